@@ -19,6 +19,26 @@ class Config:
         if cleaned.startswith('='):
             cleaned = cleaned[1:]
         return cleaned.strip()
+
+    @staticmethod
+    def _int(value: str, default: int) -> int:
+        try:
+            return int(value) if value else default
+        except ValueError:
+            return default
+
+    @staticmethod
+    def _bool(value: str, default: bool) -> bool:
+        if not value:
+            return default
+        return value.lower() in ("1", "true", "yes", "on")
+
+    @staticmethod
+    def _float(value: str, default: float) -> float:
+        try:
+            return float(value) if value else default
+        except ValueError:
+            return default
     
     # Статические переменные
     TELEGRAM_TOKEN: str = _clean.__func__(os.getenv("TELEGRAM_TOKEN", ""))
@@ -27,6 +47,117 @@ class Config:
     YOOKASSA_SECRET_KEY: str = _clean.__func__(os.getenv("YOOKASSA_SECRET_KEY", "TEST:142244"))
     LOG_LEVEL: str = _clean.__func__(os.getenv("LOG_LEVEL", "INFO"))
     LOG_FILE: str = _clean.__func__(os.getenv("LOG_FILE", ""))
+    # Формат (json | text), обрезка полей, очередь и сэмплирование логов (их читает utils/logger)
+    LOG_FORMAT: str = _clean.__func__(os.getenv("LOG_FORMAT", "json"))
+    LOG_MAX_FIELD_CHARS: int = _int.__func__(_clean.__func__(os.getenv("LOG_MAX_FIELD_CHARS")), 500)
+    LOG_QUEUE_SIZE: int = _int.__func__(_clean.__func__(os.getenv("LOG_QUEUE_SIZE")), 10_000)
+    LOG_SAMPLE_BURST: int = _int.__func__(_clean.__func__(os.getenv("LOG_SAMPLE_BURST")), 20)
+    LOG_SAMPLE_INTERVAL: float = _float.__func__(_clean.__func__(os.getenv("LOG_SAMPLE_INTERVAL")), 1.0)
+
+    # HTTP-клиент Perplexity (общий пул соединений)
+    PERPLEXITY_BASE_URL: str = _clean.__func__(os.getenv("PERPLEXITY_BASE_URL", "https://api.perplexity.ai/chat/completions"))
+    HTTP_CONNECT_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("HTTP_CONNECT_TIMEOUT")), 10.0)
+    HTTP_READ_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("HTTP_READ_TIMEOUT")), 120.0)
+    DEEP_RESEARCH_READ_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("DEEP_RESEARCH_READ_TIMEOUT")), 600.0)
+    HTTP_POOL_LIMIT: int = _int.__func__(_clean.__func__(os.getenv("HTTP_POOL_LIMIT")), 100)
+    HTTP_POOL_LIMIT_PER_HOST: int = _int.__func__(_clean.__func__(os.getenv("HTTP_POOL_LIMIT_PER_HOST")), 30)
+    HTTP_DNS_CACHE_TTL: int = _int.__func__(_clean.__func__(os.getenv("HTTP_DNS_CACHE_TTL")), 300)
+    HTTP_KEEPALIVE_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("HTTP_KEEPALIVE_TIMEOUT")), 60.0)
+
+    # Планировщик запросов к Perplexity API
+    UPSTREAM_MAX_CONCURRENT: int = _int.__func__(_clean.__func__(os.getenv("UPSTREAM_MAX_CONCURRENT")), 8)
+    UPSTREAM_RPM: int = _int.__func__(_clean.__func__(os.getenv("UPSTREAM_RPM")), 50)
+    UPSTREAM_TPM: int = _int.__func__(_clean.__func__(os.getenv("UPSTREAM_TPM")), 0)
+    DEEP_RESEARCH_MAX_CONCURRENT: int = _int.__func__(_clean.__func__(os.getenv("DEEP_RESEARCH_MAX_CONCURRENT")), 2)
+
+    # Повторы, хеджирование и автомат защиты для запросов к API
+    UPSTREAM_RETRY_ATTEMPTS: int = _int.__func__(_clean.__func__(os.getenv("UPSTREAM_RETRY_ATTEMPTS")), 3)
+    UPSTREAM_RETRY_BASE_DELAY: float = _float.__func__(_clean.__func__(os.getenv("UPSTREAM_RETRY_BASE_DELAY")), 0.5)
+    UPSTREAM_RETRY_MAX_DELAY: float = _float.__func__(_clean.__func__(os.getenv("UPSTREAM_RETRY_MAX_DELAY")), 8.0)
+    HEDGE_QUANTILE: float = _float.__func__(_clean.__func__(os.getenv("HEDGE_QUANTILE")), 0.95)
+    CIRCUIT_FAILURE_THRESHOLD: int = _int.__func__(_clean.__func__(os.getenv("CIRCUIT_FAILURE_THRESHOLD")), 5)
+    CIRCUIT_RECOVERY_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("CIRCUIT_RECOVERY_TIMEOUT")), 30.0)
+
+    # Локальная база данных (SQLite)
+    DATABASE_PATH: str = _clean.__func__(os.getenv("DATABASE_PATH", "bot_database.db"))
+
+    # Хранилище пользователей (SQLite, write-back)
+    USER_STORE_PERSISTENT: bool = _bool.__func__(_clean.__func__(os.getenv("USER_STORE_PERSISTENT")), True)
+    USER_FLUSH_INTERVAL: float = _float.__func__(_clean.__func__(os.getenv("USER_FLUSH_INTERVAL")), 1.0)
+    # Резерв квоты, не завершенный за это время (обработчик завис или процесс упал), возвращается
+    QUOTA_RESERVATION_TTL: float = _float.__func__(_clean.__func__(os.getenv("QUOTA_RESERVATION_TTL")), 900.0)
+    # Многопроцессный режим: сколько ждать блокировку записи общей базы (транзакция идет в цикле событий)
+    USER_DB_BUSY_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("USER_DB_BUSY_TIMEOUT")), 0.1)
+
+    # Исходящие запросы к Telegram (лимиты на сообщения)
+    TELEGRAM_BASE_URL: str = _clean.__func__(os.getenv("TELEGRAM_BASE_URL", ""))
+    TELEGRAM_CONNECTION_POOL_SIZE: int = _int.__func__(_clean.__func__(os.getenv("TELEGRAM_CONNECTION_POOL_SIZE")), 256)
+    TELEGRAM_POOL_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("TELEGRAM_POOL_TIMEOUT")), 1.0)
+    TELEGRAM_GLOBAL_RATE: float = _float.__func__(_clean.__func__(os.getenv("TELEGRAM_GLOBAL_RATE")), 30.0)
+    TELEGRAM_CHAT_RATE: float = _float.__func__(_clean.__func__(os.getenv("TELEGRAM_CHAT_RATE")), 1.0)
+    TELEGRAM_GROUP_RATE_PER_MINUTE: float = _float.__func__(_clean.__func__(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE")), 20.0)
+    TELEGRAM_MAX_RETRIES: int = _int.__func__(_clean.__func__(os.getenv("TELEGRAM_MAX_RETRIES")), 3)
+
+    # Внешний список доменов источников (домен<TAB>категория на строку)
+    SOURCE_DOMAINS_FILE: str = _clean.__func__(os.getenv("SOURCE_DOMAINS_FILE", ""))
+
+    # Очередь задач Deep Research
+    DEEP_RESEARCH_WORKERS: int = _int.__func__(_clean.__func__(os.getenv("DEEP_RESEARCH_WORKERS")), 2)
+    JOB_LEASE_SECONDS: float = _float.__func__(_clean.__func__(os.getenv("JOB_LEASE_SECONDS")), 90.0)
+    JOB_MAX_ATTEMPTS: int = _int.__func__(_clean.__func__(os.getenv("JOB_MAX_ATTEMPTS")), 2)
+
+    # Кэш результатов проверок
+    CACHE_MAX_ENTRIES: int = _int.__func__(_clean.__func__(os.getenv("CACHE_MAX_ENTRIES")), 5000)
+    CACHE_MAX_BYTES: int = _int.__func__(_clean.__func__(os.getenv("CACHE_MAX_BYTES")), 64 * 1024 * 1024)
+    CACHE_TTL_FACT_CHECK: int = _int.__func__(_clean.__func__(os.getenv("CACHE_TTL_FACT_CHECK")), 6 * 3600)
+    CACHE_TTL_ARTICLE: int = _int.__func__(_clean.__func__(os.getenv("CACHE_TTL_ARTICLE")), 24 * 3600)
+    CACHE_TTL_TEXT: int = _int.__func__(_clean.__func__(os.getenv("CACHE_TTL_TEXT")), 6 * 3600)
+    CACHE_PERSISTENT: bool = _bool.__func__(_clean.__func__(os.getenv("CACHE_PERSISTENT")), False)
+    # Поиск перефразированных проверок фактов в кэше (то же множество значимых слов, по умолчанию выключен)
+    NEAR_DUP_ENABLED: bool = _bool.__func__(_clean.__func__(os.getenv("NEAR_DUP_ENABLED")), False)
+    NEAR_DUP_MAX_ENTRIES: int = _int.__func__(_clean.__func__(os.getenv("NEAR_DUP_MAX_ENTRIES")), 200_000)
+    # Контекст для Deep Research (последняя тема и анализ пользователя)
+    CONTEXT_MAX_BYTES: int = _int.__func__(_clean.__func__(os.getenv("CONTEXT_MAX_BYTES")), 32 * 1024 * 1024)
+    CONTEXT_TTL: int = _int.__func__(_clean.__func__(os.getenv("CONTEXT_TTL")), 24 * 3600)
+    CONTEXT_COMPRESS_MIN_BYTES: int = _int.__func__(_clean.__func__(os.getenv("CONTEXT_COMPRESS_MIN_BYTES")), 512)
+    CONTEXT_SPILL_TO_DISK: bool = _bool.__func__(_clean.__func__(os.getenv("CONTEXT_SPILL_TO_DISK")), False)
+    # Канонизация ссылок на статьи (проверка редиректов и rel=canonical по сети — опционально)
+    URL_RESOLVE_REDIRECTS: bool = _bool.__func__(_clean.__func__(os.getenv("URL_RESOLVE_REDIRECTS")), False)
+    URL_RESOLVE_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("URL_RESOLVE_TIMEOUT")), 5.0)
+    URL_RESOLVE_MAX_BYTES: int = _int.__func__(_clean.__func__(os.getenv("URL_RESOLVE_MAX_BYTES")), 256 * 1024)
+    URL_RESOLVE_CACHE_SIZE: int = _int.__func__(_clean.__func__(os.getenv("URL_RESOLVE_CACHE_SIZE")), 10_000)
+
+    # Разбор статей на утверждения и их параллельная проверка (по умолчанию выключен:
+    # до CLAIM_MAX_CLAIMS + 1 запросов к API за один списанный запрос пользователя)
+    CLAIM_PIPELINE_ENABLED: bool = _bool.__func__(_clean.__func__(os.getenv("CLAIM_PIPELINE_ENABLED")), False)
+    CLAIM_PIPELINE_MIN_CHARS: int = _int.__func__(_clean.__func__(os.getenv("CLAIM_PIPELINE_MIN_CHARS")), 500)
+    CLAIM_MAX_CLAIMS: int = _int.__func__(_clean.__func__(os.getenv("CLAIM_MAX_CLAIMS")), 6)
+    CLAIM_CONCURRENCY: int = _int.__func__(_clean.__func__(os.getenv("CLAIM_CONCURRENCY")), 6)
+
+    # Потоковая выдача ответов (правки сообщения по мере генерации)
+    STREAMING_ENABLED: bool = _bool.__func__(_clean.__func__(os.getenv("STREAMING_ENABLED")), True)
+    STREAM_EDIT_INTERVAL: float = _float.__func__(_clean.__func__(os.getenv("STREAM_EDIT_INTERVAL")), 1.5)
+
+    # Параллельная обработка апдейтов (1 — последовательный режим)
+    CONCURRENT_UPDATES: int = _int.__func__(_clean.__func__(os.getenv("CONCURRENT_UPDATES")), 32)
+
+    # Многопроцессный режим: апдейты раздаются WORKERS рабочим процессам по user_id
+    WORKERS: int = _int.__func__(_clean.__func__(os.getenv("WORKERS")), 1)
+    WORKER_INDEX: int = _int.__func__(_clean.__func__(os.getenv("WORKER_INDEX")), 0)
+    WORKER_QUEUE_SIZE: int = _int.__func__(_clean.__func__(os.getenv("WORKER_QUEUE_SIZE")), 10_000)
+    WORKER_STOP_TIMEOUT: float = _float.__func__(_clean.__func__(os.getenv("WORKER_STOP_TIMEOUT")), 30.0)
+
+    # Webhook и встроенный HTTP-сервер (/health, /live, /metrics)
+    WEBHOOK_URL: str = _clean.__func__(os.getenv("WEBHOOK_URL", ""))
+    WEBHOOK_PATH: str = _clean.__func__(os.getenv("WEBHOOK_PATH", ""))
+    WEBHOOK_SECRET: str = _clean.__func__(os.getenv("WEBHOOK_SECRET", ""))
+    # Буфер апдейтов webhook в SQLite: быстрый ответ Telegram и отбрасывание повторов по update_id
+    WEBHOOK_INBOX_ENABLED: bool = _bool.__func__(_clean.__func__(os.getenv("WEBHOOK_INBOX_ENABLED")), True)
+    WEBHOOK_DEDUP_RETENTION: int = _int.__func__(_clean.__func__(os.getenv("WEBHOOK_DEDUP_RETENTION")), 24 * 3600)
+    HTTP_SERVER_ENABLED: bool = _bool.__func__(_clean.__func__(os.getenv("HTTP_SERVER_ENABLED")), True)
+    HTTP_SERVER_HOST: str = _clean.__func__(os.getenv("HTTP_SERVER_HOST", "0.0.0.0"))
+    PORT: int = _int.__func__(_clean.__func__(os.getenv("PORT")), 8000)
+    EVENT_LOOP_LAG_INTERVAL: float = _float.__func__(_clean.__func__(os.getenv("EVENT_LOOP_LAG_INTERVAL")), 0.5)
 
     @classmethod
     def validate(cls) -> bool:
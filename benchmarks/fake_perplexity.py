@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Локальный фейковый Perplexity API с внедрением сбоев.
+
+Запуск:
+    python -m benchmarks.fake_perplexity --port 8081 --error-rate 0.2 --reset-rate 0.05
+    PERPLEXITY_BASE_URL=http://127.0.0.1:8081/chat/completions python main.py
+
+Параметры сбоев можно менять на лету: POST /_faults с JSON вида {"error_rate": 0.5}.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from aiohttp import web
+
+
+@dataclass
+class FaultConfig:
+    """Параметры задержек и сбоев фейкового API"""
+    latency: float = 0.2            # базовая задержка ответа (медиана для lognormal), с
+    jitter: float = 0.1             # случайная добавка к задержке (uniform), с
+    latency_distribution: str = "uniform"  # uniform | lognormal | exponential
+    latency_sigma: float = 0.5      # разброс lognormal
+    deep_latency: float = 0.0       # базовая задержка для моделей deep research (0 — как latency)
+    error_rate: float = 0.0         # доля ответов 503
+    rate_limit_rate: float = 0.0    # доля ответов 429
+    hang_rate: float = 0.0          # доля запросов, которые «зависают» на hang_seconds
+    hang_seconds: float = 300.0
+    reset_rate: float = 0.0         # доля обрывов соединения без ответа
+    response_chars: int = 1500      # длина ответа
+    stream_chunk_chars: int = 40    # длина фрагмента при потоковой выдаче
+
+
+class FakePerplexityServer:
+    """Фейковый chat/completions: обычные и потоковые (SSE) ответы, сбои по вероятностям"""
+
+    def __init__(self, faults: Optional[FaultConfig] = None, host: str = "127.0.0.1", port: int = 8081) -> None:
+        self.faults = faults or FaultConfig()
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.status_counts: dict = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/chat/completions"
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/chat/completions", self.chat_completions)
+        app.router.add_post("/_faults", self.update_faults)
+        app.router.add_get("/_stats", self.stats)
+        return app
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _count(self, status: int) -> None:
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def _delay(self, model: str = "") -> float:
+        f = self.faults
+        base = f.deep_latency if f.deep_latency and "deep" in model else f.latency
+        if f.latency_distribution == "lognormal":
+            return base * random.lognormvariate(0.0, f.latency_sigma)
+        if f.latency_distribution == "exponential":
+            return random.expovariate(1.0 / base) if base > 0 else 0.0
+        return max(0.0, base + random.uniform(0, f.jitter))
+
+    def _answer(self, payload: dict) -> str:
+        prompt = str(payload.get("messages", [{}])[-1].get("content", ""))[:80]
+        sentence = f"Проверка утверждения «{prompt}»: [Источник](https://example.org/{self.requests}). "
+        repeats = self.faults.response_chars // len(sentence) + 1
+        return (sentence * repeats)[: self.faults.response_chars]
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        payload = await request.json()
+        f = self.faults
+        roll = random.random()
+
+        if roll < f.reset_rate:
+            self._count(0)
+            request.transport.close()
+            raise web.HTTPServiceUnavailable()
+        roll -= f.reset_rate
+        if roll < f.hang_rate:
+            await asyncio.sleep(f.hang_seconds)
+        roll -= f.hang_rate
+
+        model = str(payload.get("model", ""))
+        await asyncio.sleep(self._delay(model))
+        if roll < f.error_rate:
+            self._count(503)
+            return web.Response(status=503, text="upstream unavailable")
+        roll -= f.error_rate
+        if roll < f.rate_limit_rate:
+            self._count(429)
+            return web.Response(status=429, text="rate limited", headers={"Retry-After": "1"})
+
+        answer = self._answer(payload)
+        usage = {"prompt_tokens": 100, "completion_tokens": len(answer) // 4, "total_tokens": 100 + len(answer) // 4}
+        self._count(200)
+        if not payload.get("stream"):
+            return web.json_response({
+                "model": payload.get("model"),
+                "choices": [{"message": {"role": "assistant", "content": answer}}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        step = max(1, f.stream_chunk_chars)
+        chunks = [answer[i:i + step] for i in range(0, len(answer), step)]
+        pause = self._delay(model) / max(1, len(chunks))
+        for i, chunk in enumerate(chunks):
+            event = {"model": payload.get("model"), "choices": [{"delta": {"content": chunk}}]}
+            if i == len(chunks) - 1:
+                event["usage"] = usage
+            await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(pause)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def update_faults(self, request: web.Request) -> web.Response:
+        for key, value in (await request.json()).items():
+            if hasattr(self.faults, key):
+                setattr(self.faults, key, type(getattr(self.faults, key))(value))
+        return web.json_response(asdict(self.faults))
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "statuses": self.status_counts})
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Фейковый Perplexity API с внедрением сбоев")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    for name, value in asdict(FaultConfig()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    faults = FaultConfig(**{name: getattr(args, name) for name in asdict(FaultConfig())})
+    server = FakePerplexityServer(faults, args.host, args.port)
+    print(f"Fake Perplexity API: {server.base_url}")
+    web.run_app(server.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
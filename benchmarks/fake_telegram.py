@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Локальный фейковый Telegram Bot API для нагрузочных тестов.
+
+Запуск:
+    python -m benchmarks.fake_telegram --port 8082 --latency 0.05
+    TELEGRAM_BASE_URL=http://127.0.0.1:8082/bot python main.py
+
+Отвечает на методы отправки и правки сообщений правдоподобными объектами,
+может с заданной вероятностью возвращать 429 (flood control). GET /_stats —
+число вызовов по методам и статусам.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+BOT_USER = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "FactChecker",
+    "username": "fake_fact_checker_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+@dataclass
+class TelegramFaults:
+    """Задержки и сбои фейкового Bot API"""
+    latency: float = 0.03           # базовая задержка ответа, с
+    jitter: float = 0.02            # случайная добавка к задержке, с
+    flood_rate: float = 0.0         # доля ответов 429 на отправку и правку
+    retry_after: int = 1            # retry_after в ответе 429, с
+
+
+class FakeTelegramServer:
+    """Фейковые методы Bot API: getMe, send*/edit*/delete*, answerCallbackQuery и т.п."""
+
+    def __init__(self, faults: Optional[TelegramFaults] = None, host: str = "127.0.0.1", port: int = 8082) -> None:
+        self.faults = faults or TelegramFaults()
+        self.host = host
+        self.port = port
+        self.calls: Dict[str, int] = {}
+        self.status_counts: Dict[int, int] = {}
+        self._message_id = 1000
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_faults", self.update_faults)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            # Сложные параметры PTB передает строкой JSON
+            try:
+                params[key] = json.loads(value) if isinstance(value, str) else value
+            except ValueError:
+                params[key] = value
+        return params
+
+    def _message(self, params: Dict[str, Any], message_id: Optional[int] = None) -> Dict[str, Any]:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = int(params.get("chat_id", 0))
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+            "text": str(params.get("text", params.get("caption", ""))),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method.startswith("send") or method in ("copyMessage", "forwardMessage"):
+            return self._message(params)
+        if method.startswith("edit"):
+            return self._message(params, int(params.get("message_id", 0)))
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = await self._params(request)
+        f = self.faults
+        await asyncio.sleep(max(0.0, f.latency + random.uniform(0, f.jitter)))
+
+        limited = method.startswith(("send", "edit", "copy", "forward"))
+        if limited and random.random() < f.flood_rate:
+            self.status_counts[429] = self.status_counts.get(429, 0) + 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {f.retry_after}",
+                "parameters": {"retry_after": f.retry_after},
+            })
+        self.status_counts[200] = self.status_counts.get(200, 0) + 1
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def update_faults(self, request: web.Request) -> web.Response:
+        for key, value in (await request.json()).items():
+            if hasattr(self.faults, key):
+                setattr(self.faults, key, type(getattr(self.faults, key))(value))
+        return web.json_response(asdict(self.faults))
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": self.calls, "statuses": self.status_counts})
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    for name, value in asdict(TelegramFaults()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    faults = TelegramFaults(**{name: getattr(args, name) for name in asdict(TelegramFaults())})
+    server = FakeTelegramServer(faults, args.host, args.port)
+    print(f"Fake Telegram Bot API: {server.base_url}")
+    web.run_app(server.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота целиком: обработчики TelegramFactCheckerBot получают
+синтетические апдейты, Perplexity и Telegram Bot API заменены локальными фейками
+(запускаются в отдельном процессе, чтобы не искажать задержки цикла событий).
+
+Примеры:
+    python -m benchmarks.load_test --scenario fact_check --users 10000
+    python -m benchmarks.load_test --scenario mixed --users 2000 --deep-share 0.1 \\
+        --pplx-latency-distribution lognormal --pplx-deep-latency 5
+    python -m benchmarks.load_test --scenario fact_check --users 500 --real-telegram-limits
+
+Отчет: пропускная способность, p50/p95/p99 задержки обработчиков, задержка
+цикла событий, прирост RSS на пользователя, счетчики вызовов фейков.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+from urllib.request import urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fake_perplexity import FakePerplexityServer, FaultConfig  # noqa: E402
+from benchmarks.fake_telegram import BOT_USER, FakeTelegramServer, TelegramFaults  # noqa: E402
+
+
+# --- Фейки в отдельном процессе ---
+
+def _serve_fakes(pplx_faults: FaultConfig, tg_faults: TelegramFaults, pplx_port: int, tg_port: int) -> None:
+    # Отмененные клиентом запросы (хеджирование, таймауты) — ожидаемая часть нагрузки
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+
+    async def serve() -> None:
+        pplx = FakePerplexityServer(pplx_faults, port=pplx_port)
+        telegram = FakeTelegramServer(tg_faults, port=tg_port)
+        await pplx.start()
+        await telegram.start()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def _wait_for_port(url: str, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _fetch_json(url: str) -> Dict:
+    return json.loads(urlopen(url, timeout=5).read())
+
+
+# --- Метрики ---
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def describe(samples: List[float]) -> str:
+    if not samples:
+        return "нет данных"
+    return (
+        f"n={len(samples)} p50={percentile(samples, 0.5) * 1000:.0f}ms "
+        f"p95={percentile(samples, 0.95) * 1000:.0f}ms p99={percentile(samples, 0.99) * 1000:.0f}ms "
+        f"max={max(samples) * 1000:.0f}ms"
+    )
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class LoopLagMonitor:
+    """Измеряет опоздание пробуждений цикла событий относительно заданного интервала"""
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+# --- Синтетические апдейты ---
+
+class UpdateFactory:
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self._update_id = 0
+        self._message_id = 0
+
+    def _ids(self) -> int:
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+    def text(self, user_id: int, text: str):
+        from telegram import Update
+        update_id = self._ids()
+        return Update.de_json({
+            "update_id": update_id,
+            "message": {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }, self.bot)
+
+    def callback(self, user_id: int, data: str, message_id: int = 1):
+        from telegram import Update
+        update_id = self._ids()
+        return Update.de_json({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "menu",
+                },
+            },
+        }, self.bot)
+
+
+# --- Сценарии ---
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors = 0
+        self.deep_latencies: List[float] = []
+        self._deep_submitted: Dict[int, float] = {}
+        self._deep_done = asyncio.Event()
+        self._deep_expected = 0
+
+    async def _process(self, kind: str, update) -> None:
+        application = self.bot.application
+        started = time.perf_counter()
+        try:
+            await application.update_processor.process_update(update, application.process_update(update))
+        except Exception:
+            self.errors += 1
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - started)
+
+    async def _user_session(self, user_id: int, deep: bool) -> None:
+        claim_id = user_id % self.args.distinct_claims if self.args.distinct_claims else user_id
+        await self._process("callback", self.updates.callback(user_id, "check_fact"))
+        await self._process("fact_check", self.updates.text(user_id, f"Утверждение номер {claim_id}: вода кипит при 100 °C"))
+        if deep:
+            await self._process("callback", self.updates.callback(user_id, "deep_research"))
+            self._deep_submitted[user_id] = time.perf_counter()
+            await self._process("deep_research_submit", self.updates.callback(user_id, "confirm_deep_research"))
+
+    def _wrap_delivery(self) -> None:
+        job_queue = self.bot.job_queue
+        deliver = job_queue.deliver
+
+        async def timed_deliver(job) -> None:
+            await deliver(job)
+            started = self._deep_submitted.pop(job.user_id, None)
+            if started is not None:
+                self.deep_latencies.append(time.perf_counter() - started)
+            if len(self.deep_latencies) >= self._deep_expected:
+                self._deep_done.set()
+
+        job_queue.deliver = timed_deliver
+
+    async def run(self) -> None:
+        from main import TelegramFactCheckerBot
+
+        args = self.args
+        self.bot = TelegramFactCheckerBot()
+        application = self.bot.application
+        await application.initialize()
+        await self.bot._on_startup(application)
+        self.updates = UpdateFactory(application.bot)
+        self._wrap_delivery()
+
+        rng = random.Random(args.seed)
+        deep_users = {u for u in range(1, args.users + 1) if args.scenario == "mixed" and rng.random() < args.deep_share}
+        self._deep_expected = len(deep_users)
+        if not deep_users:
+            self._deep_done.set()
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+
+        sessions = []
+        for user_id in range(1, args.users + 1):
+            sessions.append(asyncio.create_task(self._user_session(1_000_000 + user_id, user_id in deep_users)))
+            if args.arrival_rate > 0:
+                await asyncio.sleep(1.0 / args.arrival_rate)
+        await asyncio.gather(*sessions)
+        handlers_elapsed = time.perf_counter() - started
+        rss_peak = rss_bytes()
+        try:
+            await asyncio.wait_for(self._deep_done.wait(), timeout=args.deep_timeout)
+        except asyncio.TimeoutError:
+            print(f"Не дождались {self._deep_expected - len(self.deep_latencies)} задач Deep Research")
+        total_elapsed = time.perf_counter() - started
+
+        await monitor.stop()
+        self.report(handlers_elapsed, total_elapsed, rss_before, rss_peak, monitor.samples)
+        await self.bot._on_shutdown(application)
+        await application.shutdown()
+
+    def report(self, handlers_elapsed: float, total_elapsed: float, rss_before: int, rss_peak: int,
+               lag: List[float]) -> None:
+        args = self.args
+        updates = sum(len(v) for v in self.latencies.values())
+        print(f"\n=== Сценарий {args.scenario}: {args.users} пользователей ===")
+        print(f"Обработчики: {handlers_elapsed:.1f} с, {updates} апдейтов, {updates / handlers_elapsed:.0f} апд/с, "
+              f"{args.users / handlers_elapsed:.1f} польз/с, ошибок {self.errors}")
+        for kind, samples in sorted(self.latencies.items()):
+            print(f"  {kind:22s} {describe(samples)}")
+        if self.deep_latencies or self._deep_expected:
+            print(f"  {'deep_research (e2e)':22s} {describe(self.deep_latencies)}  (всего {total_elapsed:.1f} с)")
+        print(f"Задержка цикла событий: {describe(lag)}")
+        print(f"RSS: {rss_before / 2**20:.0f} → {rss_peak / 2**20:.0f} МБ, "
+              f"{(rss_peak - rss_before) / max(1, args.users) / 1024:.1f} КБ на пользователя")
+        scheduler = self.bot.upstream_scheduler.stats()
+        print(f"Планировщик API: {json.dumps(scheduler['by_priority'], ensure_ascii=False)}")
+        print(f"Кэш результатов: {self.bot.result_cache.stats()}")
+        print(f"Исходящие в Telegram: {self.bot.telegram_rate_limiter.stats()}")
+        print(f"Фейк Perplexity: {_fetch_json(f'http://127.0.0.1:{args.pplx_port}/_stats')}")
+        print(f"Фейк Telegram: {_fetch_json(f'http://127.0.0.1:{args.tg_port}/_stats')}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальными фейками")
+    parser.add_argument("--scenario", choices=("fact_check", "mixed"), default="fact_check")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--arrival-rate", type=float, default=0.0, help="новых пользователей в секунду (0 — все сразу)")
+    parser.add_argument("--deep-share", type=float, default=0.05, help="доля пользователей с Deep Research (mixed)")
+    parser.add_argument("--deep-timeout", type=float, default=600.0)
+    parser.add_argument("--distinct-claims", type=int, default=0, help="число разных утверждений (0 — у каждого свое)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pplx-port", type=int, default=18081)
+    parser.add_argument("--tg-port", type=int, default=18082)
+    parser.add_argument("--real-telegram-limits", action="store_true",
+                        help="оставить лимиты Telegram по умолчанию (30 сообщений/с)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределить настройку бота")
+    for name, value in FaultConfig().__dict__.items():
+        parser.add_argument(f"--pplx-{name.replace('_', '-')}", type=type(value), default=value)
+    for name, value in TelegramFaults().__dict__.items():
+        parser.add_argument(f"--tg-{name.replace('_', '-')}", type=type(value), default=value)
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace, workdir: str) -> None:
+    env = {
+        "TELEGRAM_TOKEN": "123456:BENCHMARK",
+        "PERPLEXITY_API_KEY": "benchmark",
+        "PERPLEXITY_BASE_URL": f"http://127.0.0.1:{args.pplx_port}/chat/completions",
+        "TELEGRAM_BASE_URL": f"http://127.0.0.1:{args.tg_port}/bot",
+        "DATABASE_PATH": os.path.join(workdir, "bench.db"),
+        "LOG_LEVEL": "WARNING",
+        "CONCURRENT_UPDATES": "256",
+        "UPSTREAM_MAX_CONCURRENT": "256",
+        "UPSTREAM_RPM": "0",
+        "HTTP_POOL_LIMIT": "512",
+        "HTTP_POOL_LIMIT_PER_HOST": "512",
+        "TELEGRAM_CONNECTION_POOL_SIZE": "512",
+        "TELEGRAM_POOL_TIMEOUT": "30",
+        "PORT": "8090",  # /health и /metrics бота во время теста
+    }
+    if not args.real_telegram_limits:
+        env.update({"TELEGRAM_GLOBAL_RATE": "100000", "TELEGRAM_CHAT_RATE": "1000"})
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    os.environ.update(env)
+
+
+def main() -> None:
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    configure_environment(args, workdir)
+
+    pplx_faults = FaultConfig(**{name: getattr(args, f"pplx_{name}") for name in FaultConfig().__dict__})
+    tg_faults = TelegramFaults(**{name: getattr(args, f"tg_{name}") for name in TelegramFaults().__dict__})
+    fakes = multiprocessing.Process(
+        target=_serve_fakes, args=(pplx_faults, tg_faults, args.pplx_port, args.tg_port), daemon=True
+    )
+    fakes.start()
+    try:
+        _wait_for_port(f"http://127.0.0.1:{args.pplx_port}/_stats")
+        _wait_for_port(f"http://127.0.0.1:{args.tg_port}/_stats")
+        asyncio.run(LoadTest(args).run())
+    finally:
+        fakes.terminate()
+        fakes.join()
+
+
+if __name__ == "__main__":
+    main()
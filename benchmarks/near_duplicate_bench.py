@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк индекса перефразированных утверждений.
+
+Индекс заполняется синтетическими утверждениями, затем измеряются задержка
+поиска перефразировок и несвязанных запросов, доля найденных перефразировок
+и прирост памяти на запись. Отдельно проверяются минимальные пары: то же
+утверждение с одним замененным значимым словом (глагол, субъект или объект,
+например «одобрил» → «запретил») — совпадение с ним считается ложным.
+
+Примеры:
+    python -m benchmarks.near_duplicate_bench --entries 100000
+    python -m benchmarks.near_duplicate_bench --entries 1000000 --queries 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from services.near_duplicate_index import NearDuplicateIndex  # noqa: E402
+
+_SUBJECTS = ["Москва", "Министерство финансов", "Центробанк", "Илон Маск", "ВОЗ", "Росстат", "NASA", "Госдума",
+             "компания Яндекс", "Евросоюз", "Сбербанк", "Минздрав", "Китай", "Газпром", "МВФ", "ООН"]
+_VERBS = ["объявил о", "сообщил о", "опроверг", "подтвердил", "запретил", "одобрил", "профинансировал",
+          "начал", "отменил", "перенес"]
+_OBJECTS = ["повышении ставки", "строительстве моста", "запуске спутника", "росте инфляции", "новых санкциях",
+            "выпуске облигаций", "закрытии заводов", "программе вакцинации", "реформе пенсий", "снижении налогов"]
+_PREFIXES = ["Правда ли, что", "Говорят, что", "Верно ли, что", "Слышал, что", "Это правда, что"]
+
+
+def make_claim(rng: random.Random) -> str:
+    return format_claim(
+        rng.choice(_SUBJECTS), rng.choice(_VERBS), rng.choice(_OBJECTS),
+        rng.randint(1, 999), rng.randint(1990, 2030), rng.randint(1, 100_000),
+    )
+
+
+def format_claim(subject: str, verb: str, obj: str, amount: int, year: int, city: int) -> str:
+    return f"{subject} {verb} {obj} на {amount} млрд рублей в {year} году в городе {city}"
+
+
+def minimal_pair(rng: random.Random, parts: tuple) -> str:
+    """То же утверждение с одним другим значимым словом или фразой"""
+    parts = list(parts)
+    position = rng.randrange(3)
+    choices = (_SUBJECTS, _VERBS, _OBJECTS)[position]
+    parts[position] = rng.choice([choice for choice in choices if choice != parts[position]])
+    return format_claim(*parts)
+
+
+def rephrase(rng: random.Random, claim: str) -> str:
+    text = claim.replace("ё", "е").lower()
+    return f"{rng.choice(_PREFIXES)} {text}?"
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    index = NearDuplicateIndex(max_entries=args.entries)
+    parts = [
+        (rng.choice(_SUBJECTS), rng.choice(_VERBS), rng.choice(_OBJECTS),
+         rng.randint(1, 999), rng.randint(1990, 2030), rng.randint(1, 100_000))
+        for _ in range(args.entries)
+    ]
+    claims = [format_claim(*claim_parts) for claim_parts in parts]
+    fingerprints = [index.fingerprint(claim) for claim in claims]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for number, (claim, fingerprint) in enumerate(zip(claims, fingerprints)):
+        index.add(claim, f"fact_check:{number}", fingerprint)
+    insert_seconds = time.perf_counter() - started
+    index_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    sample = rng.sample(range(args.entries), min(args.queries, args.entries))
+    found, latencies = 0, []
+    for number in sample:
+        query = rephrase(rng, claims[number])
+        started = time.perf_counter()
+        key = index.get(query)
+        latencies.append(time.perf_counter() - started)
+        found += key == f"fact_check:{number}"
+
+    false_matches, unrelated = 0, []
+    for _ in range(len(sample)):
+        query = make_claim(rng)
+        started = time.perf_counter()
+        key = index.get(query)
+        unrelated.append(time.perf_counter() - started)
+        false_matches += key is not None
+
+    pair_matches, pairs = 0, []
+    for number in sample:
+        query = minimal_pair(rng, parts[number])
+        started = time.perf_counter()
+        key = index.get(query)
+        pairs.append(time.perf_counter() - started)
+        pair_matches += key == f"fact_check:{number}"
+
+    print(f"Записей в индексе:          {len(index)}")
+    print(f"Вставка:                    {insert_seconds / args.entries * 1e6:.1f} мкс/запись")
+    print(f"Память индекса:             {index_bytes / 2**20:.1f} МиБ ({index_bytes / args.entries:.0f} байт/запись, "
+          f"включая строки ключей)")
+    print(f"Перефразировки: найдено     {found / len(sample):.1%}, p50 {percentile(latencies, 0.5) * 1e3:.3f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1e3:.3f} мс")
+    print(f"Несвязанные запросы:        ложных совпадений {false_matches / len(sample):.2%}, "
+          f"p50 {percentile(unrelated, 0.5) * 1e3:.3f} мс, p99 {percentile(unrelated, 0.99) * 1e3:.3f} мс")
+    print(f"Минимальные пары:           ложных совпадений {pair_matches / len(sample):.2%}, "
+          f"p50 {percentile(pairs, 0.5) * 1e3:.3f} мс, p99 {percentile(pairs, 0.99) * 1e3:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк резервирования квоты (UserService.reserve/commit/refund) под конкуренцией.
+
+1. Один процесс: много одновременных задач одного пользователя с ``await``
+   между проверкой лимита и списанием — прежняя схема (check_daily_limit +
+   make_request после ответа) против резерва.
+2. Несколько процессов с общей базой (общий режим): задачи всех процессов
+   разбирают квоту одних и тех же пользователей, часть запросов «падает»
+   (refund), часть резервов брошена (процесс завершился без commit/refund) и
+   возвращается по сроку. В конце счетчики в базе сверяются с подтвержденными
+   списаниями: лимит не превышен, баланс сходится.
+
+Примеры:
+    python -m benchmarks.quota_contention_bench
+    python -m benchmarks.quota_contention_bench --processes 4 --tasks 200 --users 5 --limit 100
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Dict, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from services.user_service import UserService  # noqa: E402
+
+
+async def _in_process(tasks: int, limit: int, reserve: bool) -> Tuple[int, int]:
+    """Одновременные запросы одного пользователя: (допущено, засчитано в дневной лимит)"""
+    service = UserService()
+    service.register_user(1, "bench")
+    service.get_user_stats(1)["daily_limit"] = limit
+    admitted = 0
+
+    async def request() -> None:
+        nonlocal admitted
+        if reserve:
+            reservation = service.reserve(1)
+            if reservation is None:
+                return
+            admitted += 1
+            await asyncio.sleep(random.uniform(0, 0.01))  # запрос к API
+            service.commit(reservation)
+        else:
+            if not service.check_daily_limit(1):
+                return
+            admitted += 1
+            await asyncio.sleep(random.uniform(0, 0.01))
+            service.make_request(1)
+
+    await asyncio.gather(*(request() for _ in range(tasks)))
+    return admitted, service.get_user_stats(1)["daily_requests"]
+
+
+def _worker(db_path: str, users: int, tasks: int, fail_rate: float, abandon_rate: float,
+            seed: int, results: "multiprocessing.Queue") -> None:
+    """Процесс-участник: возвращает подтвержденные списания по пользователям"""
+    logging.disable(logging.WARNING)
+    rng = random.Random(seed)
+    committed: Dict[int, Tuple[int, int]] = {}
+    counts = {"reserved": 0, "refused": 0, "busy": 0, "refunded": 0, "abandoned": 0}
+
+    async def run() -> float:
+        service = UserService(db_path, shared=True)
+
+        async def request(user_id: int) -> None:
+            abandon = rng.random() < abandon_rate
+            try:
+                reservation = service.reserve(user_id, ttl=0.5 if abandon else None)
+            except sqlite3.OperationalError:
+                # База занята дольше busy_timeout — бот попросил бы повторить запрос
+                counts["busy"] += 1
+                return
+            if reservation is None:
+                counts["refused"] += 1
+                return
+            counts["reserved"] += 1
+            await asyncio.sleep(rng.uniform(0, 0.005))
+            if abandon:
+                # Процесс «упал» посреди запроса: резерв не завершен
+                service._reservations.pop(reservation.id)
+                counts["abandoned"] += 1
+            elif rng.random() < fail_rate:
+                service.refund(reservation)
+                counts["refunded"] += 1
+            elif service.commit(reservation):
+                n, amount = committed.get(user_id, (0, 0))
+                committed[user_id] = (n + 1, amount + reservation.amount)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request(rng.randrange(users) + 1) for _ in range(tasks)))
+        elapsed = time.perf_counter() - started
+        # Отложенные из-за занятой базы списания обычно завершает цикл сброса
+        while service._deferred_commits:
+            service._retry_deferred_commits()
+        # Без close: брошенные резервы должен вернуть другой процесс
+        service._db.close()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    results.put((committed, counts, elapsed))
+
+
+def _multi_process(args) -> bool:
+    db_path = os.path.join(tempfile.mkdtemp(prefix="quota-bench-"), "users.db")
+    setup = UserService(db_path)
+    for user_id in range(1, args.users + 1):
+        setup.register_user(user_id, f"user{user_id}")
+        user = setup.get_user_stats(user_id)
+        user["daily_limit"] = args.limit
+        user["balance"] = args.balance
+    asyncio.run(setup.close())
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(target=_worker, args=(db_path, args.users, args.tasks, args.fail_rate,
+                                              args.abandon_rate, args.seed + i, results))
+        for i in range(args.processes)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    wall = time.perf_counter() - started
+
+    # Брошенные резервы возвращает любой живой процесс
+    time.sleep(0.6)
+    sweeper = UserService(db_path, shared=True)
+    returned = sweeper.expire_reservations()
+    asyncio.run(sweeper.close())
+
+    committed: Dict[int, Tuple[int, int]] = {}
+    totals = {"reserved": 0, "refused": 0, "busy": 0, "refunded": 0, "abandoned": 0}
+    for process_committed, counts, _ in outcomes:
+        for user_id, (n, amount) in process_committed.items():
+            prev = committed.get(user_id, (0, 0))
+            committed[user_id] = (prev[0] + n, prev[1] + amount)
+        for name, value in counts.items():
+            totals[name] += value
+
+    db = sqlite3.connect(db_path)
+    rows = db.execute("SELECT user_id, daily_requests, total_requests, balance FROM users").fetchall()
+    left = db.execute("SELECT COUNT(*) FROM quota_reservations").fetchone()[0]
+    db.close()
+
+    ok = left == 0 and returned == totals["abandoned"]
+    over_limit = 0
+    for user_id, daily, total, balance in rows:
+        n, amount = committed.get(user_id, (0, 0))
+        if daily != n or total != n or balance != args.balance - amount:
+            ok = False
+            print(f"  расхождение у пользователя {user_id}: daily={daily} total={total} balance={balance}, "
+                  f"подтверждено {n} (баланс {amount})")
+        over_limit += max(0, daily - args.limit)
+
+    requests = args.processes * args.tasks
+    print(f"Процессов {args.processes} × задач {args.tasks}, пользователей {args.users}, лимит {args.limit}")
+    print(f"  резервов {totals['reserved']}, отказов {totals['refused']}, база занята {totals['busy']}, "
+          f"возвратов {totals['refunded']}, "
+          f"брошено {totals['abandoned']} (возвращено по сроку {returned})")
+    print(f"  подтверждено {sum(n for n, _ in committed.values())} "
+          f"(максимум {args.users * args.limit}), превышений лимита {over_limit}")
+    print(f"  {requests / wall:.0f} запросов/с с учетом запуска процессов; "
+          f"внутри процессов {sum(requests / args.processes / e for _, _, e in outcomes):.0f} запросов/с")
+    print(f"  итог: {'счетчики сходятся' if ok else 'РАСХОЖДЕНИЕ'}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--tasks", type=int, default=300, help="одновременных запросов в каждом процессе")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=100, help="дневной лимит каждого пользователя")
+    parser.add_argument("--balance", type=int, default=50)
+    parser.add_argument("--fail-rate", type=float, default=0.2)
+    parser.add_argument("--abandon-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # Возвраты брошенных резервов ожидаемы и в выводе не нужны
+    logging.disable(logging.WARNING)
+    random.seed(args.seed)
+    tasks = args.processes * args.tasks
+    limit = args.limit
+    for name, reserve in (("check + make_request", False), ("reserve + commit", True)):
+        admitted, counted = asyncio.run(_in_process(tasks, limit, reserve))
+        print(f"Один процесс, {name}: {tasks} одновременных запросов, лимит {limit} — "
+              f"допущено {admitted}, засчитано {counted}")
+
+    ok = _multi_process(args)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
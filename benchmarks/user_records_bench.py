@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк записей пользователей в памяти: прежние словари против UserRecord.
+
+Прежний вид записи — словарь из семи ключей с объектом ``date``, и каждое
+обращение вызывает ``date.today()`` дважды. Сейчас запись — ``UserRecord``
+со ``__slots__`` и номером дня, а текущий день берется из ``DayClock``.
+Измеряются память на пользователя (tracemalloc) и пропускная способность
+горячего пути: чтение статистики, проверка лимита, резерв и списание запроса.
+
+Примеры:
+    python -m benchmarks.user_records_bench
+    python -m benchmarks.user_records_bench --users 1000000 --ops 2000000
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date
+from typing import Callable, Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from services.user_service import UserService  # noqa: E402
+
+
+class DictUserStore:
+    """Прежняя раскладка UserService: словарь на пользователя, date.today() на каждое обращение"""
+
+    def __init__(self) -> None:
+        self.users: Dict[int, Dict] = {}
+
+    def register_user(self, user_id: int, username: str) -> None:
+        if user_id not in self.users:
+            self.users[user_id] = {
+                "username": username,
+                "daily_requests": 0,
+                "daily_limit": 3,
+                "last_reset": date.today(),
+                "total_requests": 0,
+                "balance": 0,
+                "deep_research_used": False,
+            }
+
+    def _get(self, user_id: int) -> Dict:
+        user = self.users.get(user_id)
+        if user is None:
+            self.register_user(user_id, "Unknown")
+            user = self.users[user_id]
+        self._reset_if_needed(user_id)
+        return user
+
+    def _reset_if_needed(self, user_id: int) -> None:
+        user = self.users[user_id]
+        if user["last_reset"] != date.today():
+            user["daily_requests"] = 0
+            user["last_reset"] = date.today()
+
+    def get_user_stats(self, user_id: int) -> Dict:
+        return self._get(user_id)
+
+    def check_daily_limit(self, user_id: int) -> bool:
+        u = self._get(user_id)
+        return u["daily_requests"] < u["daily_limit"]
+
+    def make_request(self, user_id: int, cost: int = 1) -> None:
+        u = self._get(user_id)
+        u["daily_requests"] += 1
+        u["total_requests"] += 1
+        u["balance"] = max(0, u["balance"] - cost)
+
+
+def measure_memory(factory: Callable, users: int) -> float:
+    """Прирост памяти на одного зарегистрированного пользователя, байт"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = factory()
+    for user_id in range(users):
+        store.register_user(user_id, f"user{user_id}")
+    # Очередь записи в базу после сброса пуста
+    getattr(store, "_dirty", set()).clear()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del store
+    return used / users
+
+
+def measure_ops(name: str, store, user_ids, op: Callable) -> float:
+    started = time.perf_counter()
+    for user_id in user_ids:
+        op(store, user_id)
+    elapsed = time.perf_counter() - started
+    rate = len(user_ids) / elapsed
+    print(f"  {name:<34} {rate / 1e6:6.2f} млн опер./с ({elapsed / len(user_ids) * 1e9:5.0f} нс)")
+    return rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--ops", type=int, default=500_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"Память на пользователя ({args.users} пользователей, включая ключ и имя):")
+    dict_bytes = measure_memory(DictUserStore, args.users)
+    slot_bytes = measure_memory(UserService, args.users)
+    print(f"  словарь + date:  {dict_bytes:6.0f} байт")
+    print(f"  UserRecord:      {slot_bytes:6.0f} байт ({dict_bytes / slot_bytes:.1f}× меньше)")
+
+    rng = random.Random(args.seed)
+    user_ids = [rng.randrange(args.users) for _ in range(args.ops)]
+    operations = {
+        "get_user_stats()['balance']": lambda s, u: s.get_user_stats(u)["balance"],
+        "check_daily_limit": lambda s, u: s.check_daily_limit(u),
+        "make_request": lambda s, u: s.make_request(u, cost=0),
+    }
+    stores = {"словарь + date": DictUserStore(), "UserRecord": UserService()}
+    for store in stores.values():
+        for user_id in range(args.users):
+            store.register_user(user_id, f"user{user_id}")
+        # Лимит не должен мешать списаниям в замере
+        for user in store.users.values():
+            user["daily_limit"] = args.ops
+
+    rates: Dict[str, Dict[str, float]] = {}
+    for store_name, store in stores.items():
+        print(f"Пропускная способность, {store_name}:")
+        rates[store_name] = {name: measure_ops(name, store, user_ids, op) for name, op in operations.items()}
+        if isinstance(store, UserService):
+            def reserve_commit(s, u):
+                s.commit(s.reserve(u))
+            measure_ops("reserve + commit", store, user_ids, reserve_commit)
+
+    print("Ускорение:")
+    for name in operations:
+        print(f"  {name:<34} {rates['UserRecord'][name] / rates['словарь + date'][name]:.2f}×")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Пакетная проверка утверждений и статей из JSONL без Telegram.
+
+Каждая строка входного файла — JSON-объект с полем "claim" (проверка
+утверждения), "url" (анализ статьи по ссылке) или "text" (анализ текста) и
+необязательным "id"; допускается и просто JSON-строка с утверждением.
+Результаты дописываются в выходной JSONL по мере готовности (порядок строк
+может отличаться от входного, поле "line" — номер входной строки).
+
+Примеры:
+    python bulk_check.py claims.jsonl -o results.jsonl --concurrency 8 --rpm 120
+    python bulk_check.py claims.jsonl -o results.jsonl --resume          # продолжить после остановки
+    python bulk_check.py claims.jsonl -o results.jsonl --resume --retry-errors
+
+Выходной файл служит и контрольной точкой: с --resume уже обработанные строки
+пропускаются, а с --retry-errors повторяются задания с ошибкой (новая запись
+дописывается в конец, актуальна последняя запись для строки). Непустой
+выходной файл без --resume не перезаписывается, если не указан --force.
+Ctrl+C останавливает выдачу новых задач и дожидается начатых.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app_config import Config
+from services.claim_pipeline_service import ClaimPipelineService
+from services.fact_checker_service import FactCheckerService
+from services.perplexity_client import PerplexityClient
+from services.perplexity_service import PerplexityService
+from services.result_cache_service import ResultCacheService
+from services.upstream_scheduler import Priority, UpstreamScheduler, request_priority
+from services.url_canonicalizer import UrlCanonicalizer
+from utils.logger import setup_logger
+
+logger = setup_logger("bulk_check")
+
+# Вид задания -> поле входной строки
+KINDS = ("claim", "url", "text")
+
+
+@dataclass
+class BulkItem:
+    """Одна строка входного файла"""
+    line: int
+    kind: str
+    value: str
+    item_id: Any = None
+
+
+@dataclass
+class BulkStats:
+    """Счётчики прогресса пакетной проверки"""
+    total: int = 0
+    skipped: int = 0
+    done: int = 0
+    errors: int = 0
+    cached: int = 0
+    invalid: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.total - self.skipped - self.done - self.invalid)
+        eta = f"{remaining / rate / 60:.1f} мин" if rate > 0 else "—"
+        return (
+            f"Готово {self.done + self.skipped}/{self.total} "
+            f"(в этом запуске {self.done}, ошибок {self.errors}, из кэша {self.cached}, "
+            f"некорректных {self.invalid}) — {rate * 60:.1f}/мин, осталось ~{eta}"
+        )
+
+
+def parse_line(line_no: int, raw: str) -> Optional[BulkItem]:
+    """Разбирает строку входного файла (None — строка некорректна)"""
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return None
+    if isinstance(data, str):
+        return BulkItem(line_no, "claim", data) if data.strip() else None
+    if not isinstance(data, dict):
+        return None
+    for kind in KINDS:
+        value = data.get(kind)
+        if isinstance(value, str) and value.strip():
+            return BulkItem(line_no, kind, value.strip(), data.get("id"))
+    return None
+
+
+def read_input(path: str) -> Iterator[Tuple[int, str]]:
+    """Непустые строки входного файла с номерами (файл читается потоково)"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, raw in enumerate(f, 1):
+            if raw.strip():
+                yield line_no, raw
+
+
+def load_checkpoint(path: str, retry_errors: bool) -> Set[int]:
+    """Номера входных строк, уже записанных в выходной файл.
+
+    Недописанная последняя строка (процесс остановлен во время записи)
+    отрезается, чтобы следующая запись начиналась с новой строки.
+    """
+    done: Set[int] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    for raw in data[:end].splitlines():
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and isinstance(record.get("line"), int):
+            if retry_errors and record.get("error"):
+                continue
+            done.add(record["line"])
+    return done
+
+
+class BulkChecker:
+    """Прогоняет задания через те же сервисы, что и бот.
+
+    Запросы к API идут через ``UpstreamScheduler`` с приоритетом BATCH, который
+    ограничивает число запросов в минуту и одновременных запросов; результаты
+    кэшируются в ``ResultCacheService`` (с постоянным слоем — общим с ботом).
+    """
+
+    def __init__(self, config: Config, concurrency: int, rpm: int, tpm: int) -> None:
+        self.config = config
+        self.concurrency = max(1, concurrency)
+        self.scheduler = UpstreamScheduler(
+            max_concurrent=self.concurrency,
+            requests_per_minute=rpm,
+            tokens_per_minute=tpm,
+        )
+        self.client = PerplexityClient.from_config(config, self.scheduler)
+        self.fact_checker = FactCheckerService(config.PERPLEXITY_API_KEY, self.client)
+        self.perplexity = PerplexityService(config.PERPLEXITY_API_KEY, self.client)
+        self.cache = ResultCacheService.from_config(config)
+        self.url_canonicalizer = UrlCanonicalizer.from_config(config)
+        self.claim_pipeline: Optional[ClaimPipelineService] = None
+        if config.CLAIM_PIPELINE_ENABLED:
+            self.claim_pipeline = ClaimPipelineService.from_config(config, self.client, self.fact_checker, self.cache)
+
+    async def start(self) -> None:
+        await self.client.start()
+
+    async def close(self) -> None:
+        await self.url_canonicalizer.close()
+        await self.client.close()
+        self.cache.close()
+
+    async def check(self, item: BulkItem) -> Dict[str, Any]:
+        """Результат одного задания в виде записи выходного файла"""
+        request_priority.set(Priority.BATCH)
+        started = time.monotonic()
+        record: Dict[str, Any] = {"line": item.line, "id": item.item_id, "kind": item.kind, "input": item.value}
+        try:
+            if item.kind == "claim":
+                result, from_cache = await self.cache.get_or_compute(
+                    "fact_check", item.value, lambda: self.fact_checker.check_fact(item.value, with_verdict_tag=True)
+                )
+                record["verdict"] = ClaimPipelineService.parse_verdict(result)
+            elif item.kind == "url":
+                canonical = await self.url_canonicalizer.resolve(item.value)
+                record["url"] = canonical.url
+                result, from_cache = await self.cache.get_or_compute(
+                    "article", canonical.key, lambda: self._analyze(canonical.url, True)
+                )
+            else:
+                result, from_cache = await self.cache.get_or_compute(
+                    "text", item.value, lambda: self._analyze(item.value, False)
+                )
+            record["result"] = result
+            record["from_cache"] = from_cache
+            # Сервисы возвращают ошибки API текстом ответа
+            if not ResultCacheService.is_cacheable(result):
+                record["error"] = result
+        except Exception as e:
+            logger.error("Ошибка задания в строке %s: %s", item.line, e)
+            record["error"] = str(e) or type(e).__name__
+        record["duration"] = round(time.monotonic() - started, 3)
+        return record
+
+    async def _analyze(self, content: str, is_url: bool) -> str:
+        if self.claim_pipeline is not None and self.claim_pipeline.applies(content, is_url):
+            report = await self.claim_pipeline.analyze(content, is_url)
+            if report is not None:
+                return report
+        if is_url:
+            return await self.perplexity.analyze_article(content)
+        return await self.perplexity.analyze_text(content)
+
+    async def run(
+        self,
+        input_path: str,
+        output_path: str,
+        resume: bool,
+        retry_errors: bool,
+        limit: int,
+        progress_interval: float,
+    ) -> BulkStats:
+        stats = BulkStats()
+        done = load_checkpoint(output_path, retry_errors) if resume else set()
+        stats.total = sum(1 for _ in read_input(input_path))
+        if limit:
+            stats.total = min(stats.total, limit)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        queue: "asyncio.Queue[Optional[BulkItem]]" = asyncio.Queue(maxsize=self.concurrency * 2)
+        output = open(output_path, "a" if resume else "w", encoding="utf-8")
+
+        async def produce() -> None:
+            for count, (line_no, raw) in enumerate(read_input(input_path), 1):
+                if limit and count > limit or stop.is_set():
+                    break
+                if line_no in done:
+                    stats.skipped += 1
+                    continue
+                item = parse_line(line_no, raw)
+                if item is None:
+                    stats.invalid += 1
+                    logger.warning("Некорректная строка %s пропущена", line_no)
+                    continue
+                await queue.put(item)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def consume() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if stop.is_set():
+                    continue
+                record = await self.check(item)
+                # Запись целой строкой и сброс на диск — контрольная точка для --resume
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                stats.done += 1
+                stats.errors += bool(record.get("error"))
+                stats.cached += bool(record.get("from_cache"))
+
+        async def report() -> None:
+            while True:
+                await asyncio.sleep(progress_interval)
+                logger.info(stats.report())
+
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.gather(produce(), *(consume() for _ in range(self.concurrency)))
+        finally:
+            reporter.cancel()
+            output.close()
+        if stop.is_set():
+            logger.warning("Остановлено по сигналу; продолжить: --resume")
+        logger.info(stats.report())
+        return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="входной JSONL")
+    parser.add_argument("-o", "--output", required=True, help="выходной JSONL (он же контрольная точка)")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных заданий")
+    parser.add_argument("--rpm", type=int, default=Config.UPSTREAM_RPM, help="запросов к API в минуту (0 — без ограничения)")
+    parser.add_argument("--tpm", type=int, default=Config.UPSTREAM_TPM, help="токенов в минуту (0 — без ограничения)")
+    parser.add_argument("--resume", action="store_true", help="пропустить строки, уже записанные в выходной файл")
+    parser.add_argument("--retry-errors", action="store_true", help="с --resume: повторить задания с ошибкой")
+    parser.add_argument("--force", action="store_true", help="перезаписать непустой выходной файл (без --resume)")
+    parser.add_argument("--limit", type=int, default=0, help="обработать не больше N строк входа")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="период отчета о прогрессе, с")
+    args = parser.parse_args()
+    if args.retry_errors and not args.resume:
+        parser.error("--retry-errors работает только вместе с --resume")
+    if not args.resume and not args.force and os.path.exists(args.output) and os.path.getsize(args.output) > 0:
+        # Выходной файл — контрольная точка прошлого запуска, молча терять ее нельзя
+        parser.error(f"{args.output} уже содержит результаты: продолжить — --resume, перезаписать — --force")
+
+    config = Config()
+    if not config.PERPLEXITY_API_KEY:
+        parser.error("PERPLEXITY_API_KEY не установлен")
+
+    async def run() -> BulkStats:
+        checker = BulkChecker(config, args.concurrency, args.rpm, args.tpm)
+        await checker.start()
+        try:
+            return await checker.run(
+                args.input, args.output, args.resume, args.retry_errors, args.limit, args.progress_interval
+            )
+        finally:
+            await checker.close()
+
+    stats = asyncio.run(run())
+    sys.exit(1 if stats.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
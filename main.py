@@ -5,28 +5,52 @@ Telegram-бот для проверки фактов и анализа стат
 
 import asyncio
 import logging
+import multiprocessing
 import os
+import queue
+import signal
+import sqlite3
 import sys
+import time
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 
 # Добавляем текущую директорию в путь для импорта модулей
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app_config import Config
+from services.claim_pipeline_service import ClaimPipelineService
 from services.fact_checker_service import FactCheckerService
+from services.perplexity_client import PerplexityClient
 from services.perplexity_service import PerplexityService
-from services.user_service import UserService
+from services.user_service import QuotaReservation, UserService
 from services.payment_service import PaymentService
 from services.deep_research_service import DeepResearchService
-from utils.logger import setup_logger
+from services.conversation_context_service import ConversationContextService
+from services.result_cache_service import ResultCacheService
+from services.source_validator_service import SourceValidatorService
+from services.job_queue_service import DeepResearchJob, JobQueueService
+from services.resilience import CircuitBreaker
+from services.upstream_scheduler import Priority, UpstreamScheduler, request_priority
+from services.update_inbox_service import UpdateInboxService
+from services.url_canonicalizer import UrlCanonicalizer
+from utils.http_server import BotHttpServer
+from utils.logger import dropped_records, setup_logger
+from utils.metrics import HANDLER_ERRORS, HANDLER_LATENCY, REGISTRY, EventLoopLagMonitor
+from utils.telegram_rate_limiter import TelegramRateLimiter
+from utils.update_processor import PerUserUpdateProcessor
+from utils.progressive_message import ProgressiveMessage
+from utils.sharded_frontend import ShardedFrontend
 
 # Настройка логирования
 logger = setup_logger(__name__)
 
+# Значение метрики состояния автомата защиты API
+_CIRCUIT_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
 class TelegramFactCheckerBot:
     """Основной класс Telegram-бота для проверки фактов"""
     
@@ -34,38 +58,263 @@ class TelegramFactCheckerBot:
         self.config = Config()
         self.config.validate()
         
+        # Общий HTTP-клиент и планировщик для всех запросов к Perplexity API
+        self.upstream_scheduler = UpstreamScheduler.from_config(self.config)
+        self.perplexity_client = PerplexityClient.from_config(self.config, self.upstream_scheduler)
+        
         # Инициализация сервисов
-        self.fact_checker_service = FactCheckerService(self.config.PERPLEXITY_API_KEY)
-        self.perplexity_service = PerplexityService(self.config.PERPLEXITY_API_KEY)
-        self.user_service = UserService()
+        self.fact_checker_service = FactCheckerService(self.config.PERPLEXITY_API_KEY, self.perplexity_client)
+        self.perplexity_service = PerplexityService(self.config.PERPLEXITY_API_KEY, self.perplexity_client)
+        self.user_service = UserService(
+            db_path=self.config.DATABASE_PATH if self.config.USER_STORE_PERSISTENT else None,
+            flush_interval=self.config.USER_FLUSH_INTERVAL,
+            # Рабочие процессы многопроцессного режима делят одну базу
+            shared=self.config.WORKERS > 1,
+            reservation_ttl=self.config.QUOTA_RESERVATION_TTL,
+            busy_timeout=self.config.USER_DB_BUSY_TIMEOUT,
+        )
         self.payment_service = PaymentService(self.config.YOOKASSA_SHOP_ID, self.config.YOOKASSA_SECRET_KEY)
-        self.deep_research_service = DeepResearchService()
+        self.deep_research_service = DeepResearchService(self.perplexity_client)
+        self.result_cache = ResultCacheService.from_config(self.config)
+        self.url_canonicalizer = UrlCanonicalizer.from_config(self.config)
+        # Последний результат пользователя для Deep Research (вместо context.user_data)
+        self.conversation_context = ConversationContextService.from_config(self.config)
+        
+        # Разбор статей на утверждения с параллельной проверкой каждого
+        self.claim_pipeline: Optional[ClaimPipelineService] = None
+        if self.config.CLAIM_PIPELINE_ENABLED:
+            self.claim_pipeline = ClaimPipelineService.from_config(
+                self.config,
+                self.perplexity_client,
+                self.fact_checker_service,
+                self.result_cache,
+                score_domain=SourceValidatorService.from_config(self.config).score_domain,
+            )
+        
+        # Постоянная очередь задач Deep Research
+        self.job_queue = JobQueueService(
+            self.config.DATABASE_PATH,
+            workers=self.config.DEEP_RESEARCH_WORKERS,
+            lease_seconds=self.config.JOB_LEASE_SECONDS,
+            max_attempts=self.config.JOB_MAX_ATTEMPTS,
+            # Рабочий процесс выполняет и доставляет задачи только своих пользователей
+            shard=(self.config.WORKER_INDEX, self.config.WORKERS) if self.config.WORKERS > 1 else None,
+        )
+        self.job_queue.runner = self._run_deep_research_job
+        self.job_queue.deliver = self._deliver_deep_research
         
         # Создаем приложение
-        self.application = Application.builder().token(self.config.TELEGRAM_TOKEN).build()
+        # Все исходящие сообщения и правки проходят через общий планировщик
+        self.telegram_rate_limiter = TelegramRateLimiter.from_config(self.config)
+        builder = (
+            Application.builder()
+            .token(self.config.TELEGRAM_TOKEN)
+            .post_init(self._on_startup)
+            .post_shutdown(self._on_shutdown)
+            .rate_limiter(self.telegram_rate_limiter)
+            .connection_pool_size(self.config.TELEGRAM_CONNECTION_POOL_SIZE)
+            .pool_timeout(self.config.TELEGRAM_POOL_TIMEOUT)
+        )
+        if self.config.TELEGRAM_BASE_URL:
+            # Локальный Bot API сервер или фейк для нагрузочных тестов
+            builder = builder.base_url(self.config.TELEGRAM_BASE_URL)
+        if self.config.CONCURRENT_UPDATES > 1:
+            # Разные пользователи обрабатываются параллельно, апдейты одного — по порядку
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(self.config.CONCURRENT_UPDATES))
+        self.application = builder.build()
+        
+        # Встроенный HTTP-сервер: /health, /metrics и приём webhook
+        self.webhook_path = self.config.WEBHOOK_PATH or f"/{self.config.TELEGRAM_TOKEN}"
+        # Апдейты webhook сохраняются и подтверждаются сразу, обрабатываются диспетчером буфера
+        self.update_inbox: Optional[UpdateInboxService] = None
+        if self.config.WEBHOOK_URL and self.config.WEBHOOK_INBOX_ENABLED:
+            self.update_inbox = UpdateInboxService.from_config(self.config)
+            self.update_inbox.dispatch = self._dispatch_update
+        self.http_server: Optional[BotHttpServer] = None
+        if self.config.HTTP_SERVER_ENABLED or self.config.WEBHOOK_URL:
+            self.http_server = BotHttpServer(
+                self.application,
+                self._readiness,
+                host=self.config.HTTP_SERVER_HOST,
+                port=self.config.PORT,
+                webhook_path=self.webhook_path if self.config.WEBHOOK_URL else None,
+                webhook_secret=self.config.WEBHOOK_SECRET,
+                inbox=self.update_inbox,
+            )
+        self.loop_lag_monitor = EventLoopLagMonitor(self.config.EVENT_LOOP_LAG_INTERVAL)
+        self._register_metrics()
         
         # Регистрируем обработчики
         self._register_handlers()
     
+    async def _on_startup(self, application: Application) -> None:
+        """Запуск общих ресурсов при старте приложения"""
+        await self.perplexity_client.start()
+        await self.user_service.start()
+        await self.conversation_context.start()
+        await self.job_queue.start()
+        self.loop_lag_monitor.start()
+        if self.update_inbox is not None:
+            await self.update_inbox.start()
+        if self.http_server is not None:
+            await self.http_server.start()
+    
+    async def _stop_ingress(self) -> None:
+        """Прекращает прием апдейтов (HTTP-сервер и диспетчер буфера webhook).
+
+        Вызывается до application.stop(): апдейт, переданный в очередь уже
+        остановленного приложения, не обработается, хотя в буфере будет
+        отмечен отправленным.
+        """
+        if self.http_server is not None:
+            await self.http_server.stop()
+        if self.update_inbox is not None:
+            await self.update_inbox.stop()
+    
+    async def _on_shutdown(self, application: Application) -> None:
+        """Освобождение общих ресурсов при остановке приложения"""
+        await self._stop_ingress()
+        await self.url_canonicalizer.close()
+        await self.loop_lag_monitor.stop()
+        await self.job_queue.close()
+        await self.perplexity_client.close()
+        await self.user_service.close()
+        await self.conversation_context.close()
+        self.result_cache.close()
+    
+    async def _dispatch_update(self, data: Dict[str, Any]) -> None:
+        """Передает апдейт из буфера webhook в очередь приложения"""
+        update = Update.de_json(data, self.application.bot)
+        if update is not None:
+            await self.application.update_queue.put(update)
+    
+    async def _reserve(self, update: Update, user_id: int) -> Tuple[bool, Optional[QuotaReservation]]:
+        """Резерв квоты (None — лимит исчерпан); False — общая база занята, пользователю уже ответили"""
+        try:
+            return True, self.user_service.reserve(user_id)
+        except sqlite3.OperationalError as e:
+            logger.warning("Не удалось зарезервировать запрос пользователя %s: %s", user_id, e)
+            await update.message.reply_text("⏳ Сервис перегружен, повторите запрос через несколько секунд.")
+            return False, None
+    
+    def _set_request_priority(self, user_id: int) -> None:
+        """Запросы пользователей с оплаченным балансом обслуживаются в первую очередь"""
+        user_stats = self.user_service.get_user_stats(user_id)
+        request_priority.set(Priority.PAID if user_stats['balance'] > 0 else Priority.FREE)
+    
+    def _readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        """Готовность к работе: приложение запущено, автомат защиты API не разомкнут"""
+        running = self.application.running
+        circuit = self.perplexity_client.breaker.state
+        details = {
+            "telegram": "running" if running else "stopped",
+            "upstream_circuit": circuit,
+            "loop_lag": round(self.loop_lag_monitor.last_lag, 4),
+        }
+        return running and circuit != CircuitBreaker.OPEN, details
+    
+    def _register_metrics(self) -> None:
+        """Метрики, значения которых снимаются с сервисов при запросе /metrics"""
+        processor = self.application.update_processor
+        scheduler = self.upstream_scheduler
+        limiter = self.telegram_rate_limiter
+        
+        def by_priority(field: str):
+            return lambda: [({"priority": p}, s[field]) for p, s in scheduler.stats()["by_priority"].items()]
+        
+        def cache_ratios():
+            ratios = []
+            for kind, c in self.result_cache.stats()["by_kind"].items():
+                lookups = c["hits"] + c["misses"]
+                ratios.append(({"kind": kind}, c["hits"] / lookups if lookups else 0.0))
+            return ratios
+        
+        REGISTRY.gauge("bot_updates_active", "Апдейты в обработке",
+                       collect=lambda: [({}, getattr(processor, "active_updates", 0))])
+        REGISTRY.gauge("bot_update_queue_depth", "Апдейты, ожидающие в очереди приложения",
+                       collect=lambda: [({}, self.application.update_queue.qsize())])
+        REGISTRY.gauge("bot_upstream_inflight", "Запросы к Perplexity API в работе", ("priority",),
+                       collect=by_priority("inflight"))
+        REGISTRY.gauge("bot_upstream_queued", "Запросы к Perplexity API в очереди планировщика", ("priority",),
+                       collect=by_priority("queued"))
+        REGISTRY.gauge("bot_upstream_circuit_state", "Автомат защиты API: 0 — замкнут, 1 — пробный запрос, 2 — разомкнут",
+                       collect=lambda: [({}, _CIRCUIT_STATES.get(self.perplexity_client.breaker.state, 0))])
+        REGISTRY.gauge("bot_telegram_requests_queued", "Исходящие запросы к Telegram в очереди",
+                       collect=lambda: [({}, limiter.queued)])
+        REGISTRY.gauge("bot_telegram_requests_inflight", "Исходящие запросы к Telegram в работе",
+                       collect=lambda: [({}, limiter.inflight)])
+        REGISTRY.counter("bot_telegram_requests_sent_total", "Отправленные запросы к Telegram",
+                         collect=lambda: [({}, limiter.sent)])
+        REGISTRY.counter("bot_telegram_edits_coalesced_total", "Правки, замененные более новыми",
+                         collect=lambda: [({}, limiter.coalesced)])
+        REGISTRY.counter("bot_telegram_retry_after_total", "Ответы Telegram с RetryAfter",
+                         collect=lambda: [({}, limiter.retry_after_count)])
+        REGISTRY.gauge("bot_cache_hit_ratio", "Доля попаданий в кэш результатов", ("kind",), collect=cache_ratios)
+        REGISTRY.gauge("bot_cache_entries", "Записи в кэше результатов в памяти",
+                       collect=lambda: [({}, self.result_cache.stats()["entries"])])
+        REGISTRY.gauge("bot_deep_research_jobs", "Задачи Deep Research по статусам", ("status",),
+                       collect=lambda: [({"status": status}, n) for status, n in self.job_queue.stats().items()])
+        REGISTRY.counter("bot_log_records_dropped_total", "Записи логов, отброшенные при переполнении очереди",
+                         collect=lambda: [({}, dropped_records())])
+        REGISTRY.gauge("bot_event_loop_lag_last_seconds", "Последнее измеренное опоздание цикла событий",
+                       collect=lambda: [({}, self.loop_lag_monitor.last_lag)])
+        REGISTRY.gauge("bot_quota_reservations", "Резервы квоты, ожидающие списания или возврата",
+                       collect=lambda: [({}, self.user_service.pending_reservations)])
+        REGISTRY.counter("bot_quota_reservations_total", "Завершенные резервы квоты по исходу", ("result",),
+                         collect=lambda: [({"result": "committed"}, self.user_service.committed),
+                                          ({"result": "refunded"}, self.user_service.refunded),
+                                          ({"result": "expired"}, self.user_service.expired)])
+        REGISTRY.gauge("bot_conversation_context_bytes", "Память контекста Deep Research (после сжатия)",
+                       collect=lambda: [({}, self.conversation_context.stats()["bytes"])])
+        REGISTRY.gauge("bot_conversation_context_entries", "Записи контекста Deep Research в памяти",
+                       collect=lambda: [({}, self.conversation_context.stats()["entries"])])
+        REGISTRY.counter("bot_conversation_context_evictions_total", "Записи контекста, вытесненные из памяти",
+                         collect=lambda: [({}, self.conversation_context.evicted)])
+        if self.update_inbox is not None:
+            REGISTRY.gauge("bot_webhook_inbox_pending", "Принятые апдейты webhook, ожидающие передачи на обработку",
+                           collect=lambda: [({}, self.update_inbox.pending)])
+    
+    @staticmethod
+    def _handler_label(name: str, update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+        if update.callback_query is not None and update.callback_query.data:
+            return f"{name}:{update.callback_query.data.split(':')[0]}"
+        if name == "message":
+            return f"{name}:{(context.user_data or {}).get('mode') or 'none'}"
+        return name
+    
+    def _measured(self, name: str, callback):
+        """Обработчик с замером времени выполнения и счетчиком ошибок"""
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            label = self._handler_label(name, update, context)
+            try:
+                with HANDLER_LATENCY.time(handler=label):
+                    return await callback(update, context)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=label)
+                raise
+        return wrapper
+    
     def _register_handlers(self):
         """Регистрация обработчиков команд и сообщений"""
         # Команды
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("promo", self.promo_command))
+        self.application.add_handler(CommandHandler("start", self._measured("start", self.start_command)))
+        self.application.add_handler(CommandHandler("help", self._measured("help", self.help_command)))
+        self.application.add_handler(CommandHandler("promo", self._measured("promo", self.promo_command)))
         
         # Обработчики сообщений
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        self.application.add_handler(MessageHandler(
+            filters.TEXT & ~filters.COMMAND, self._measured("message", self.handle_message)
+        ))
         
         # Обработчики callback-запросов
-        self.application.add_handler(CallbackQueryHandler(self.button_callback))
+        self.application.add_handler(CallbackQueryHandler(self._measured("callback", self.button_callback)))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user_id = update.effective_user.id
         username = update.effective_user.username or "Пользователь"
         
-        logger.info(f"Пользователь {username} (ID: {user_id}) запустил бота")
+        logger.info("Пользователь %s (ID: %s) запустил бота", username, user_id)
         
         # Регистрируем пользователя
         self.user_service.register_user(user_id, username)
@@ -173,7 +422,8 @@ class TelegramFactCheckerBot:
         user_id = update.effective_user.id
         message_text = update.message.text
         
-        logger.info(f"Получено сообщение от пользователя {user_id}: {message_text[:100]}...")
+        logger.info("Получено сообщение от пользователя %s (%s символов)", user_id, len(message_text))
+        logger.debug("Текст сообщения: %s", message_text)
         
         try:
             # Проверяем, ожидается ли промо-код
@@ -196,7 +446,7 @@ class TelegramFactCheckerBot:
                 await self.show_main_menu(update, context)
                 
         except Exception as e:
-            logger.error(f"Ошибка при обработке сообщения: {e}")
+            logger.error("Ошибка при обработке сообщения: %s", e)
             await update.message.reply_text(
                 "❌ Произошла ошибка при обработке вашего запроса. Попробуйте еще раз.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -241,9 +491,22 @@ class TelegramFactCheckerBot:
         """Обработка анализа статьи"""
         user_id = update.effective_user.id
         message_text = update.message.text
+        is_url = message_text.startswith('http')
+        cache_kind = "article" if is_url else "text"
+        # Ссылки на одну статью (с метками utm_*, мобильная или AMP-версия) дают один ключ кэша
+        cache_text = message_text
+        if is_url and len(message_text.split()) == 1:
+            canonical = await self.url_canonicalizer.resolve(message_text.strip())
+            message_text, cache_text = canonical.url, canonical.key
         
-        # Проверяем лимиты
-        if not self.user_service.check_daily_limit(user_id):
+        # Резервируем запрос до обращения к API (готовый результат из кэша выдаем и без квоты)
+        reserved, reservation = await self._reserve(update, user_id)
+        if not reserved:
+            return
+        cached_analysis = None
+        if reservation is None:
+            cached_analysis = await self.result_cache.get(cache_kind, cache_text)
+        if reservation is None and cached_analysis is None:
             await update.message.reply_text(
                 "❌ Достигнут дневной лимит запросов\n\n"
                 "Купите дополнительные запросы или попробуйте завтра.",
@@ -257,51 +520,44 @@ class TelegramFactCheckerBot:
         
         # Сбрасываем режим
         context.user_data['mode'] = None
+        self._set_request_priority(user_id)
         
         try:
-            # Показываем индикатор загрузки
+            # Показываем индикатор загрузки (по мере генерации он заменяется текстом ответа)
             loading_message = await update.message.reply_text("🔍 Анализирую статью...")
-            logger.info(f"Начинаем анализ для пользователя {user_id}: {message_text[:100]}...")
-            logger.info(f"Полное сообщение от пользователя: '{message_text}'")
+            progress = ProgressiveMessage(loading_message, min_interval=self.config.STREAM_EDIT_INTERVAL)
+            on_delta = progress.update if self.config.STREAMING_ENABLED else None
+            logger.info("Начинаем анализ для пользователя %s", user_id)
+            logger.debug("Полное сообщение от пользователя: '%s'", message_text)
             
             # Анализируем статью
-            if message_text.startswith('http'):
-                # Это ссылка
-                logger.info(f"Анализируем ссылку через Perplexity API: '{message_text}'")
-                analysis = await self.perplexity_service.analyze_article(message_text)
-                logger.info(f"Анализ завершен, результат: {str(analysis)[:200]}...")
-            else:
-                # Это текст
-                logger.info("Анализируем текст через Perplexity API...")
-                analysis = await self.perplexity_service.analyze_text(message_text)
-                logger.info(f"Анализ завершен, результат: {str(analysis)[:200]}...")
-            
-            # Учитываем запрос
-            self.user_service.make_request(user_id)
+            try:
+                if cached_analysis is not None:
+                    analysis, from_cache = cached_analysis, True
+                else:
+                    analysis, from_cache = await self.result_cache.get_or_compute(
+                        cache_kind, cache_text,
+                        lambda: self._analyze_content(message_text, is_url, progress, on_delta)
+                    )
+            finally:
+                await progress.stop()
+            logger.info("Анализ завершен (из кэша: %s), %s символов", from_cache, len(str(analysis)))
+            logger.debug("Результат анализа: %s", analysis)
             
-            # Удаляем сообщение о загрузке
-            await loading_message.delete()
+            # Списываем запрос (результат из кэша и ошибка API не оплачиваются — резерв вернется)
+            if reservation is not None and not from_cache and ResultCacheService.is_cacheable(analysis):
+                self.user_service.commit(reservation)
             
             # Сохраняем контекст для Deep Research
-            context.user_data['last_topic'] = message_text
-            context.user_data['last_analysis'] = analysis
+            await self.conversation_context.set(user_id, message_text, analysis)
             
             # Форматируем ответ
             from utils.response_formatter import ResponseFormatter
             formatter = ResponseFormatter()
             formatted_analysis = formatter.format_analysis(analysis)
             
-            # Разбиваем длинные сообщения
-            if len(formatted_analysis) > 4000:
-                # Отправляем по частям
-                parts = [formatted_analysis[i:i+4000] for i in range(0, len(formatted_analysis), 4000)]
-                for i, part in enumerate(parts):
-                    if i == 0:
-                        await update.message.reply_text(part, parse_mode='Markdown')
-                    else:
-                        await update.message.reply_text(part, parse_mode='Markdown')
-            else:
-                await update.message.reply_text(formatted_analysis, parse_mode='Markdown')
+            # Выводим итог в сообщения потоковой печати (длинный ответ делится на части)
+            await progress.finish(formatted_analysis)
             
             # Показываем меню после анализа
             user_stats = self.user_service.get_user_stats(user_id)
@@ -331,21 +587,45 @@ class TelegramFactCheckerBot:
             )
             
         except Exception as e:
-            logger.error(f"Ошибка при анализе статьи: {e}")
+            logger.error("Ошибка при анализе статьи: %s", e)
             await update.message.reply_text(
                 "❌ Произошла ошибка при анализе статьи. Попробуйте еще раз.",
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
                 ]])
             )
+        finally:
+            # Незавершенный резерв (ошибка, отмена, результат из кэша) возвращается
+            if reservation is not None:
+                self.user_service.refund(reservation)
+    
+    async def _analyze_content(self, message_text: str, is_url: bool, progress: ProgressiveMessage, on_delta) -> str:
+        """Анализ ссылки или текста: по утверждениям, если это возможно, иначе целиком"""
+        if self.claim_pipeline is not None and self.claim_pipeline.applies(message_text, is_url):
+            report = await self.claim_pipeline.analyze(message_text, is_url, on_progress=progress.update)
+            if report is not None:
+                return report
+        if is_url:
+            # Это ссылка
+            logger.debug("Анализируем ссылку через Perplexity API: '%s'", message_text)
+            return await self.perplexity_service.analyze_article(message_text, on_delta=on_delta)
+        # Это текст
+        logger.info("Анализируем текст через Perplexity API...")
+        return await self.perplexity_service.analyze_text(message_text, on_delta=on_delta)
     
     async def handle_fact_check(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка проверки факта"""
         user_id = update.effective_user.id
         message_text = update.message.text
         
-        # Проверяем лимиты
-        if not self.user_service.check_daily_limit(user_id):
+        # Резервируем запрос до обращения к API (готовый результат из кэша выдаем и без квоты)
+        reserved, reservation = await self._reserve(update, user_id)
+        if not reserved:
+            return
+        cached_fact_check = None
+        if reservation is None:
+            cached_fact_check = await self.result_cache.get("fact_check", message_text)
+        if reservation is None and cached_fact_check is None:
             await update.message.reply_text(
                 "❌ **Достигнут дневной лимит запросов**\n\n"
                 "Купите дополнительные запросы или попробуйте завтра.",
@@ -359,19 +639,29 @@ class TelegramFactCheckerBot:
         
         # Сбрасываем режим
         context.user_data['mode'] = None
+        self._set_request_priority(user_id)
         
         try:
-            # Показываем индикатор загрузки
+            # Показываем индикатор загрузки (по мере генерации он заменяется текстом ответа)
             loading_message = await update.message.reply_text("🔍 Проверяю факт...")
+            progress = ProgressiveMessage(loading_message, min_interval=self.config.STREAM_EDIT_INTERVAL)
+            on_delta = progress.update if self.config.STREAMING_ENABLED else None
             
             # Проверяем факт
-            fact_check = await self.fact_checker_service.check_fact(message_text)
-            
-            # Учитываем запрос
-            self.user_service.make_request(user_id)
+            try:
+                if cached_fact_check is not None:
+                    fact_check, from_cache = cached_fact_check, True
+                else:
+                    fact_check, from_cache = await self.result_cache.get_or_compute(
+                        "fact_check", message_text,
+                        lambda: self.fact_checker_service.check_fact(message_text, on_delta=on_delta)
+                    )
+            finally:
+                await progress.stop()
             
-            # Удаляем сообщение о загрузке
-            await loading_message.delete()
+            # Списываем запрос (результат из кэша и ошибка API не оплачиваются — резерв вернется)
+            if reservation is not None and not from_cache and ResultCacheService.is_cacheable(fact_check):
+                self.user_service.commit(reservation)
             
             # Форматируем ответ
             from utils.response_formatter import ResponseFormatter
@@ -379,20 +669,12 @@ class TelegramFactCheckerBot:
             formatted_fact_check = formatter.format_fact_check(fact_check)
             
             # Сохраняем контекст для Deep Research по утверждению
-            context.user_data['last_topic'] = f"Факт-чек утверждения: {message_text[:200]}"
-            context.user_data['last_analysis'] = formatted_fact_check
+            await self.conversation_context.set(
+                user_id, f"Факт-чек утверждения: {message_text[:200]}", formatted_fact_check
+            )
             
-            # Разбиваем длинные сообщения
-            if len(formatted_fact_check) > 4000:
-                # Отправляем по частям
-                parts = [formatted_fact_check[i:i+4000] for i in range(0, len(formatted_fact_check), 4000)]
-                for i, part in enumerate(parts):
-                    if i == 0:
-                        await update.message.reply_text(part, parse_mode='Markdown')
-                    else:
-                        await update.message.reply_text(part, parse_mode='Markdown')
-            else:
-                await update.message.reply_text(formatted_fact_check, parse_mode='Markdown')
+            # Выводим итог в сообщения потоковой печати (длинный ответ делится на части)
+            await progress.finish(formatted_fact_check)
             
             # Показываем меню после проверки (с Deep Research)
             is_free = self.user_service.can_use_deep_research(user_id)
@@ -411,13 +693,17 @@ class TelegramFactCheckerBot:
             )
             
         except Exception as e:
-            logger.error(f"Ошибка при проверке факта: {e}")
+            logger.error("Ошибка при проверке факта: %s", e)
             await update.message.reply_text(
                 "❌ Произошла ошибка при проверке факта. Попробуйте еще раз.",
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
                 ]])
             )
+        finally:
+            # Незавершенный резерв (ошибка, отмена, результат из кэша) возвращается
+            if reservation is not None:
+                self.user_service.refund(reservation)
     
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на кнопки"""
@@ -427,7 +713,7 @@ class TelegramFactCheckerBot:
         data = query.data
         user_id = query.from_user.id
         
-        logger.info(f"Обработка callback: {data} от пользователя {user_id}")
+        logger.info("Обработка callback: %s от пользователя %s", data, user_id)
         
         if data == "analyze_article":
             await self.start_article_analysis(query, context)
@@ -447,6 +733,8 @@ class TelegramFactCheckerBot:
             await self.handle_deep_research(query, context)
         elif data == "confirm_deep_research":
             await self.confirm_deep_research(query, context)
+        elif data.startswith("deep_research_status:"):
+            await self.show_deep_research_status(query, int(data.split(":", 1)[1]))
         elif data.startswith("buy_"):
             await self.handle_payment_selection(query, context, data)
         else:
@@ -593,7 +881,7 @@ class TelegramFactCheckerBot:
                 )
                 
         except Exception as e:
-            logger.error(f"Ошибка при создании платежа: {e}")
+            logger.error("Ошибка при создании платежа: %s", e)
             await query.edit_message_text(
                 "❌ Ошибка создания платежа. Попробуйте позже.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -688,21 +976,18 @@ class TelegramFactCheckerBot:
         """Обработка запроса на Deep Research"""
         user_id = query.from_user.id
         
-        # Логируем имеющийся контекст
-        try:
-            logger.info(f"Deep Research user_data keys: {list(context.user_data.keys())}")
-        except Exception:
-            pass
-        
         # Проверяем, есть ли контекст для Deep Research
-        if not context.user_data.get('last_analysis'):
+        follow_up = await self.conversation_context.get(user_id)
+        logger.debug("Контекст для Deep Research у пользователя %s: %s", user_id, follow_up is not None)
+        if follow_up is None or not follow_up.analysis:
             # Если есть только тема, используем её как контекст
-            fallback_topic = context.user_data.get('last_topic')
-            if fallback_topic:
-                context.user_data['last_analysis'] = (
+            if follow_up is not None:
+                await self.conversation_context.set(
+                    user_id,
+                    follow_up.topic,
                     f"Исходные данные получены из последнего действия пользователя.\n"
-                    f"Тема: {fallback_topic}. Проведи углублённое исследование по этой теме, \n"
-                    f"найди дополнительные независимые источники, статистику и экспертные мнения."
+                    f"Тема: {follow_up.topic}. Проведи углублённое исследование по этой теме, \n"
+                    f"найди дополнительные независимые источники, статистику и экспертные мнения.",
                 )
             else:
                 await query.edit_message_text(
@@ -729,9 +1014,6 @@ class TelegramFactCheckerBot:
                     parse_mode='Markdown'
                 )
                 return
-            else:
-                # Списываем 449 запросов
-                self.user_service.make_request(user_id, 449)
         
         # Показываем подтверждение
         is_free = self.user_service.can_use_deep_research(user_id)
@@ -758,17 +1040,32 @@ class TelegramFactCheckerBot:
         )
     
     async def confirm_deep_research(self, query, context: ContextTypes.DEFAULT_TYPE):
-        """Подтверждение Deep Research"""
+        """Подтверждение Deep Research: задача ставится в постоянную очередь"""
         user_id = query.from_user.id
+        reservation = None
+        is_free = False
+        job_id = None
         
         try:
+            # Контекст мог устареть или быть вытеснен, пока пользователь подтверждал
+            follow_up = await self.conversation_context.get(user_id)
+            if follow_up is None:
+                await query.edit_message_text(
+                    "❌ Нет данных для Deep Research. Сначала выполните анализ статьи или проверку утверждения.",
+                    reply_markup=InlineKeyboardMarkup([[
+                        InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
+                    ]])
+                )
+                return
+            
             # Проверяем, может ли пользователь использовать Deep Research
             is_free = self.user_service.can_use_deep_research(user_id)
+            cost = 0
             
             if not is_free:
-                # Проверяем баланс для платного использования
-                user_stats = self.user_service.get_user_stats(user_id)
-                if user_stats['balance'] < 449:
+                # Резервируем оплату (списывается только здесь, после подтверждения)
+                reservation = self.user_service.reserve(user_id, cost=449, paid=True)
+                if reservation is None:
                     await query.edit_message_text(
                         "❌ Недостаточно запросов для Deep Research",
                         reply_markup=InlineKeyboardMarkup([[
@@ -776,113 +1073,38 @@ class TelegramFactCheckerBot:
                         ]])
                     )
                     return
-                # Списываем запросы
-                self.user_service.make_request(user_id, cost=449)
-            
-            # Показываем индикатор загрузки с временем
-            await query.edit_message_text(
-                "🔬 Запускаю Глубокое Исследование...\n\n"
-                "⏱️ Ожидаемое время: 3-4 минуты\n"
-                "🔍 Анализирую сотни источников...\n\n"
-                "⏳ Пожалуйста, подождите..."
-            )
-            
-            # Проводим Deep Research
-            topic = context.user_data.get('last_topic')
-            initial_analysis = context.user_data.get('last_analysis')
-            
-            logger.info(f"Начинаем Deep Research для пользователя {user_id}")
-            logger.info(f"Тема: {topic}")
-            logger.info(f"Начальный анализ: {initial_analysis[:100]}...")
-            
-            import time
-            start_time = time.time()
-            
-            try:
-                # Создаем задачу для Deep Research
-                deep_research_task = asyncio.create_task(
-                    self.deep_research_service.conduct_deep_research(topic, initial_analysis)
-                )
-                
-                # Показываем промежуточные обновления
-                status_messages = [
-                    "🔍 Ищу независимые источники...",
-                    "📊 Анализирую экспертные мнения...",
-                    "📈 Собираю статистические данные...",
-                    "🌍 Проверяю международные источники...",
-                    "⚖️ Ищу альтернативные точки зрения...",
-                    "🎯 Формирую заключение..."
-                ]
-                
-                message_index = 0
-                while not deep_research_task.done():
-                    await asyncio.sleep(30)  # Обновляем каждые 30 секунд
-                    if not deep_research_task.done() and message_index < len(status_messages):
-                        await query.edit_message_text(
-                            f"🔬 Глубокое Исследование...\n\n"
-                            f"⏱️ Прошло: {int(time.time() - start_time)} секунд\n"
-                            f"📊 {status_messages[message_index]}\n\n"
-                            f"⏳ Пожалуйста, подождите..."
-                        )
-                        message_index += 1
-                
-                deep_research_result = await deep_research_task
-                end_time = time.time()
-                duration = int(end_time - start_time)
-                
-                logger.info(f"Deep Research завершен за {duration} секунд")
-                
-            except Exception as e:
-                logger.error(f"Ошибка при проведении Deep Research: {str(e)}")
-                await query.edit_message_text(
-                    f"❌ **Ошибка при проведении Deep Research**\n\n"
-                    f"Произошла ошибка: {str(e)}\n\n"
-                    f"Попробуйте позже или обратитесь в поддержку."
-                )
-                return
+                cost = 449
             
-            # Отмечаем использование Deep Research
+            # Отмечаем использование Deep Research (при сбое попытка возвращается)
             self.user_service.use_deep_research(user_id)
             
-            # Форматируем результат с информацией о времени
-            from utils.response_formatter import ResponseFormatter
-            formatter = ResponseFormatter()
-            
-            # Добавляем заголовок с информацией о времени выполнения
-            header = f"🔬 **DEEP RESEARCH ЗАВЕРШЕН**\n\n"
-            header += f"⏱️ **Время выполнения:** {duration} секунд\n"
-            header += f"🧠 **Модель:** Perplexity Sonar (оптимизированная)\n"
-            header += f"📊 **Тип анализа:** углубленное исследование\n\n"
-            header += "---\n\n"
+            topic = follow_up.topic
+            initial_analysis = follow_up.analysis or topic
             
-            formatted_result = header + formatter.format_deep_research(deep_research_result)
-            
-            # Разбиваем длинные сообщения
-            if len(formatted_result) > 4000:
-                parts = [formatted_result[i:i+4000] for i in range(0, len(formatted_result), 4000)]
-                for i, part in enumerate(parts):
-                    if i == 0:
-                        await query.edit_message_text(part, parse_mode='Markdown')
-                    else:
-                        await query.message.reply_text(part, parse_mode='Markdown')
-            else:
-                await query.edit_message_text(formatted_result, parse_mode='Markdown')
-            
-            # Показываем меню после Deep Research
-            keyboard = [
-                [InlineKeyboardButton("📰 Анализ другой статьи", callback_data="analyze_article")],
-                [InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            logger.info("Ставим Deep Research в очередь для пользователя %s", user_id)
+            logger.debug("Тема: %s", topic)
             
-            await query.message.reply_text(
-                "**Что дальше?**",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
+            job_id = await self.job_queue.submit(
+                user_id=user_id,
+                chat_id=query.message.chat_id,
+                message_id=query.message.message_id,
+                topic=topic,
+                initial_analysis=initial_analysis,
+                cost=cost,
             )
+            # Задача в очереди: при ее сбое оплату вернет исполнитель (refund_request)
+            if reservation is not None:
+                self.user_service.commit(reservation)
+            await self.show_deep_research_status(query, job_id)
             
         except Exception as e:
-            logger.error(f"Ошибка при Deep Research: {e}")
+            logger.error("Ошибка при Deep Research: %s", e)
+            # Задача не поставлена в очередь: возвращаем резерв или бесплатную попытку
+            if job_id is None:
+                if reservation is not None:
+                    self.user_service.refund(reservation)
+                elif is_free:
+                    self.user_service.restore_deep_research(user_id)
             await query.edit_message_text(
                 "❌ Произошла ошибка при проведении Deep Research. Попробуйте позже.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -890,27 +1112,135 @@ class TelegramFactCheckerBot:
                 ]])
             )
     
+    async def show_deep_research_status(self, query, job_id: int):
+        """Показать позицию задачи Deep Research в очереди и оценку времени"""
+        job = await self.job_queue.get(job_id)
+        if job is None or job.user_id != query.from_user.id:
+            await query.edit_message_text("❌ Задача не найдена")
+            return
+        if job.status != 'queued':
+            # Задача уже выполняется или завершена — сообщение обновит исполнитель
+            return
+        
+        position, eta = await self.job_queue.position(job_id)
+        keyboard = [[InlineKeyboardButton("🔄 Обновить статус", callback_data=f"deep_research_status:{job_id}")]]
+        await query.edit_message_text(
+            "🔬 Глубокое Исследование в очереди\n\n"
+            f"📋 Позиция в очереди: {position}\n"
+            f"⏱️ Ожидаемое время: ~{max(1, round(eta / 60))} мин\n\n"
+            "Результат придет в этот чат, даже если бот будет перезапущен.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
+    def _job_message(self, job: DeepResearchJob) -> Message:
+        """Сообщение со статусом задачи, которое редактирует исполнитель"""
+        return Message.de_json(
+            {"message_id": job.message_id, "date": int(job.created_at),
+             "chat": {"id": job.chat_id, "type": "private"}},
+            self.application.bot,
+        )
+    
+    async def _run_deep_research_job(self, job: DeepResearchJob, on_progress) -> str:
+        """Исполнитель очереди: проводит Deep Research с показом прогресса"""
+        logger.info("Начинаем Deep Research #%s для пользователя %s", job.id, job.user_id)
+        
+        start_time = time.time()
+        
+        def render_progress(text: str) -> str:
+            status = (
+                f"🔬 Глубокое Исследование...\n\n"
+                f"⏱️ Прошло: {int(time.time() - start_time)} секунд\n"
+            )
+            if not text:
+                return status + "🔍 Ищу источники...\n\n⏳ Пожалуйста, подождите..."
+            tail = text[-300:].split("\n", 1)[-1] if len(text) > 300 else text
+            return status + f"📊 Получено: {len(text)} символов\n\n…{tail}"
+        
+        # Статус обновляется по мере поступления потока ответа
+        progress = ProgressiveMessage(
+            self._job_message(job),
+            min_interval=max(5.0, self.config.STREAM_EDIT_INTERVAL),
+            render=render_progress,
+        )
+        
+        def on_delta(text: str) -> None:
+            on_progress(text)
+            progress.update(text)
+        
+        progress.update("")
+        
+        # Deep Research идёт в отдельной очереди и не вытесняет обычные проверки
+        request_priority.set(Priority.DEEP_RESEARCH)
+        try:
+            return await self.deep_research_service.conduct_deep_research(
+                job.topic, job.initial_analysis,
+                on_delta=on_delta if self.config.STREAMING_ENABLED else None
+            )
+        finally:
+            await progress.stop()
+    
+    async def _deliver_deep_research(self, job: DeepResearchJob) -> None:
+        """Доставка результата Deep Research (или сообщения об ошибке) в чат"""
+        progress = ProgressiveMessage(self._job_message(job))
+        
+        if job.status != 'done':
+            # Возвращаем списанное: платные запросы или бесплатную попытку.
+            # Возврат отмечается в базе один раз — повторная доставка сообщения после перезапуска его не повторит
+            if await self.job_queue.claim_refund(job.id):
+                if job.cost:
+                    self.user_service.refund_request(job.user_id, job.cost)
+                else:
+                    self.user_service.restore_deep_research(job.user_id)
+            await progress.finish(
+                "❌ Ошибка при проведении Deep Research\n\n"
+                "Списанные запросы возвращены. Попробуйте позже или обратитесь в поддержку.",
+                parse_mode=None,
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
+                ]])
+            )
+            return
+        
+        logger.info("Deep Research #%s завершен за %s секунд", job.id, job.duration)
+        
+        # Форматируем результат с информацией о времени
+        from utils.response_formatter import ResponseFormatter
+        formatter = ResponseFormatter()
+        
+        # Добавляем заголовок с информацией о времени выполнения
+        header = f"🔬 **DEEP RESEARCH ЗАВЕРШЕН**\n\n"
+        header += f"⏱️ **Время выполнения:** {job.duration} секунд\n"
+        header += f"🧠 **Модель:** Perplexity Sonar (оптимизированная)\n"
+        header += f"📊 **Тип анализа:** углубленное исследование\n\n"
+        header += "---\n\n"
+        
+        formatted_result = header + formatter.format_deep_research(job.result)
+        
+        # Заменяем статус итоговым результатом (длинный ответ делится на части)
+        await progress.finish(formatted_result)
+        
+        # Показываем меню после Deep Research
+        keyboard = [
+            [InlineKeyboardButton("📰 Анализ другой статьи", callback_data="analyze_article")],
+            [InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await progress.messages[-1].reply_text(
+            "**Что дальше?**",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    
     def run(self):
         """Запуск бота (Webhook или Polling)"""
         logger.info("Запуск Telegram-бота...")
         
         try:
-            webhook_url = os.getenv("WEBHOOK_URL", "").strip()
-            port = int(os.getenv("PORT", "8000"))
-            path = os.getenv("WEBHOOK_PATH", f"/{self.config.TELEGRAM_TOKEN}")
-
-            if webhook_url:
-                # Запуск в режиме webhook
-                logger.info(f"Включаем Webhook: url={webhook_url}, path={path}, port={port}")
-                # Устанавливаем webhook
-                import asyncio as _asyncio
-                _asyncio.run(self.application.bot.set_webhook(url=webhook_url + path, drop_pending_updates=True))
-                # Запускаем веб-сервер
-                self.application.run_webhook(
-                    listen="0.0.0.0",
-                    port=port,
-                    url_path=path,
-                )
+            if self.config.WEBHOOK_URL:
+                # Запуск в режиме webhook: апдейты принимает встроенный HTTP-сервер
+                logger.info("Включаем Webhook: url=%s, port=%s", self.config.WEBHOOK_URL, self.config.PORT)
+                asyncio.run(self._run_webhook())
             else:
                 # Fallback: polling (локально)
                 logger.info("WEBHOOK_URL не задан — запускаем polling")
@@ -921,18 +1251,94 @@ class TelegramFactCheckerBot:
                     pass
                 self.application.run_polling(drop_pending_updates=True)
         except Exception as e:
-            logger.error(f"Ошибка при запуске бота: {e}")
+            logger.error("Ошибка при запуске бота: %s", e)
             raise
+    
+    async def _run_webhook(self) -> None:
+        """Режим webhook: /health, /metrics и webhook обслуживаются одним сервером"""
+        async def register_webhook() -> None:
+            await self.application.bot.set_webhook(
+                url=self.config.WEBHOOK_URL + self.webhook_path,
+                secret_token=self.http_server.webhook_secret,
+                # Буфер отбрасывает повторы, поэтому накопленные за время простоя апдейты можно принять
+                drop_pending_updates=self.update_inbox is None,
+            )
+        
+        await self._serve(before_start=register_webhook)
+    
+    async def _run_worker(self, updates: "multiprocessing.Queue") -> None:
+        """Рабочий процесс: апдейты своих пользователей приходят от основного процесса"""
+        parent = os.getppid()
+        
+        async def feed(stop: asyncio.Event) -> None:
+            while not stop.is_set():
+                try:
+                    data = await asyncio.to_thread(updates.get, True, 0.5)
+                except queue.Empty:
+                    # Основной процесс завершился аварийно — рабочему процессу тоже пора
+                    if os.getppid() != parent:
+                        stop.set()
+                    continue
+                if data is None:
+                    stop.set()
+                    return
+                await self._dispatch_update(data)
+        
+        logger.info("Рабочий процесс %s из %s запущен", self.config.WORKER_INDEX, self.config.WORKERS)
+        await self._serve(feed=feed)
+    
+    async def _serve(self, before_start=None, feed=None) -> None:
+        """Запускает приложение без Updater и работает до сигнала остановки"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        
+        application = self.application
+        feeder: Optional[asyncio.Task] = None
+        await application.initialize()
+        await self._on_startup(application)
+        try:
+            if before_start is not None:
+                await before_start()
+            await application.start()
+            if feed is not None:
+                feeder = asyncio.create_task(feed(stop))
+            await stop.wait()
+        finally:
+            if feeder is not None:
+                feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+            # Сначала закрываем прием: уже переданные апдейты приложение обработает при остановке
+            await self._stop_ingress()
+            if application.running:
+                await application.stop()
+            await self._on_shutdown(application)
+            await application.shutdown()
+
+
+def run_worker(index: int, workers: int, updates: "multiprocessing.Queue") -> None:
+    """Точка входа рабочего процесса (номер и число процессов приходят и через окружение)"""
+    bot = TelegramFactCheckerBot()
+    asyncio.run(bot._run_worker(updates))
 
 def main():
     """Главная функция"""
     try:
+        if Config.WORKERS > 1:
+            # Основной процесс только принимает апдейты и раздает их рабочим процессам
+            Config.validate()
+            ShardedFrontend(Config(), run_worker, Config.WORKERS).run()
+            return
         bot = TelegramFactCheckerBot()
         bot.run()
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
+        logger.error("Критическая ошибка: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":
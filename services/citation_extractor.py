@@ -0,0 +1,140 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from services.url_canonicalizer import canonicalize_url, clean_url
+
+# Markdown-ссылка [заголовок](url) или «голый» URL
+_CITATION_RE = re.compile(
+    r"\[(?P<title>[^\]\n]{0,500})\]\((?P<link>https?://[^\s()<>]+(?:\([^\s()<>]*\)[^\s()<>]*)*)\)"
+    r"|(?P<url>https?://[^\s<>\"'`\[\]\{\}]+)",
+    re.IGNORECASE,
+)
+
+# Знаки препинания и остатки разметки, которые не относятся к URL
+_TRAILING_CHARS = ".,;:!?*_~'\"»…"
+
+
+def _strip_trailing(url: str) -> str:
+    url = url.rstrip(_TRAILING_CHARS)
+    # Закрывающая скобка без парной открывающей — часть текста, а не URL
+    while url.endswith(")") and url.count("(") < url.count(")"):
+        url = url[:-1].rstrip(_TRAILING_CHARS)
+    return url
+
+
+@dataclass
+class Citation:
+    """Уникальный источник из ответа"""
+    url: str
+    domain: str
+    title: Optional[str] = None
+    score: Optional[float] = None
+    mentions: int = 1
+
+
+class CitationExtractor:
+    """Инкрементальное извлечение источников из ответа модели.
+
+    Текст подаётся кусками через ``feed`` (в том числе во время потоковой
+    генерации); каждый символ разбирается один раз. Незавершённый хвост — всё
+    после последнего перевода строки — ждёт следующего куска, так как ни URL, ни
+    Markdown-ссылка не переносятся на новую строку. Варианты одной страницы
+    (с метками utm_*, мобильная или AMP-версия) сравниваются по ключу
+    ``canonicalize`` и считаются один раз, а в ``Citation.url`` остается рабочий
+    адрес первого упоминания; оценка надежности ``score_domain`` вызывается один
+    раз на домен.
+    """
+
+    MAX_PENDING = 8192
+
+    def __init__(
+        self,
+        score_domain: Optional[Callable[[str], float]] = None,
+        canonicalize: Callable[[str], str] = canonicalize_url,
+    ) -> None:
+        self.score_domain = score_domain
+        self.canonicalize = canonicalize
+        self._citations: Dict[str, Citation] = {}
+        self._domain_scores: Dict[str, float] = {}
+        self._pending = ""
+
+    @property
+    def citations(self) -> List[Citation]:
+        """Источники в порядке первого упоминания"""
+        return list(self._citations.values())
+
+    @property
+    def domain_scores(self) -> Dict[str, float]:
+        return dict(self._domain_scores)
+
+    def feed(self, chunk: str) -> List[Citation]:
+        """Разбирает очередной кусок текста; возвращает впервые найденные источники"""
+        if not chunk:
+            return []
+        previous = len(self._pending)
+        self._pending += chunk
+        newline = chunk.rfind("\n")
+        if newline != -1:
+            cut = previous + newline + 1
+        elif len(self._pending) > self.MAX_PENDING:
+            # Очень длинная строка: режем по пробелу, чтобы не копить буфер
+            cut = max(self._pending.rfind(" "), self._pending.rfind("\t")) + 1
+            if cut == 0:
+                cut = len(self._pending)
+        else:
+            return []
+        text, self._pending = self._pending[:cut], self._pending[cut:]
+        return self._scan(text)
+
+    def close(self) -> List[Citation]:
+        """Разбирает оставшийся хвост текста"""
+        text, self._pending = self._pending, ""
+        return self._scan(text)
+
+    def extract(self, text: str) -> List[Citation]:
+        """Разбирает весь текст целиком и возвращает все источники"""
+        self.feed(text)
+        self.close()
+        return self.citations
+
+    def _scan(self, text: str) -> List[Citation]:
+        found = []
+        for match in _CITATION_RE.finditer(text):
+            link = match.group("link")
+            if link is not None:
+                title = match.group("title").strip() or None
+            else:
+                link, title = match.group("url"), None
+            citation = self._add(_strip_trailing(link), title)
+            if citation is not None:
+                found.append(citation)
+        return found
+
+    def _add(self, raw_url: str, title: Optional[str]) -> Optional[Citation]:
+        key = self.canonicalize(raw_url)
+        citation = self._citations.get(key)
+        if citation is not None:
+            citation.mentions += 1
+            if citation.title is None:
+                citation.title = title
+            return None
+        url = clean_url(raw_url)
+        try:
+            domain = urlsplit(url).hostname or ""
+        except ValueError:
+            domain = ""
+        if domain.startswith("www."):
+            domain = domain[4:]
+        citation = Citation(url=url, domain=domain, title=title, score=self._score(domain))
+        self._citations[key] = citation
+        return citation
+
+    def _score(self, domain: str) -> Optional[float]:
+        if self.score_domain is None:
+            return None
+        score = self._domain_scores.get(domain)
+        if score is None:
+            score = self._domain_scores[domain] = self.score_domain(domain)
+        return score
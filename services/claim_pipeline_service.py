@@ -0,0 +1,319 @@
+import asyncio
+import json
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from services.citation_extractor import Citation, CitationExtractor
+from services.fact_checker_service import VERDICT_TAG_RE, FactCheckerService
+from services.perplexity_client import PerplexityClient
+from services.result_cache_service import ResultCacheService
+from utils.logger import setup_logger
+from utils.metrics import observe_latency
+
+logger = setup_logger(__name__)
+
+# Разбиение текста на предложения для эвристического извлечения утверждений
+_SENTENCE_RE = re.compile(r"(?:[^.!?…\n]|\.(?=\d))+(?:[.!?…]+|$)")
+
+# Признаки проверяемого утверждения: числа, даты, имена собственные внутри предложения
+_DIGIT_RE = re.compile(r"\d")
+_PROPER_NAME_RE = re.compile(r"(?<=[\s«\"(])[A-ZА-ЯЁ][a-zа-яё]+")
+
+# Символы разметки Telegram Markdown, которые убираем из текста утверждений
+_MARKUP_RE = re.compile(r"[*_`\[\]]")
+
+# Метки вердикта check_fact(with_verdict_tag=True) → вердикт
+_VERDICT_TOKENS = {"истинно": "true", "ложно": "false", "частично": "partly", "не установлено": "unverified"}
+
+# Запасной разбор строки «КРАТКИЙ ВЫВОД» (ответы без метки, например из кэша):
+# вердиктом считается первое по положению слово-признак; при равном положении
+# побеждает более ранняя альтернатива («неверно» — ложно, а не «верно»)
+_VERDICT_WORDS_RE = re.compile(
+    r"(?P<neg>\bне\s+(?:(?:является|являются|было|был[аио]?|совсем)\s+)?)?"
+    r"(?:(?P<partly>частичн|отчасти|неоднознач)"
+    r"|(?P<false>ложн|неверн|недостоверн|неправд|несоответств|опроверг)"
+    r"|(?P<true>истинн(?!ост)|верн|правд|соответств|подтвержд|достоверн))",
+    re.IGNORECASE,
+)
+# Повторенный из запроса перечень вариантов: «(истинно/ложно/частично истинно)»
+_VERDICT_OPTIONS_RE = re.compile(r"\([^()]*/[^()]*\)|(?:\w+\s+)?\w+(?:\s*/\s*\w+(?:\s+\w+)?)+")
+
+VERDICT_LABELS = {
+    "true": "✅ Подтверждено",
+    "partly": "⚠️ Частично подтверждено",
+    "false": "❌ Опровергнуто",
+    "unverified": "❔ Не удалось установить",
+    "error": "🚫 Проверка не выполнена",
+}
+
+ProgressCallback = Callable[[str], None]
+
+
+def _plain(text: str) -> str:
+    return " ".join(_MARKUP_RE.sub("", text).split())
+
+
+@dataclass
+class ClaimVerdict:
+    """Результат проверки одного утверждения"""
+    claim: str
+    verdict: str
+    summary: str
+    report: str
+    from_cache: bool = False
+    duration: float = 0.0
+
+
+class ClaimPipelineService:
+    """Разбор статьи на атомарные утверждения и их параллельная проверка.
+
+    Утверждения извлекаются моделью (для текста — с эвристическим запасным
+    вариантом), затем каждое проверяется через ``FactCheckerService.check_fact``
+    с кэшем результатов вида "fact_check". Одновременно выполняется не больше
+    ``concurrency`` проверок одной статьи, поэтому время ответа близко ко времени
+    самой медленной проверки, а не к сумме.
+    """
+
+    def __init__(
+        self,
+        client: PerplexityClient,
+        fact_checker: FactCheckerService,
+        cache: ResultCacheService,
+        max_claims: int = 6,
+        concurrency: int = 6,
+        min_chars: int = 500,
+        score_domain: Optional[Callable[[str], float]] = None,
+    ) -> None:
+        self.client = client
+        self.fact_checker = fact_checker
+        self.cache = cache
+        self.max_claims = max_claims
+        self.concurrency = max(1, concurrency)
+        self.min_chars = min_chars
+        self.score_domain = score_domain
+
+    @classmethod
+    def from_config(
+        cls,
+        config,
+        client: PerplexityClient,
+        fact_checker: FactCheckerService,
+        cache: ResultCacheService,
+        score_domain: Optional[Callable[[str], float]] = None,
+    ) -> "ClaimPipelineService":
+        return cls(
+            client,
+            fact_checker,
+            cache,
+            max_claims=config.CLAIM_MAX_CLAIMS,
+            concurrency=config.CLAIM_CONCURRENCY,
+            min_chars=config.CLAIM_PIPELINE_MIN_CHARS,
+            score_domain=score_domain,
+        )
+
+    def applies(self, text: str, is_url: bool) -> bool:
+        """Короткий текст быстрее проверить одним запросом"""
+        return is_url or len(text) >= self.min_chars
+
+    # --- Извлечение утверждений ---
+
+    async def extract_claims(self, text: str, is_url: bool) -> List[str]:
+        """Проверяемые утверждения статьи (по ссылке или из текста)"""
+        source = f"статьи по ссылке: {text}" if is_url else f"текста:\n\n{text}"
+        payload = {
+            "model": "sonar",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": (
+                        "Ты выделяешь из материалов проверяемые утверждения о фактах. "
+                        f"Выбери не больше {self.max_claims} самых важных утверждений: конкретные факты, "
+                        "числа, даты, цитаты и причинно-следственные связи. Не включай мнения и оценки. "
+                        "Каждое утверждение должно быть самодостаточным: без местоимений, со всеми "
+                        "именами и датами, на русском языке. Ответь ТОЛЬКО JSON-массивом строк."
+                    ),
+                },
+                {"role": "user", "content": f"Выдели утверждения из {source}"},
+            ],
+            "max_tokens": 800,
+            "temperature": 0.0,
+            "stream": False,
+        }
+        try:
+            response = await self.client.post_chat(payload, hedge=True)
+            if response.ok:
+                claims = self._parse_claims(response.content)
+                if claims:
+                    return claims
+            else:
+                logger.warning("Не удалось выделить утверждения: статус %s", response.status)
+        except Exception as e:
+            logger.warning("Не удалось выделить утверждения: %s", e)
+        # Текст статьи по ссылке без модели недоступен
+        return [] if is_url else self.heuristic_claims(text)
+
+    def _parse_claims(self, content: str) -> List[str]:
+        start, end = content.find("["), content.rfind("]")
+        if start == -1 or end <= start:
+            return []
+        try:
+            items = json.loads(content[start:end + 1])
+        except ValueError:
+            return []
+        if not isinstance(items, list):
+            return []
+        return self._unique(str(item) for item in items if isinstance(item, (str, int, float)))
+
+    def heuristic_claims(self, text: str) -> List[str]:
+        """Предложения с числами и именами собственными — самые проверяемые"""
+        scored = []
+        for position, match in enumerate(_SENTENCE_RE.finditer(text)):
+            sentence = " ".join(match.group().split())
+            if not 30 <= len(sentence) <= 400:
+                continue
+            score = 2 * bool(_DIGIT_RE.search(sentence)) + len(_PROPER_NAME_RE.findall(sentence))
+            if score:
+                scored.append((-score, position, sentence))
+        best = sorted(scored)[: self.max_claims]
+        # Возвращаем в порядке текста
+        return self._unique(sentence for _, _, sentence in sorted(best, key=lambda item: item[1]))
+
+    def _unique(self, claims) -> List[str]:
+        seen = set()
+        unique = []
+        for claim in claims:
+            claim = claim.strip()
+            key = ResultCacheService.normalize(claim)
+            if len(claim) < 10 or key in seen:
+                continue
+            seen.add(key)
+            unique.append(claim)
+            if len(unique) >= self.max_claims:
+                break
+        return unique
+
+    # --- Проверка ---
+
+    @classmethod
+    def parse_verdict(cls, report: str) -> str:
+        if not report or report.startswith("❌"):
+            return "error"
+        tokens = {match.group(1).casefold() for match in VERDICT_TAG_RE.finditer(report)}
+        if len(tokens) == 1:
+            return _VERDICT_TOKENS[tokens.pop()]
+        # Строка после заголовка может оказаться повтором подписи из запроса — тогда смотрим следующую
+        for line in cls._summary_lines(report):
+            match = _VERDICT_WORDS_RE.search(_VERDICT_OPTIONS_RE.sub(" ", line))
+            if match is None:
+                continue
+            verdict = match.lastgroup
+            if match.group("neg"):
+                # «не является истинным», «не подтверждается» — ложно; «не опровергнуто» ничего не доказывает
+                return {"true": "false", "false": "unverified"}.get(verdict, "partly")
+            return verdict
+        return "unverified"
+
+    @staticmethod
+    def _summary_lines(report: str) -> List[str]:
+        """Текст после заголовка «КРАТКИЙ ВЫВОД» и следующая строка (или первая строка ответа)"""
+        lines = [line.strip() for line in report.splitlines() if line.strip()]
+        for index, line in enumerate(lines):
+            if "КРАТКИЙ ВЫВОД" in line.upper():
+                rest = line[line.upper().index("КРАТКИЙ ВЫВОД") + len("КРАТКИЙ ВЫВОД"):]
+                rest = rest.strip(" *_#:-—")
+                return ([rest] if rest else []) + lines[index + 1:index + 2]
+        return lines[:1]
+
+    @classmethod
+    def _summary(cls, report: str) -> str:
+        """Текст краткого вывода (или первая строка ответа)"""
+        lines = cls._summary_lines(report)
+        return lines[0] if lines else ""
+
+    async def verify(self, claims: List[str], on_progress: Optional[ProgressCallback] = None) -> List[ClaimVerdict]:
+        """Проверяет утверждения параллельно (не больше concurrency одновременно)"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        done = 0
+
+        async def check(claim: str) -> ClaimVerdict:
+            nonlocal done
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    report, from_cache = await self.cache.get_or_compute(
+                        "fact_check", claim, lambda: self.fact_checker.check_fact(claim, with_verdict_tag=True)
+                    )
+                except Exception as e:
+                    logger.error("Ошибка проверки утверждения: %s", e)
+                    report, from_cache = f"❌ Ошибка при проверке факта: {e}", False
+            done += 1
+            if on_progress is not None:
+                on_progress(f"🔍 Проверено утверждений: {done} из {len(claims)}...")
+            return ClaimVerdict(
+                claim=claim,
+                verdict=self.parse_verdict(report),
+                summary=self._summary(report),
+                report=report,
+                from_cache=from_cache,
+                duration=time.monotonic() - started,
+            )
+
+        return list(await asyncio.gather(*(check(claim) for claim in claims)))
+
+    # --- Итоговый отчёт ---
+
+    def merge(self, verdicts: List[ClaimVerdict]) -> str:
+        """Сводный отчёт по всем утверждениям"""
+        counts = {verdict: 0 for verdict in VERDICT_LABELS}
+        for item in verdicts:
+            counts[item.verdict] += 1
+        checked = len(verdicts) - counts["error"]
+
+        lines = ["📋 **КРАТКИЙ ВЫВОД**", ""]
+        lines.append(f"Проверено утверждений: {checked} из {len(verdicts)}.")
+        for verdict, label in VERDICT_LABELS.items():
+            if counts[verdict]:
+                lines.append(f"{label}: {counts[verdict]}")
+        lines += ["", "🔍 **ПРОВЕРКА УТВЕРЖДЕНИЙ**", ""]
+        for number, item in enumerate(verdicts, 1):
+            lines.append(f"{number}. {VERDICT_LABELS[item.verdict]}")
+            lines.append(f"_{_plain(item.claim)}_")
+            if item.summary and item.verdict != "error":
+                lines.append(_plain(item.summary)[:400])
+            lines.append("")
+
+        sources = self._sources(verdicts)
+        if sources:
+            lines += ["📚 **ИСТОЧНИКИ ВЕРИФИКАЦИИ**", ""]
+            for citation in sources:
+                title = _plain(citation.title or citation.domain)
+                lines.append(f"• [{title}]({citation.url})")
+        return "\n".join(lines).strip()
+
+    def _sources(self, verdicts: List[ClaimVerdict], limit: int = 10) -> List[Citation]:
+        extractor = CitationExtractor(score_domain=self.score_domain)
+        for item in verdicts:
+            if item.verdict != "error":
+                extractor.feed(item.report + "\n")
+        extractor.close()
+        citations = extractor.citations
+        # Чаще упоминаемые и более надежные источники — выше
+        citations.sort(key=lambda c: (-(c.score or 0.0), -c.mentions))
+        return citations[:limit]
+
+    @observe_latency("claim_pipeline")
+    async def analyze(self, text: str, is_url: bool, on_progress: Optional[ProgressCallback] = None) -> Optional[str]:
+        """Сводный отчёт по утверждениям или None, если разобрать статью не удалось"""
+        claims = await self.extract_claims(text, is_url)
+        if not claims:
+            logger.info("Утверждения не выделены, анализируем статью целиком")
+            return None
+        logger.info("Выделено утверждений: %s", len(claims))
+        if on_progress is not None:
+            on_progress(f"🔍 Выделено утверждений: {len(claims)}. Проверяю...")
+        verdicts = await self.verify(claims, on_progress)
+        if all(item.verdict == "error" for item in verdicts):
+            return None
+        return self.merge(verdicts)
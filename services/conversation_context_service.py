@@ -0,0 +1,304 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Признак способа хранения текста (первый байт)
+_RAW = b"r"
+_ZLIB = b"z"
+
+# Примерные накладные расходы записи в памяти (ключ, кортеж, объекты bytes)
+_ENTRY_OVERHEAD = 200
+
+# user_id -> (expires_at, тема, анализ)
+_Entry = Tuple[float, bytes, Optional[bytes]]
+
+
+@dataclass(frozen=True)
+class FollowUpContext:
+    """Последний результат пользователя, по которому можно запустить Deep Research"""
+    topic: str
+    analysis: Optional[str]
+
+
+class ConversationContextService:
+    """Хранилище контекста для Deep Research с общим бюджетом памяти.
+
+    Для каждого пользователя хранится только последний результат (тема и
+    анализ). Тексты длиннее ``compress_min_bytes`` сжимаются zlib. Записи
+    старше ``ttl`` не выдаются и удаляются периодической очисткой; при
+    превышении ``max_bytes`` вытесняются давно не использованные записи —
+    в SQLite (``spill_path``), если он задан, иначе безвозвратно. Запись,
+    поднятая с диска, возвращается в память; при остановке записи из памяти
+    тоже сохраняются на диск.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+        compress_min_bytes: int = 512,
+        compress_level: int = 6,
+        spill_path: Optional[str] = None,
+        sweep_interval: float = 60.0,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self.sweep_interval = sweep_interval
+        self._memory: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._memory_bytes = 0
+        # Вытесненные записи, которые еще пишутся на диск
+        self._spilling: Dict[int, _Entry] = {}
+        # user_id -> [блокировка, число ожидающих]: set, delete и подъём с диска для одного пользователя идут по очереди
+        self._user_locks: Dict[int, List[Any]] = {}
+        self.evicted = 0
+        self.expired = 0
+        self.spilled = 0
+        self.disk_hits = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._sweep_task: Optional[asyncio.Task] = None
+        if spill_path:
+            self._open_db(spill_path)
+
+    @classmethod
+    def from_config(cls, config) -> "ConversationContextService":
+        return cls(
+            max_bytes=config.CONTEXT_MAX_BYTES,
+            ttl=config.CONTEXT_TTL,
+            compress_min_bytes=config.CONTEXT_COMPRESS_MIN_BYTES,
+            spill_path=config.DATABASE_PATH if config.CONTEXT_SPILL_TO_DISK else None,
+        )
+
+    # --- Кодирование ---
+
+    def _encode(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        if len(data) >= self.compress_min_bytes:
+            compressed = zlib.compress(data, self.compress_level)
+            if len(compressed) < len(data):
+                return _ZLIB + compressed
+        return _RAW + data
+
+    @staticmethod
+    def _decode(blob: bytes) -> str:
+        data = blob[1:]
+        if blob[:1] == _ZLIB:
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    @staticmethod
+    def _size(entry: _Entry) -> int:
+        return _ENTRY_OVERHEAD + len(entry[1]) + (len(entry[2]) if entry[2] is not None else 0)
+
+    # --- Слой в памяти ---
+
+    def _memory_remove(self, user_id: int) -> Optional[_Entry]:
+        entry = self._memory.pop(user_id, None)
+        if entry is not None:
+            self._memory_bytes -= self._size(entry)
+        return entry
+
+    def _memory_set(self, user_id: int, entry: _Entry) -> List[Tuple[int, _Entry]]:
+        """Кладет запись в память; возвращает вытесненные записи"""
+        self._memory_remove(user_id)
+        self._memory[user_id] = entry
+        self._memory_bytes += self._size(entry)
+        evicted: List[Tuple[int, _Entry]] = []
+        # Последнюю запись не вытесняем, даже если она одна больше бюджета
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            evicted_id, evicted_entry = self._memory.popitem(last=False)
+            self._memory_bytes -= self._size(evicted_entry)
+            self.evicted += 1
+            evicted.append((evicted_id, evicted_entry))
+        return evicted
+
+    # --- Слой на диске ---
+
+    def _open_db(self, db_path: str) -> None:
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_context ("
+            "user_id INTEGER PRIMARY KEY, topic BLOB NOT NULL, analysis BLOB, expires_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        logger.info("Контекст Deep Research вытесняется на диск: %s", db_path)
+
+    def _db_write(self, entries: List[Tuple[int, _Entry]], pending_only: bool = False) -> None:
+        with self._db_lock:
+            if pending_only:
+                # Запись, которую уже удалили или заменили, пока ждали блокировку, на диск не возвращаем
+                entries = [(user_id, entry) for user_id, entry in entries if self._spilling.get(user_id) is entry]
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO conversation_context (user_id, expires_at, topic, analysis) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(user_id, *entry) for user_id, entry in entries],
+                )
+
+    def _db_take(self, user_id: int) -> Optional[_Entry]:
+        """Забирает запись с диска (она возвращается в память)"""
+        with self._db_lock:
+            with self._db:
+                row = self._db.execute(
+                    "SELECT expires_at, topic, analysis FROM conversation_context WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("DELETE FROM conversation_context WHERE user_id = ?", (user_id,))
+        return row
+
+    def _db_delete(self, user_id: int) -> None:
+        with self._db_lock:
+            with self._db:
+                self._db.execute("DELETE FROM conversation_context WHERE user_id = ?", (user_id,))
+
+    def _db_prune(self, now: float) -> int:
+        with self._db_lock:
+            with self._db:
+                return self._db.execute(
+                    "DELETE FROM conversation_context WHERE expires_at <= ?", (now,)
+                ).rowcount
+
+    async def _spill(self, evicted: List[Tuple[int, _Entry]]) -> None:
+        if self._db is None or not evicted:
+            return
+        for user_id, entry in evicted:
+            self._spilling[user_id] = entry
+        try:
+            await asyncio.to_thread(self._db_write, evicted, True)
+            self.spilled += len(evicted)
+        except sqlite3.Error as e:
+            logger.error("Не удалось сохранить контекст на диск: %s", e)
+        finally:
+            for user_id, entry in evicted:
+                if self._spilling.get(user_id) is entry:
+                    del self._spilling[user_id]
+
+    @asynccontextmanager
+    async def _user_lock(self, user_id: int) -> AsyncIterator[None]:
+        entry = self._user_locks.get(user_id)
+        if entry is None:
+            entry = self._user_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._user_locks.pop(user_id, None)
+
+    # --- Публичный API ---
+
+    async def set(self, user_id: int, topic: str, analysis: Optional[str] = None) -> None:
+        """Запоминает последний результат пользователя"""
+        entry = (
+            time.time() + self.ttl,
+            self._encode(topic),
+            self._encode(analysis) if analysis else None,
+        )
+        async with self._user_lock(user_id):
+            self._spilling.pop(user_id, None)
+            await self._spill(self._memory_set(user_id, entry))
+
+    async def get(self, user_id: int) -> Optional[FollowUpContext]:
+        """Последний результат пользователя или None (не было, устарел или вытеснен)"""
+        entry = self._memory.get(user_id)
+        if entry is not None:
+            self._memory.move_to_end(user_id)
+        else:
+            async with self._user_lock(user_id):
+                # Пока ждали блокировку, set мог положить запись новее той, что на диске
+                entry = self._memory.get(user_id) or self._spilling.get(user_id)
+                if entry is None and self._db is not None:
+                    entry = await asyncio.to_thread(self._db_take, user_id)
+                    if entry is not None:
+                        self.disk_hits += 1
+                if entry is not None and entry[0] > time.time() and self._memory.get(user_id) is not entry:
+                    await self._spill(self._memory_set(user_id, entry))
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self._memory_remove(user_id)
+            self.expired += 1
+            return None
+        return FollowUpContext(
+            topic=self._decode(entry[1]),
+            analysis=self._decode(entry[2]) if entry[2] is not None else None,
+        )
+
+    async def delete(self, user_id: int) -> None:
+        async with self._user_lock(user_id):
+            self._memory_remove(user_id)
+            self._spilling.pop(user_id, None)
+            if self._db is not None:
+                await asyncio.to_thread(self._db_delete, user_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._memory),
+            "bytes": self._memory_bytes,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "spilled": self.spilled,
+            "disk_hits": self.disk_hits,
+        }
+
+    # --- Очистка устаревших записей ---
+
+    async def sweep(self) -> int:
+        """Удаляет записи старше TTL из памяти и с диска"""
+        now = time.time()
+        stale = [user_id for user_id, entry in self._memory.items() if entry[0] <= now]
+        for user_id in stale:
+            self._memory_remove(user_id)
+        removed = len(stale)
+        if self._db is not None:
+            try:
+                removed += await asyncio.to_thread(self._db_prune, now)
+            except sqlite3.Error as e:
+                logger.error("Ошибка очистки контекста на диске: %s", e)
+        self.expired += removed
+        return removed
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+    async def start(self) -> None:
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def close(self) -> None:
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+        if self._db is not None:
+            # Живые записи из памяти сохраняются на диск и переживают перезапуск
+            now = time.time()
+            live = [(user_id, entry) for user_id, entry in self._memory.items() if entry[0] > now]
+            if live:
+                try:
+                    self._db_write(live)
+                except sqlite3.Error as e:
+                    logger.error("Не удалось сохранить контекст на диск: %s", e)
+            with self._db_lock:
+                self._db.close()
+            self._db = None
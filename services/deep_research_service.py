@@ -1,22 +1,29 @@
-import aiohttp
-import asyncio
-from loguru import logger
+from typing import Optional
 from app_config import Config
+from services.perplexity_client import DeltaCallback, PerplexityClient
+from utils.logger import setup_logger
+from utils.metrics import observe_latency
+
+logger = setup_logger(__name__)
 
 class DeepResearchService:
-    def __init__(self) -> None:
+    def __init__(self, client: Optional[PerplexityClient] = None) -> None:
         self.api_key = Config.PERPLEXITY_API_KEY
-        self.base_url = "https://api.perplexity.ai/chat/completions"
+        self.client = client or PerplexityClient.from_config(Config)
+        self.read_timeout = Config.DEEP_RESEARCH_READ_TIMEOUT
         
-    async def conduct_deep_research(self, topic: str, initial_analysis: str) -> str:
+    @observe_latency("deep_research")
+    async def conduct_deep_research(
+        self, topic: str, initial_analysis: str, on_delta: Optional[DeltaCallback] = None
+    ) -> str:
         """Проводит углубленное исследование с использованием дорогой модели"""
         
-        logger.info(f"Начинаем Deep Research для темы: {topic}")
-        logger.info(f"Начальный анализ: {initial_analysis[:200]}...")
+        logger.debug("Начинаем Deep Research для темы: %s", topic)
+        logger.debug("Начальный анализ: %s", initial_analysis)
         
         # Формируем промпт на основе простого анализа
         research_prompt = self._generate_research_prompt(topic, initial_analysis)
-        logger.info(f"Сгенерирован промпт для Deep Research: {research_prompt[:200]}...")
+        logger.debug("Сгенерирован промпт для Deep Research: %s", research_prompt)
         
         messages = [
             {
@@ -53,29 +60,26 @@ class DeepResearchService:
             "stream": False
         }
         
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        logger.info("Отправляем запрос в Perplexity API для Deep Research...")
+        logger.debug("Payload: %s", payload)
         
-        logger.info(f"Запускаем Deep Research для темы: {topic[:100]}...")
-        logger.info(f"Отправляем запрос в Perplexity API для Deep Research...")
-        logger.info(f"Payload: {payload}")
+        if on_delta is not None:
+            response = await self.client.stream_chat(
+                payload, on_delta, read_timeout=self.read_timeout, idempotent=False
+            )
+        else:
+            # Дорогой запрос повторяем только если он не дошёл до API
+            response = await self.client.post_chat(payload, read_timeout=self.read_timeout, idempotent=False)
+        logger.info("Получен ответ от API: %s", response.status)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.base_url, json=payload, headers=headers) as response:
-                logger.info(f"Получен ответ от API: {response.status}")
-                
-                if response.status == 200:
-                    result = await response.json()
-                    content = result['choices'][0]['message']['content']
-                    logger.info(f"Deep Research завершен, получено {len(content)} символов")
-                    logger.info(f"Результат Deep Research: {content[:200]}...")
-                    return content
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Ошибка Deep Research API: {response.status} - {error_text}")
-                    return f"❌ Ошибка при проведении Deep Research: {response.status}"
+        if response.ok:
+            content = response.content
+            logger.info("Deep Research завершен, получено %s символов", len(content))
+            logger.debug("Результат Deep Research: %s", content)
+            return content
+        else:
+            logger.error("Ошибка Deep Research API: %s - %s", response.status, response.text)
+            return f"❌ Ошибка при проведении Deep Research: {response.status}"
     
     def _generate_research_prompt(self, topic: str, initial_analysis: str) -> str:
         """Генерирует детальный промпт для Deep Research на основе простого анализа"""
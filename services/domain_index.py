@@ -0,0 +1,108 @@
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Оценки категорий во внешнем файле доменов
+CATEGORY_SCORES: Dict[str, float] = {
+    "high": 0.9,
+    "medium": 0.7,
+    "biased": 0.3,
+    "low": 0.1,
+}
+
+
+def normalize_host(host: str) -> str:
+    """Приводит имя хоста к виду ключа индекса: нижний регистр, без www. и точки в конце"""
+    host = host.strip().lower().rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    return host
+
+
+class DomainIndex:
+    """Таблица суффиксов доменов с оценками надежности.
+
+    Домен совпадает сам с собой и со всеми поддоменами: ``cnn.com`` покрывает
+    ``edition.cnn.com``, но не ``notcnn.com``. Поиск перебирает суффиксы хоста по
+    границам меток от самого длинного, поэтому занимает O(число меток) обращений
+    к словарю и побеждает самая специфичная запись. Если один домен встречается
+    с разными оценками, берётся результат ``resolve`` (по умолчанию — минимальная,
+    самая осторожная оценка), так что итог не зависит от порядка загрузки.
+    """
+
+    def __init__(self, resolve: Callable[[float, float], float] = min) -> None:
+        self.resolve = resolve
+        self._table: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __contains__(self, domain: str) -> bool:
+        return normalize_host(domain) in self._table
+
+    def add(self, domain: str, score: float) -> None:
+        domain = normalize_host(domain)
+        if not domain:
+            return
+        current = self._table.get(domain)
+        self._table[domain] = score if current is None else self.resolve(current, score)
+
+    def add_many(self, domains: Iterable[str], score: float) -> None:
+        for domain in domains:
+            self.add(domain, score)
+
+    def update(self, other: "DomainIndex") -> None:
+        """Переносит записи другого индекса; они заменяют существующие"""
+        self._table.update(other._table)
+
+    @classmethod
+    def load(cls, path: str, resolve: Callable[[float, float], float] = min) -> "DomainIndex":
+        """Загружает индекс из файла: ``домен<TAB>категория`` или ``домен<TAB>оценка`` на строку.
+
+        Категории — high, medium, biased, low; пустые строки и строки с ``#`` пропускаются.
+        """
+        index = cls(resolve)
+        skipped = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line[0] == "#":
+                    continue
+                fields = line.split(None, 1)
+                if len(fields) != 2:
+                    skipped += 1
+                    continue
+                domain, value = fields
+                value = value.strip().lower()
+                score = CATEGORY_SCORES.get(value)
+                if score is None:
+                    try:
+                        score = float(value)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                index.add(domain, score)
+        if skipped:
+            logger.warning("Файл доменов %s: пропущено строк с ошибками: %s", path, skipped)
+        logger.info("Загружено доменов из %s: %s", path, len(index))
+        return index
+
+    def match(self, host: str) -> Optional[Tuple[str, float]]:
+        """Самая специфичная запись, покрывающая хост: (домен, оценка) или None"""
+        table = self._table
+        position = 0
+        while True:
+            suffix = host[position:] if position else host
+            score = table.get(suffix)
+            if score is not None:
+                return suffix, score
+            position = host.find(".", position) + 1
+            if position == 0:
+                return None
+
+    def lookup(self, host: str) -> Optional[float]:
+        """Оценка для уже нормализованного хоста или None, если он не покрыт индексом"""
+        found = self.match(host)
+        return found[1] if found is not None else None
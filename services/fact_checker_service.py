@@ -1,15 +1,43 @@
-import aiohttp
+import re
 from typing import Optional
-from loguru import logger
+
+from services.perplexity_client import DeltaCallback, PerplexityClient
+from utils.logger import setup_logger
+from utils.metrics import observe_latency
+
+logger = setup_logger(__name__)
+
+# Машиночитаемая метка вердикта (check_fact с with_verdict_tag) — отдельной строкой
+VERDICT_TAG_RE = re.compile(
+    r"^[\W_]*ВЕРДИКТ[\W_]*(ИСТИННО|ЛОЖНО|ЧАСТИЧНО|НЕ УСТАНОВЛЕНО)[\W_]*$", re.IGNORECASE | re.MULTILINE
+)
+
+_VERDICT_TAG_INSTRUCTION = (
+    "\n- Первая строка ответа — только метка вердикта, ровно одна из: "
+    "ВЕРДИКТ: ИСТИННО, ВЕРДИКТ: ЛОЖНО, ВЕРДИКТ: ЧАСТИЧНО, ВЕРДИКТ: НЕ УСТАНОВЛЕНО"
+)
+
+
+def strip_verdict_tag(text: str) -> str:
+    """Убирает метку вердикта из ответа, который показывается пользователю"""
+    return VERDICT_TAG_RE.sub("", text, count=1).lstrip("\n")
+
 
 class FactCheckerService:
-    def __init__(self, api_key: str) -> None:
+    def __init__(self, api_key: str, client: Optional[PerplexityClient] = None) -> None:
         self.api_key = api_key
-        self.base_url = "https://api.perplexity.ai/chat/completions"
+        self.client = client or PerplexityClient(api_key)
+
+    @observe_latency("fact_checker")
+    async def check_fact(
+        self, statement: str, on_delta: Optional[DeltaCallback] = None, with_verdict_tag: bool = False
+    ) -> str:
+        """Проверяет факт с помощью Perplexity API (потоково, если передан on_delta).
 
-    async def check_fact(self, statement: str) -> str:
-        """Проверяет факт с помощью Perplexity API"""
-        logger.info(f"Проверяем факт: {statement}")
+        С ``with_verdict_tag`` первой строкой ответа идет машиночитаемая метка
+        вердикта (для разбора утверждений и пакетной проверки).
+        """
+        logger.debug("Проверяем факт: %s", statement)
         
         messages = [
             {
@@ -27,7 +55,7 @@ class FactCheckerService:
 - Отвечай ТОЛЬКО на русском языке
 - Используй только проверенные, независимые источники
 - Формат ссылок: [Название источника](URL)
-- Будь объективным и беспристрастным"""
+- Будь объективным и беспристрастным""" + (_VERDICT_TAG_INSTRUCTION if with_verdict_tag else "")
             },
             {
                 "role": "user",
@@ -43,23 +71,19 @@ class FactCheckerService:
             "stream": False
         }
         
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        result = data['choices'][0]['message']['content']
-                        logger.info(f"Факт-чек завершен, получено {len(result)} символов")
-                        return result
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Ошибка API факт-чека: {response.status} - {error_text}")
-                        return f"❌ Ошибка при проверке факта: {response.status}"
+            if on_delta is not None:
+                response = await self.client.stream_chat(payload, on_delta)
+            else:
+                # Короткие проверки страхуем повторным запросом, если ответ задерживается
+                response = await self.client.post_chat(payload, hedge=True)
+            if response.ok:
+                result = response.content
+                logger.info("Факт-чек завершен, получено %s символов", len(result))
+                return result
+            else:
+                logger.error("Ошибка API факт-чека: %s - %s", response.status, response.text)
+                return f"❌ Ошибка при проверке факта: {response.status}"
         except Exception as e:
-            logger.error(f"Ошибка при проверке факта: {str(e)}")
+            logger.error("Ошибка при проверке факта: %s", str(e))
             return f"❌ Ошибка при проверке факта: {str(e)}"
@@ -0,0 +1,361 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.perplexity_client import DeltaCallback
+from services.resilience import CircuitOpenError
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@dataclass
+class DeepResearchJob:
+    """Задача Deep Research, сохранённая в очереди"""
+    id: int
+    user_id: int
+    chat_id: int
+    message_id: int
+    topic: str
+    initial_analysis: str
+    cost: int
+    status: str
+    attempts: int
+    result: Optional[str]
+    error: Optional[str]
+    progress_chars: int
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+
+    @property
+    def duration(self) -> int:
+        if self.started_at is None or self.finished_at is None:
+            return 0
+        return int(self.finished_at - self.started_at)
+
+
+_JOB_COLUMNS = (
+    "id, user_id, chat_id, message_id, topic, initial_analysis, cost, status, attempts, "
+    "result, error, progress_chars, created_at, started_at, finished_at"
+)
+
+# Исполнитель задачи: получает задачу и колбэк прогресса, возвращает текст результата
+JobRunner = Callable[[DeepResearchJob, DeltaCallback], Awaitable[str]]
+# Доставка результата (или ошибки) пользователю
+JobDelivery = Callable[[DeepResearchJob], Awaitable[None]]
+
+
+class JobQueueService:
+    """Постоянная очередь задач Deep Research в SQLite с ограниченным пулом исполнителей.
+
+    Состояние задачи (queued → running → done/failed → доставлена) сохраняется в базе.
+    Исполнитель держит аренду задачи и продлевает её; если процесс упал, аренда
+    истекает и задача выполняется заново. Готовые, но не доставленные результаты
+    отправляются пользователю после перезапуска. Число задач по статусам
+    считается один раз при открытии базы и дальше ведется в памяти при смене
+    статуса (в многопроцессном режиме — по задачам своего шарда).
+    """
+
+    DEFAULT_DURATION = 210.0
+
+    def __init__(
+        self,
+        db_path: str,
+        workers: int = 2,
+        lease_seconds: float = 90.0,
+        max_attempts: int = 2,
+        poll_interval: float = 2.0,
+        shard: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        # (номер, число процессов): в многопроцессном режиме берём только задачи своих пользователей
+        self.shard = shard
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.runner: Optional[JobRunner] = None
+        self.deliver: Optional[JobDelivery] = None
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._counts: Dict[str, int] = {}
+        self._create_schema()
+        self._load_counts()
+
+    def _create_schema(self) -> None:
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS deep_research_jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+                "chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, "
+                "topic TEXT NOT NULL, initial_analysis TEXT NOT NULL, cost INTEGER NOT NULL DEFAULT 0, "
+                "status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, "
+                "result TEXT, error TEXT, progress_chars INTEGER NOT NULL DEFAULT 0, "
+                "worker TEXT, lease_until REAL, delivered INTEGER NOT NULL DEFAULT 0, "
+                "refunded INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_deep_research_jobs_status ON deep_research_jobs(status, id)"
+            )
+
+    def _load_counts(self) -> None:
+        shard_sql, shard_params = self._shard_filter()
+        rows = self._execute(
+            f"SELECT status, COUNT(*) FROM deep_research_jobs WHERE 1{shard_sql} GROUP BY status", shard_params
+        )
+        self._counts = {"queued": 0, "running": 0, "done": 0, "failed": 0, **dict(rows)}
+
+    def _move(self, old: Optional[str], new: str) -> None:
+        """Учитывает смену статуса задачи (вызывается под _db_lock)"""
+        if old == new:
+            return
+        if old is not None:
+            self._counts[old] = self._counts.get(old, 0) - 1
+        self._counts[new] = self._counts.get(new, 0) + 1
+
+    def _shard_filter(self) -> Tuple[str, Tuple]:
+        if self.shard is None:
+            return "", ()
+        index, count = self.shard
+        return " AND user_id % ? = ?", (count, index)
+
+    def _execute(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _insert(self, sql: str, params: Tuple) -> int:
+        with self._db_lock:
+            job_id = self._db.execute(sql, params).lastrowid
+            self._move(None, "queued")
+            return job_id
+
+    @staticmethod
+    def _to_job(row: Tuple) -> DeepResearchJob:
+        return DeepResearchJob(*row)
+
+    # --- Постановка и статус ---
+
+    async def submit(
+        self, user_id: int, chat_id: int, message_id: int, topic: str, initial_analysis: str, cost: int
+    ) -> int:
+        """Сохраняет задачу в очереди и возвращает её номер"""
+        job_id = await asyncio.to_thread(
+            self._insert,
+            "INSERT INTO deep_research_jobs (user_id, chat_id, message_id, topic, initial_analysis, cost, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, chat_id, message_id, topic, initial_analysis, cost, time.time()),
+        )
+        self._wakeup.set()
+        logger.info("Deep Research #%s поставлен в очередь для пользователя %s", job_id, user_id)
+        return job_id
+
+    async def get(self, job_id: int) -> Optional[DeepResearchJob]:
+        rows = await asyncio.to_thread(
+            self._execute, f"SELECT {_JOB_COLUMNS} FROM deep_research_jobs WHERE id = ?", (job_id,)
+        )
+        return self._to_job(rows[0]) if rows else None
+
+    def _average_duration(self) -> float:
+        average = self._execute(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM deep_research_jobs "
+            "WHERE status = 'done' ORDER BY id DESC LIMIT 20)"
+        )[0][0]
+        return average or self.DEFAULT_DURATION
+
+    def _position(self, job_id: int) -> Tuple[int, float]:
+        ahead = self._execute(
+            "SELECT COUNT(*) FROM deep_research_jobs WHERE status = 'queued' AND id < ?", (job_id,)
+        )[0][0]
+        average = self._average_duration()
+        # Задачи впереди расходятся по исполнителям; своя выполняется целиком
+        eta = (ahead // max(1, self.workers) + 1) * average
+        return ahead + 1, eta
+
+    async def position(self, job_id: int) -> Tuple[int, float]:
+        """Позиция задачи в очереди (1 — следующая) и оценка времени до результата, с"""
+        return await asyncio.to_thread(self._position, job_id)
+
+    def stats(self) -> dict:
+        """Задачи по статусам (без запроса к базе — снимается при каждом опросе /metrics)"""
+        with self._db_lock:
+            return dict(self._counts)
+
+    # --- Исполнение ---
+
+    def _claim(self) -> Optional[DeepResearchJob]:
+        # У задачи в очереди lease_until — время, раньше которого её не берём (отложенный повтор)
+        now = time.time()
+        shard_sql, shard_params = self._shard_filter()
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    f"SELECT {_JOB_COLUMNS} FROM deep_research_jobs "
+                    f"WHERE ((status = 'queued' AND (lease_until IS NULL OR lease_until <= ?)) "
+                    f"OR (status = 'running' AND lease_until < ?)){shard_sql} "
+                    "ORDER BY id LIMIT 1",
+                    (now, now, *shard_params),
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE deep_research_jobs SET status = 'running', worker = ?, lease_until = ?, "
+                    "attempts = attempts + 1, started_at = ? WHERE id = ?",
+                    (self.worker_id, now + self.lease_seconds, now, row[0]),
+                )
+                self._db.execute("COMMIT")
+                self._move(row[7], "running")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        job = self._to_job(row)
+        job.status, job.attempts, job.started_at = "running", job.attempts + 1, now
+        return job
+
+    def _heartbeat(self, job_id: int, progress_chars: int) -> None:
+        self._execute(
+            "UPDATE deep_research_jobs SET lease_until = ?, progress_chars = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time() + self.lease_seconds, progress_chars, job_id, self.worker_id),
+        )
+
+    def _finish(self, job_id: int, status: str, result: Optional[str], error: Optional[str]) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE deep_research_jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+                "WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+            self._move("running", status)
+
+    def _requeue(self, job_id: int, count_attempt: bool, delay: float = 0.0) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE deep_research_jobs SET status = 'queued', worker = NULL, lease_until = ?, "
+                "attempts = attempts - ? WHERE id = ?",
+                (time.time() + delay if delay > 0 else None, 0 if count_attempt else 1, job_id),
+            )
+            self._move("running", "queued")
+
+    def _claim_refund(self, job_id: int) -> bool:
+        with self._db_lock:
+            return self._db.execute(
+                "UPDATE deep_research_jobs SET refunded = 1 WHERE id = ? AND status = 'failed' AND refunded = 0",
+                (job_id,),
+            ).rowcount == 1
+
+    async def claim_refund(self, job_id: int) -> bool:
+        """Отмечает возврат оплаты упавшей задачи; True — только при первом вызове.
+
+        Доставка сообщения повторяется после перезапуска, а возврат — нет.
+        """
+        return await asyncio.to_thread(self._claim_refund, job_id)
+
+    def _mark_delivered(self, job_id: int) -> None:
+        self._execute("UPDATE deep_research_jobs SET delivered = 1 WHERE id = ?", (job_id,))
+
+    async def _run_job(self, job: DeepResearchJob) -> None:
+        progress = {"chars": 0}
+
+        def on_delta(text: str) -> None:
+            progress["chars"] = len(text)
+
+        async def heartbeat() -> None:
+            while True:
+                await asyncio.sleep(self.lease_seconds / 3)
+                await asyncio.to_thread(self._heartbeat, job.id, progress["chars"])
+
+        logger.info("Deep Research #%s: попытка %s", job.id, job.attempts)
+        beat = asyncio.create_task(heartbeat())
+        try:
+            result = await self.runner(job, on_delta)
+            if result.startswith("❌"):
+                raise RuntimeError(result)
+        except asyncio.CancelledError:
+            # Остановка процесса: задача вернётся в очередь без учёта попытки
+            await asyncio.to_thread(self._requeue, job.id, False)
+            raise
+        except CircuitOpenError as e:
+            # API недоступен и запрос не отправлялся: попытку не учитываем и ждём восстановления
+            logger.warning("Deep Research #%s отложен на %.1f с: %s", job.id, e.retry_in, e)
+            await asyncio.to_thread(self._requeue, job.id, False, e.retry_in)
+            return
+        except Exception as e:
+            logger.error("Deep Research #%s завершился ошибкой: %s", job.id, e)
+            if job.attempts < self.max_attempts:
+                await asyncio.to_thread(self._requeue, job.id, True)
+                return
+            await asyncio.to_thread(self._finish, job.id, "failed", None, str(e))
+        else:
+            await asyncio.to_thread(self._finish, job.id, "done", result, None)
+        finally:
+            beat.cancel()
+        await self._deliver(job.id)
+
+    async def _deliver(self, job_id: int) -> None:
+        job = await self.get(job_id)
+        if job is None or self.deliver is None:
+            return
+        try:
+            await self.deliver(job)
+        except Exception as e:
+            logger.error("Не удалось доставить результат Deep Research #%s: %s", job_id, e)
+            return
+        await asyncio.to_thread(self._mark_delivered, job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as e:
+                logger.error("Ошибка очереди Deep Research: %s", e)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job.attempts > self.max_attempts:
+                # Аренда истекла после последней попытки (процесс падал во время выполнения)
+                await asyncio.to_thread(self._finish, job.id, "failed", None, "превышено число попыток")
+                await self._deliver(job.id)
+                continue
+            await self._run_job(job)
+
+    async def start(self) -> None:
+        """Доставляет результаты, оставшиеся с прошлого запуска, и запускает исполнителей"""
+        shard_sql, shard_params = self._shard_filter()
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT id FROM deep_research_jobs WHERE status IN ('done', 'failed') AND delivered = 0{shard_sql}",
+            shard_params,
+        )
+        for (job_id,) in rows:
+            await self._deliver(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("Очередь Deep Research запущена: исполнителей %s", self.workers)
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        with self._db_lock:
+            self._db.close()
@@ -0,0 +1,112 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+# Служебные слова, не влияющие на смысл утверждения (отрицания сохраняем)
+STOPWORDS: FrozenSet[str] = frozenset(
+    "а в во вот да для до же за и из или к как ко ли либо на над о об от по под после при про "
+    "с со так также то у что чтобы это этот эта эти тот та те там тут уже еще бы был была было были "
+    "быть есть его ее их им ему ей мы вы они он она оно я ты мне меня нам нас вам вас все всё весь "
+    "вся всех the a an of to in on is are was were be that this".split()
+)
+
+# Вводные слова вопросов-перефразировок в начале утверждения: «правда ли, что…», «говорят, что…»
+PREFIX_WORDS: FrozenSet[str] = frozenset(
+    "правда верно действительно говорят слышал слышала слышали пишут скажи скажите подскажи "
+    "подскажите проверь проверьте интересно".split()
+)
+
+# Окончания для грубого стемминга (от длинных к коротким)
+_ENDINGS = tuple(sorted(
+    "иями ями ами иях ах ях ого его ому ему ыми ими ой ей ий ый ая яя ое ее ые ие ую юю ом ем ам ям "
+    "ов ев ла ли ло ть ет ит ут ют ат ят ся ы и а я о е у ю ь".split(),
+    key=len, reverse=True,
+))
+
+_WORD_RE = re.compile(r"[0-9a-zа-я]+")
+
+
+def _stem(word: str) -> str:
+    if word.isdigit() or len(word) <= 4:
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 4:
+            return word[:-len(ending)]
+    return word
+
+
+def claim_tokens(text: str) -> FrozenSet[str]:
+    """Нормализованные слова утверждения: регистр, ё→е, без служебных и вводных слов"""
+    words = _WORD_RE.findall(text.casefold().replace("ё", "е"))
+    words = [w for w in words if w not in STOPWORDS]
+    start = 0
+    while start < len(words) and words[start] in PREFIX_WORDS:
+        start += 1
+    return frozenset(_stem(w) for w in words[start:])
+
+
+def claim_fingerprint(tokens: FrozenSet[str]) -> int:
+    """64-битный отпечаток множества значимых слов (числа и отрицания входят в него как слова)"""
+    data = "|".join(sorted(tokens - PREFIX_WORDS)).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big", signed=True)
+
+
+class NearDuplicateIndex:
+    """Индекс перефразированных утверждений: отпечаток нормализованного утверждения → ключ результата.
+
+    Утверждение сводится к множеству значимых слов (``claim_tokens``), и
+    перефразировкой считается только утверждение с тем же множеством: отличаться
+    могут служебные и вводные слова («Правда ли, что…»), порядок слов, регистр,
+    окончания и пунктуация. Оценка сходства с порогом сюда не подходит: одно
+    замененное слово («одобрило» → «запретило», «России» → «Казахстана») или
+    другое число дает высокое сходство, но меняет смысл, и выдать вердикт
+    другого утверждения нельзя. Поэтому поиск — одно обращение к словарю.
+    При превышении ``max_entries`` вытесняются самые старые записи.
+    """
+
+    def __init__(self, max_entries: int = 1_000_000) -> None:
+        self.max_entries = max_entries
+        # ключ -> отпечаток, в порядке добавления
+        self._fingerprints: "OrderedDict[str, int]" = OrderedDict()
+        # отпечаток -> ключ последнего сохраненного результата
+        self._keys: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._fingerprints
+
+    @staticmethod
+    def fingerprint(text: str) -> Optional[int]:
+        """Отпечаток утверждения (None, если в нем нет значимых слов)"""
+        tokens = claim_tokens(text)
+        return claim_fingerprint(tokens) if tokens else None
+
+    def add(self, text: str, key: str, fingerprint: Optional[int] = None) -> bool:
+        """Запоминает утверждение; key — ключ сохраненного результата"""
+        fingerprint = fingerprint if fingerprint is not None else self.fingerprint(text)
+        if fingerprint is None:
+            return False
+        self.remove(key)
+        self._fingerprints[key] = fingerprint
+        self._keys[fingerprint] = key
+        while len(self._fingerprints) > self.max_entries:
+            self.remove(next(iter(self._fingerprints)))
+        return True
+
+    def remove(self, key: str) -> None:
+        fingerprint = self._fingerprints.pop(key, None)
+        if fingerprint is not None and self._keys.get(fingerprint) == key:
+            del self._keys[fingerprint]
+
+    def get(self, text: str, fingerprint: Optional[int] = None) -> Optional[str]:
+        """Ключ результата для перефразировки утверждения или None"""
+        fingerprint = fingerprint if fingerprint is not None else self.fingerprint(text)
+        if fingerprint is None:
+            return None
+        return self._keys.get(fingerprint)
+
+    def entries(self) -> Iterable[Tuple[str, int]]:
+        return self._fingerprints.items()
@@ -0,0 +1,480 @@
+import asyncio
+import contextlib
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from services.request_coalescer import RequestCoalescer
+from services.resilience import (
+    RETRYABLE_EXCEPTIONS,
+    RETRYABLE_STATUSES,
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    RetryPolicy,
+)
+from services.upstream_scheduler import UpstreamScheduler
+from utils.logger import setup_logger
+from utils.metrics import UPSTREAM_LATENCY, UPSTREAM_RESPONSES
+
+logger = setup_logger(__name__)
+
+DEFAULT_BASE_URL = "https://api.perplexity.ai/chat/completions"
+
+# Маркер конца SSE-потока ("data: [DONE]")
+_SSE_DONE = object()
+
+
+@dataclass
+class UpstreamResponse:
+    """Ответ Perplexity API"""
+    status: int
+    data: Optional[Dict[str, Any]] = None
+    text: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.data is not None
+
+    @property
+    def content(self) -> str:
+        return self.data["choices"][0]["message"]["content"]
+
+
+DeltaCallback = Callable[[str], None]
+
+
+@dataclass
+class _StreamFanout:
+    """Общий поток ответа для нескольких одинаковых запросов"""
+    text: str = ""
+    listeners: List[DeltaCallback] = field(default_factory=list)
+
+    def publish(self, text: str) -> None:
+        self.text = text
+        for listener in list(self.listeners):
+            try:
+                listener(text)
+            except Exception as e:
+                logger.error("Ошибка обработчика потока: %s", e)
+                self.listeners.remove(listener)
+
+
+class PerplexityClient:
+    """Общий долгоживущий HTTP-клиент с пулом соединений для запросов к Perplexity API"""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = DEFAULT_BASE_URL,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 120.0,
+        pool_limit: int = 100,
+        pool_limit_per_host: int = 30,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 60.0,
+        scheduler: Optional[UpstreamScheduler] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge_quantile: Optional[float] = 0.95,
+    ) -> None:
+        self.api_key = api_key
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.coalescer = RequestCoalescer()
+        self.scheduler = scheduler
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        # Квантиль задержки, после которого отправляется страхующий запрос (None — без хеджирования)
+        self.hedge_quantile = hedge_quantile
+        self.hedged_requests = 0
+        self._streams: Dict[str, _StreamFanout] = {}
+
+    @classmethod
+    def from_config(cls, config, scheduler: Optional[UpstreamScheduler] = None) -> "PerplexityClient":
+        return cls(
+            config.PERPLEXITY_API_KEY,
+            base_url=config.PERPLEXITY_BASE_URL,
+            connect_timeout=config.HTTP_CONNECT_TIMEOUT,
+            read_timeout=config.HTTP_READ_TIMEOUT,
+            pool_limit=config.HTTP_POOL_LIMIT,
+            pool_limit_per_host=config.HTTP_POOL_LIMIT_PER_HOST,
+            dns_cache_ttl=config.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+            scheduler=scheduler,
+            retry_policy=RetryPolicy(
+                max_attempts=config.UPSTREAM_RETRY_ATTEMPTS,
+                base_delay=config.UPSTREAM_RETRY_BASE_DELAY,
+                max_delay=config.UPSTREAM_RETRY_MAX_DELAY,
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+                recovery_timeout=config.CIRCUIT_RECOVERY_TIMEOUT,
+            ),
+            hedge_quantile=config.HEDGE_QUANTILE or None,
+        )
+
+    def _timeout(self, read_timeout: Optional[float] = None) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            total=None,
+            connect=self.connect_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=read_timeout or self.read_timeout,
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию, создавая её при первом обращении"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._timeout(),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self._session
+
+    async def start(self) -> None:
+        """Открывает пул соединений (вызывается при старте бота)"""
+        _ = self.session
+        logger.info(
+            "HTTP-клиент Perplexity запущен: limit=%s, per_host=%s, dns_ttl=%ss",
+            self.pool_limit, self.pool_limit_per_host, self.dns_cache_ttl,
+        )
+
+    async def close(self) -> None:
+        """Закрывает пул соединений (вызывается при остановке бота)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            # Даём SSL-транспортам корректно закрыться
+            await asyncio.sleep(0.25)
+        self._session = None
+        logger.info("HTTP-клиент Perplexity остановлен")
+
+    async def post_chat(
+        self,
+        payload: Dict[str, Any],
+        read_timeout: Optional[float] = None,
+        coalesce: bool = True,
+        idempotent: bool = True,
+        hedge: bool = False,
+    ) -> UpstreamResponse:
+        """Отправляет запрос к chat/completions через общий пул соединений.
+
+        Одинаковые одновременные запросы объединяются в один вызов API.
+        Временные сбои повторяются (для неидемпотентных запросов — только те,
+        что гарантированно не дошли до обработки); при ``hedge=True`` медленный
+        запрос страхуется повторным после порога задержки.
+        """
+        def call() -> Awaitable[UpstreamResponse]:
+            return self._call_with_retries(
+                payload,
+                lambda: self._post(payload, read_timeout),
+                idempotent=idempotent,
+                hedge=hedge,
+            )
+
+        if not coalesce:
+            return await call()
+        key = RequestCoalescer.make_key(payload)
+        return await self.coalescer.run(key, call)
+
+    def _hedge_delay(self, payload: Dict[str, Any]) -> Optional[float]:
+        if self.hedge_quantile is None:
+            return None
+        return self.latency.percentile(payload.get("model", ""), self.hedge_quantile)
+
+    async def _hedged(
+        self, payload: Dict[str, Any], attempt: Callable[[], Awaitable[UpstreamResponse]]
+    ) -> UpstreamResponse:
+        """Запускает второй запрос, если первый не уложился в p95, и берёт первый успешный"""
+        delay = self._hedge_delay(payload)
+        primary = asyncio.ensure_future(attempt())
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self.hedged_requests += 1
+        logger.info("Запрос дольше %.1f с, отправляем страхующий запрос", delay)
+        pending = {primary, asyncio.ensure_future(attempt())}
+        result: Optional[UpstreamResponse] = None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    result = task.result()
+                    if result.ok or not pending:
+                        return result
+            if result is not None:
+                return result
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call_with_retries(
+        self,
+        payload: Dict[str, Any],
+        attempt: Callable[[], Awaitable[UpstreamResponse]],
+        idempotent: bool = True,
+        hedge: bool = False,
+        can_retry: Callable[[], bool] = lambda: True,
+    ) -> UpstreamResponse:
+        model = payload.get("model", "")
+        max_attempts = self.retry_policy.max_attempts
+        for number in range(max_attempts):
+            try:
+                probe = self.breaker.before_call()
+            except CircuitOpenError:
+                UPSTREAM_RESPONSES.inc(model=model, status="circuit_open")
+                raise
+            started = time.monotonic()
+            last_attempt = number + 1 >= max_attempts
+            try:
+                response = await (self._hedged(payload, attempt) if hedge else attempt())
+            except RETRYABLE_EXCEPTIONS as e:
+                UPSTREAM_RESPONSES.inc(model=model, status="error")
+                UPSTREAM_LATENCY.observe(time.monotonic() - started, model=model)
+                self.breaker.record_failure()
+                # Неидемпотентный запрос повторяем, только если он не был отправлен
+                sent = not isinstance(e, aiohttp.ClientConnectorError)
+                if last_attempt or not can_retry() or (sent and not idempotent):
+                    raise
+                delay = self.retry_policy.backoff(number)
+                logger.warning("Сбой запроса к Perplexity API (%r), повтор через %.1f с", e, delay)
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                # Отмена ничего не говорит о доступности API, но проба должна освободиться
+                if probe:
+                    self.breaker.release_probe()
+                raise
+            except BaseException:
+                # Неповторяемая ошибка (ответ не разобран, сбой on_delta и т.п.):
+                # иначе пробный запрос half-open остался бы занятым навсегда
+                UPSTREAM_RESPONSES.inc(model=model, status="error")
+                UPSTREAM_LATENCY.observe(time.monotonic() - started, model=model)
+                self.breaker.record_failure()
+                raise
+
+            UPSTREAM_RESPONSES.inc(model=model, status=str(response.status))
+            UPSTREAM_LATENCY.observe(time.monotonic() - started, model=model)
+            if response.status >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if response.ok:
+                self.latency.record(model, time.monotonic() - started)
+                return response
+
+            retryable = response.status in RETRYABLE_STATUSES and (idempotent or response.status == 429)
+            if last_attempt or not retryable or not can_retry():
+                return response
+            delay = self.retry_policy.backoff(number)
+            if response.status == 429 and self.scheduler is not None:
+                delay = max(delay, self.scheduler.stats()["paused_for"])
+            logger.warning("Perplexity API вернул %s, повтор через %.1f с", response.status, delay)
+            await asyncio.sleep(delay)
+        return response
+
+    @staticmethod
+    def _estimate_tokens(payload: Dict[str, Any]) -> int:
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+        return prompt_chars // 3 + int(payload.get("max_tokens", 0))
+
+    def _slot(self, payload: Dict[str, Any]):
+        """Слот планировщика запросов (если он подключён)"""
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        return self.scheduler.slot(tokens=self._estimate_tokens(payload))
+
+    def _on_error_status(self, response: aiohttp.ClientResponse) -> None:
+        if response.status == 429 and self.scheduler is not None:
+            try:
+                retry_after = float(response.headers.get("Retry-After", ""))
+            except ValueError:
+                retry_after = 5.0
+            self.scheduler.pause(retry_after)
+
+    @staticmethod
+    def _record_usage(ticket, data: Optional[Dict[str, Any]]) -> None:
+        if ticket is None or not data:
+            return
+        total = (data.get("usage") or {}).get("total_tokens")
+        if isinstance(total, int):
+            ticket.used_tokens = total
+
+    async def _post(self, payload: Dict[str, Any], read_timeout: Optional[float]) -> UpstreamResponse:
+        async with self._slot(payload) as ticket:
+            async with self.session.post(
+                self.base_url,
+                json=payload,
+                timeout=self._timeout(read_timeout),
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    self._record_usage(ticket, data)
+                    return UpstreamResponse(status=200, data=data)
+                self._on_error_status(response)
+                return UpstreamResponse(status=response.status, text=await response.text())
+
+    async def stream_chat(
+        self,
+        payload: Dict[str, Any],
+        on_delta: Optional[DeltaCallback] = None,
+        read_timeout: Optional[float] = None,
+        idempotent: bool = True,
+    ) -> UpstreamResponse:
+        """Отправляет потоковый запрос (SSE) и передаёт накопленный текст в ``on_delta``.
+
+        ``on_delta`` вызывается синхронно на каждом фрагменте и не должен блокировать.
+        Одинаковые одновременные потоковые запросы читают один общий поток.
+        """
+        payload = {**payload, "stream": True}
+        key = RequestCoalescer.make_key(payload)
+        fanout = self._streams.get(key)
+        if fanout is None:
+            fanout = self._streams[key] = _StreamFanout()
+        if on_delta is not None:
+            fanout.listeners.append(on_delta)
+            if fanout.text:
+                on_delta(fanout.text)
+        try:
+            return await self.coalescer.run(
+                key, lambda: self._stream(key, payload, fanout, read_timeout, idempotent)
+            )
+        finally:
+            if on_delta is not None and on_delta in fanout.listeners:
+                fanout.listeners.remove(on_delta)
+            # Общий поток отменён: новый запрос не должен подхватить его текст
+            if self._streams.get(key) is fanout and not self.coalescer.running(key):
+                del self._streams[key]
+
+    async def _stream(
+        self,
+        key: str,
+        payload: Dict[str, Any],
+        fanout: _StreamFanout,
+        read_timeout: Optional[float],
+        idempotent: bool,
+    ) -> UpstreamResponse:
+        try:
+            # Повтор возможен, пока пользователю не показан ни один фрагмент
+            return await self._call_with_retries(
+                payload,
+                lambda: self._stream_once(payload, fanout, read_timeout),
+                idempotent=idempotent,
+                can_retry=lambda: not fanout.text,
+            )
+        finally:
+            if self._streams.get(key) is fanout:
+                del self._streams[key]
+
+    async def _stream_once(
+        self,
+        payload: Dict[str, Any],
+        fanout: _StreamFanout,
+        read_timeout: Optional[float],
+    ) -> UpstreamResponse:
+        async with self._slot(payload) as ticket:
+            async with self.session.post(
+                self.base_url,
+                json=payload,
+                timeout=self._timeout(read_timeout),
+            ) as response:
+                if response.status != 200:
+                    self._on_error_status(response)
+                    return UpstreamResponse(status=response.status, text=await response.text())
+
+                text = ""
+                last_event: Dict[str, Any] = {}
+                buffer = b""
+                done = False
+                async for chunk in response.content.iter_any():
+                    buffer += chunk
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        event = self._parse_sse_line(line)
+                        if event is None:
+                            continue
+                        if event is _SSE_DONE:
+                            done = True
+                            break
+                        last_event = event
+                        delta = self._event_delta(event)
+                        if delta:
+                            text += delta
+                            fanout.publish(text)
+                    if done:
+                        break
+                if not done and buffer.strip():
+                    event = self._parse_sse_line(buffer)
+                    if event is _SSE_DONE:
+                        done = True
+                    elif isinstance(event, dict):
+                        last_event = event
+                        delta = self._event_delta(event)
+                        if delta:
+                            text += delta
+                            fanout.publish(text)
+                if not done and not self._event_finished(last_event):
+                    # Соединение закрылось посреди ответа: обрывок нельзя ни кэшировать, ни оплачивать
+                    raise aiohttp.ClientPayloadError(
+                        f"поток ответа оборвался до завершения (получено {len(text)} символов)"
+                    )
+
+                data: Dict[str, Any] = {
+                    key_: value for key_, value in last_event.items() if key_ not in ("choices", "object")
+                }
+                data["choices"] = [{"message": {"role": "assistant", "content": text}}]
+                self._record_usage(ticket, data)
+                return UpstreamResponse(status=200, data=data)
+
+    @staticmethod
+    def _parse_sse_line(line: bytes):
+        line = line.strip()
+        if not line.startswith(b"data:"):
+            return None
+        raw = line[5:].strip()
+        if raw == b"[DONE]":
+            return _SSE_DONE
+        try:
+            return json.loads(raw)
+        except ValueError:
+            logger.warning("Некорректный фрагмент потока: %r", raw[:200])
+            return None
+
+    @staticmethod
+    def _event_finished(event: Dict[str, Any]) -> bool:
+        """Последний фрагмент потока с finish_reason (на случай ответа без [DONE])"""
+        choices = event.get("choices") or []
+        return bool(choices) and choices[0].get("finish_reason") is not None
+
+    @staticmethod
+    def _event_delta(event: Dict[str, Any]) -> str:
+        choices = event.get("choices") or []
+        if not choices:
+            return ""
+        delta = choices[0].get("delta") or {}
+        return delta.get("content") or ""
@@ -1,21 +1,20 @@
-import aiohttp
 import json
 from typing import Optional
-from loguru import logger
+
+from services.perplexity_client import DeltaCallback, PerplexityClient
+from utils.logger import setup_logger
+from utils.metrics import observe_latency
+
+logger = setup_logger(__name__)
 
 
 class PerplexityService:
-    def __init__(self, api_key: str) -> None:
+    def __init__(self, api_key: str, client: Optional[PerplexityClient] = None) -> None:
         self.api_key = api_key
-        self.base_url = "https://api.perplexity.ai/chat/completions"
+        self.client = client or PerplexityClient(api_key)
 
-    async def _make_request(self, messages: list) -> str:
-        """Выполняет запрос к Perplexity API"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+    async def _make_request(self, messages: list, on_delta: Optional[DeltaCallback] = None) -> str:
+        """Выполняет запрос к Perplexity API (потоково, если передан on_delta)"""
         payload = {
             "model": "sonar",
             "messages": messages,
@@ -25,25 +24,25 @@ class PerplexityService:
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        result = data["choices"][0]["message"]["content"]
-                        logger.info(f"Получен ответ от Perplexity API: {result[:300]}...")
-                        return result
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Perplexity API error {response.status}: {error_text}")
-                        return f"❌ Ошибка API: {response.status}"
+            if on_delta is not None:
+                response = await self.client.stream_chat(payload, on_delta)
+            else:
+                response = await self.client.post_chat(payload)
+            if response.ok:
+                result = response.content
+                logger.debug("Получен ответ от Perplexity API: %s", result)
+                return result
+            else:
+                logger.error("Perplexity API error %s: %s", response.status, response.text)
+                return f"❌ Ошибка API: {response.status}"
         except Exception as e:
-            logger.error(f"Ошибка при запросе к Perplexity API: {e}")
+            logger.error("Ошибка при запросе к Perplexity API: %s", e)
             return f"❌ Ошибка подключения к API: {str(e)}"
 
-    async def analyze_article(self, url: str) -> str:
+    @observe_latency("perplexity")
+    async def analyze_article(self, url: str, on_delta: Optional[DeltaCallback] = None) -> str:
         """Анализирует статью по ссылке"""
-        logger.info(f"Анализируем статью: {url}")
-        logger.info(f"Полный URL для анализа: '{url}'")
+        logger.info("Анализируем статью: %s", url)
         
         messages = [
             {
@@ -70,12 +69,14 @@ class PerplexityService:
             }
         ]
         
-        logger.info(f"Отправляем в API сообщение: {messages[1]['content']}")
-        return await self._make_request(messages)
+        logger.debug("Отправляем в API сообщение: %s", messages[1]['content'])
+        return await self._make_request(messages, on_delta)
 
-    async def analyze_text(self, text: str) -> str:
+    @observe_latency("perplexity")
+    async def analyze_text(self, text: str, on_delta: Optional[DeltaCallback] = None) -> str:
         """Анализирует текст"""
-        logger.info(f"Анализируем текст: {text[:100]}...")
+        logger.info("Анализируем текст: %s символов", len(text))
+        logger.debug("Текст для анализа: %s", text)
         
         messages = [
             {
@@ -98,11 +99,12 @@ class PerplexityService:
             }
         ]
         
-        return await self._make_request(messages)
+        return await self._make_request(messages, on_delta)
 
-    async def check_fact(self, fact: str) -> str:
+    @observe_latency("perplexity")
+    async def check_fact(self, fact: str, on_delta: Optional[DeltaCallback] = None) -> str:
         """Проверяет конкретный факт"""
-        logger.info(f"Проверяем факт: {fact[:100]}...")
+        logger.debug("Проверяем факт: %s", fact)
         
         messages = [
             {
@@ -125,4 +127,4 @@ class PerplexityService:
             }
         ]
         
-        return await self._make_request(messages)
+        return await self._make_request(messages, on_delta)
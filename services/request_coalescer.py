@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+
+
+class RequestCoalescer:
+    """Объединяет одинаковые одновременные запросы в один вызов (single-flight).
+
+    Все ожидающие получают результат общего вызова. Отмена одного ожидающего
+    не отменяет общий вызов — он защищён через ``asyncio.shield``; общий вызов
+    отменяется, только когда отменились все ожидающие (например, при остановке).
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[str, "asyncio.Future[Any]"] = {}
+        # Число ожидающих общего вызова по ключу
+        self._waiters: Dict[str, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """Ключ по нормализованному промпту, модели и параметрам запроса"""
+        normalized = dict(payload)
+        normalized["messages"] = [
+            {**message, "content": " ".join(str(message.get("content", "")).split())}
+            for message in payload.get("messages", [])
+        ]
+        raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def running(self, key: str) -> bool:
+        """Идет ли общий вызов с этим ключом"""
+        return key in self._inflight
+
+    def _forget(self, key: str, task: "asyncio.Future[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+        # Забираем исключение, если все ожидающие уже отменились
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет ``factory()`` один раз для всех одновременных вызовов с этим ключом"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and not task.done():
+                    # Результат больше никому не нужен: не держим запрос к API
+                    del self._inflight[key]
+                    del self._waiters[key]
+                    task.cancel()
@@ -0,0 +1,121 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+import aiohttp
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Ошибки, после которых запрос можно безопасно повторить
+RETRYABLE_EXCEPTIONS = (
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    asyncio.TimeoutError,
+)
+
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """API признан недоступным, запрос отклонён без обращения к нему"""
+
+    def __init__(self, retry_in: float) -> None:
+        super().__init__(f"сервис проверки временно недоступен, повторите через {int(retry_in) + 1} с")
+        self.retry_in = retry_in
+
+
+class RetryPolicy:
+    """Повторы с экспоненциальной задержкой и полным джиттером"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0) -> None:
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед повтором номер attempt + 1 (attempt считается с нуля)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Автомат защиты: после серии сбоев запросы отклоняются сразу (open),
+    через recovery_timeout пропускается пробный запрос (half-open)."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_inflight = False
+
+    def before_call(self) -> bool:
+        """Проверяет, можно ли выполнить запрос; иначе бросает CircuitOpenError.
+
+        Возвращает True, если запрос пропущен как пробный (half-open): его
+        исход обязательно сообщается через record_success, record_failure
+        или release_probe.
+        """
+        if self.state == self.CLOSED:
+            return False
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == self.OPEN and elapsed >= self.recovery_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_inflight = False
+        if self.state == self.HALF_OPEN and not self._probe_inflight:
+            self._probe_inflight = True
+            return True
+        self.rejected += 1
+        raise CircuitOpenError(max(0.0, self.recovery_timeout - elapsed))
+
+    def release_probe(self) -> None:
+        """Пробный запрос отменён без ответа: следующий запрос станет новой пробой"""
+        if self.state == self.HALF_OPEN:
+            self._probe_inflight = False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Perplexity API снова доступен, автомат защиты закрыт")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_inflight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.error("Perplexity API недоступен (%s сбоев подряд), автомат защиты открыт", self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_inflight = False
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных запросов по моделям"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, model: str, seconds: float) -> None:
+        samples = self._samples.get(model)
+        if samples is None:
+            samples = self._samples[model] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, model: str, q: float) -> Optional[float]:
+        samples = self._samples.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -0,0 +1,287 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from services.near_duplicate_index import NearDuplicateIndex
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class ResultCacheService:
+    """Кэш результатов проверок: LRU в памяти + опциональный постоянный слой в SQLite.
+
+    Для видов из ``near_duplicate_kinds`` при промахе по точному ключу ищется
+    перефразированный запрос в ``NearDuplicateIndex`` (например, «Правда ли,
+    что Москву основали в 1147 году?» и «В 1147 году Москву основали»).
+    """
+
+    DEFAULT_TTLS = {
+        "fact_check": 6 * 3600,
+        "article": 24 * 3600,
+        "text": 6 * 3600,
+    }
+
+    def __init__(
+        self,
+        max_entries: int = 5000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttls: Optional[Dict[str, int]] = None,
+        db_path: Optional[str] = None,
+        db_max_entries: int = 100_000,
+        near_duplicate: Optional[NearDuplicateIndex] = None,
+        near_duplicate_kinds: Iterable[str] = ("fact_check",),
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.db_max_entries = db_max_entries
+        self.near_duplicate = near_duplicate
+        self.near_duplicate_kinds = frozenset(near_duplicate_kinds)
+
+        # ключ -> (kind, expires_at, value)
+        self._memory: "OrderedDict[str, Tuple[str, float, str]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._db_writes = 0
+        if db_path:
+            self._open_db(db_path)
+
+    @classmethod
+    def from_config(cls, config) -> "ResultCacheService":
+        return cls(
+            max_entries=config.CACHE_MAX_ENTRIES,
+            max_bytes=config.CACHE_MAX_BYTES,
+            ttls={
+                "fact_check": config.CACHE_TTL_FACT_CHECK,
+                "article": config.CACHE_TTL_ARTICLE,
+                "text": config.CACHE_TTL_TEXT,
+            },
+            db_path=config.DATABASE_PATH if config.CACHE_PERSISTENT else None,
+            near_duplicate=NearDuplicateIndex(
+                max_entries=config.NEAR_DUP_MAX_ENTRIES,
+            ) if config.NEAR_DUP_ENABLED else None,
+        )
+
+    # --- Ключи и статистика ---
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).casefold()
+
+    @classmethod
+    def make_key(cls, kind: str, text: str) -> str:
+        # Путь и параметры URL чувствительны к регистру: канонический ключ статьи берем как есть
+        normalized = text if kind == "article" else cls.normalize(text)
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"{kind}:{digest}"
+
+    @staticmethod
+    def is_cacheable(value: str) -> bool:
+        # Сообщения об ошибках API не кэшируем
+        return bool(value) and not value.startswith("❌")
+
+    def _count(self, kind: str, field: str) -> None:
+        counters = self._stats.setdefault(
+            kind, {"hits": 0, "memory_hits": 0, "db_hits": 0, "near_hits": 0, "misses": 0}
+        )
+        counters[field] += 1
+
+    def stats(self) -> Dict:
+        """Счётчики попаданий/промахов по видам запросов"""
+        total_hits = sum(c["hits"] for c in self._stats.values())
+        total_misses = sum(c["misses"] for c in self._stats.values())
+        lookups = total_hits + total_misses
+        return {
+            "entries": len(self._memory),
+            "bytes": self._memory_bytes,
+            "hits": total_hits,
+            "misses": total_misses,
+            "hit_ratio": total_hits / lookups if lookups else 0.0,
+            "near_duplicate_entries": len(self.near_duplicate) if self.near_duplicate is not None else 0,
+            "by_kind": {kind: dict(c) for kind, c in self._stats.items()},
+        }
+
+    # --- Слой в памяти ---
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        if item[1] <= time.time():
+            self._memory_remove(key)
+            return None
+        self._memory.move_to_end(key)
+        return item[2]
+
+    def _memory_remove(self, key: str) -> None:
+        item = self._memory.pop(key, None)
+        if item is not None:
+            self._memory_bytes -= len(item[2])
+
+    def _memory_set(self, key: str, kind: str, expires_at: float, value: str) -> None:
+        self._memory_remove(key)
+        self._memory[key] = (kind, expires_at, value)
+        self._memory_bytes += len(value)
+        while self._memory and (len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes):
+            _, (_, _, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # --- Слой в SQLite ---
+
+    def _open_db(self, db_path: str) -> None:
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache ("
+            "key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_created ON result_cache(created_at)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS claim_fingerprints ("
+            "key TEXT PRIMARY KEY, fingerprint INTEGER NOT NULL)"
+        )
+        self._db.commit()
+        logger.info("Постоянный кэш результатов: %s", db_path)
+        if self.near_duplicate is not None:
+            self._load_fingerprints()
+
+    def _load_fingerprints(self) -> None:
+        """Восстанавливает индекс перефразировок по живым записям кэша"""
+        rows = self._db.execute(
+            "SELECT f.key, f.fingerprint FROM claim_fingerprints f "
+            "JOIN result_cache r ON r.key = f.key WHERE r.expires_at > ? ORDER BY r.created_at",
+            (time.time(),),
+        )
+        for key, fingerprint in rows:
+            self.near_duplicate.add("", key, fingerprint)
+        logger.info("Индекс перефразировок: загружено %s отпечатков", len(self.near_duplicate))
+
+    def _db_get(self, key: str) -> Optional[Tuple[str, float, str]]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT kind, expires_at, value FROM result_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row
+
+    def _db_set(
+        self, key: str, kind: str, expires_at: float, value: str, fingerprint: Optional[int] = None
+    ) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO result_cache (key, kind, value, expires_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, kind, value, expires_at, time.time()),
+            )
+            if fingerprint is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO claim_fingerprints (key, fingerprint) VALUES (?, ?)",
+                    (key, fingerprint),
+                )
+            self._db_writes += 1
+            if self._db_writes % 100 == 0:
+                self._db_evict()
+            self._db.commit()
+
+    def _db_evict(self) -> None:
+        self._db.execute("DELETE FROM result_cache WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM result_cache WHERE key IN ("
+            "SELECT key FROM result_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.db_max_entries,),
+        )
+        self._db.execute("DELETE FROM claim_fingerprints WHERE key NOT IN (SELECT key FROM result_cache)")
+
+    # --- Публичный API ---
+
+    async def get(self, kind: str, text: str) -> Optional[str]:
+        """Возвращает сохранённый результат или None"""
+        key = self.make_key(kind, text)
+        value = self._memory_get(key)
+        if value is not None:
+            self._count(kind, "hits")
+            self._count(kind, "memory_hits")
+            return value
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, key)
+            if row is not None:
+                self._memory_set(key, row[0], row[1], row[2])
+                self._count(kind, "hits")
+                self._count(kind, "db_hits")
+                return row[2]
+        if self.near_duplicate is not None and kind in self.near_duplicate_kinds:
+            value = await self._near_duplicate_get(text)
+            if value is not None:
+                self._count(kind, "hits")
+                self._count(kind, "near_hits")
+                return value
+        self._count(kind, "misses")
+        return None
+
+    async def _near_duplicate_get(self, text: str) -> Optional[str]:
+        """Результат для перефразированного запроса из индекса перефразировок"""
+        key = self.near_duplicate.get(text)
+        if key is None:
+            return None
+        value = self._memory_get(key)
+        if value is None and self._db is not None:
+            row = await asyncio.to_thread(self._db_get, key)
+            if row is not None:
+                self._memory_set(key, row[0], row[1], row[2])
+                value = row[2]
+        if value is not None:
+            logger.debug("Перефразированный запрос найден в кэше")
+            return value
+        # Результат вытеснен или устарел — отпечаток больше не нужен
+        self.near_duplicate.remove(key)
+        return None
+
+    async def set(self, kind: str, text: str, value: str) -> None:
+        """Сохраняет результат с TTL, заданным для данного вида запроса"""
+        if not self.is_cacheable(value):
+            return
+        ttl = self.ttls.get(kind)
+        if not ttl:
+            return
+        key = self.make_key(kind, text)
+        expires_at = time.time() + ttl
+        self._memory_set(key, kind, expires_at, value)
+        fingerprint = None
+        if self.near_duplicate is not None and kind in self.near_duplicate_kinds:
+            fingerprint = self.near_duplicate.fingerprint(text)
+            if fingerprint is not None:
+                self.near_duplicate.add(text, key, fingerprint)
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._db_set, key, kind, expires_at, value, fingerprint)
+            except sqlite3.Error as e:
+                logger.error("Ошибка записи в кэш SQLite: %s", e)
+
+    async def get_or_compute(
+        self, kind: str, text: str, compute: Callable[[], Awaitable[str]]
+    ) -> Tuple[str, bool]:
+        """Возвращает (результат, взят_из_кэша)"""
+        cached = await self.get(kind, text)
+        if cached is not None:
+            return cached, True
+        value = await compute()
+        await self.set(kind, text, value)
+        return value, False
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
@@ -1,11 +1,16 @@
-import re
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 from urllib.parse import urlparse
 
+from services.citation_extractor import Citation, CitationExtractor
+from services.domain_index import CATEGORY_SCORES, DomainIndex, normalize_host
+
 class SourceValidatorService:
     """Сервис для валидации и ранжирования источников по надежности"""
     
-    def __init__(self):
+    UNKNOWN_SCORE = 0.5
+    INVALID_SCORE = 0.1
+    
+    def __init__(self, domains_file: Optional[str] = None):
         # Домены с высокой надежностью (научные, официальные, международные)
         self.high_reliability_domains = {
             # Научные журналы и базы данных
@@ -17,7 +22,7 @@ class SourceValidatorService:
             'fda.gov', 'cdc.gov', 'nih.gov', 'nsa.gov', 'cia.gov',
             
             # Международные новостные агентства
-            'reuters.com', 'ap.org', 'afp.com', 'bbc.com', 'dw.com', 'france24.com',
+            'reuters.com', 'ap.org', 'afp.com', 'bbc.com', 'bbc.co.uk', 'dw.com', 'france24.com',
             'aljazeera.com', 'dw.com', 'rt.com', 'sputniknews.com',
             
             # Академические институты
@@ -49,7 +54,7 @@ class SourceValidatorService:
             
             # Оппозиционные издания
             'meduza.io', 'currenttime.tv', 'svoboda.org', 'dw.com',
-            'bbc.com', 'voanews.com', 'rferl.org',
+            'bbc.com', 'bbc.co.uk', 'voanews.com', 'rferl.org',
             
             # Партийные издания
             'kremlin.ru', 'government.ru', 'duma.gov.ru'
@@ -61,42 +66,60 @@ class SourceValidatorService:
             'instagram.com', 'tiktok.com', 'youtube.com', 'blogspot.com',
             'wordpress.com', 'medium.com', 'substack.com'
         }
+        
+        # Индекс суффиксов: домены из списков выше покрывают и свои поддомены.
+        # Домен из нескольких списков получает самую осторожную (низкую) оценку.
+        self.domain_index = DomainIndex()
+        self.domain_index.add_many(self.high_reliability_domains, CATEGORY_SCORES['high'])
+        self.domain_index.add_many(self.medium_reliability_domains, CATEGORY_SCORES['medium'])
+        self.domain_index.add_many(self.biased_domains, CATEGORY_SCORES['biased'])
+        self.domain_index.add_many(self.low_reliability_domains, CATEGORY_SCORES['low'])
+        
+        # Внешний список доменов заменяет оценки встроенных списков
+        if domains_file:
+            self.domain_index.update(DomainIndex.load(domains_file))
+
+    @classmethod
+    def from_config(cls, config) -> "SourceValidatorService":
+        return cls(domains_file=config.SOURCE_DOMAINS_FILE or None)
 
     def extract_domain(self, url: str) -> str:
-        """Извлекает домен из URL"""
+        """Извлекает домен из URL (без порта, учетных данных и www.)"""
         try:
-            parsed = urlparse(url)
-            domain = parsed.netloc.lower()
-            # Убираем www.
-            if domain.startswith('www.'):
-                domain = domain[4:]
-            return domain
-        except:
+            return normalize_host(urlparse(url).hostname or "")
+        except ValueError:
             return ""
 
+    def score_domain(self, domain: str) -> float:
+        """Оценка надежности для уже извлеченного домена"""
+        if not domain:
+            return self.INVALID_SCORE
+        score = self.domain_index.lookup(domain)
+        # Неизвестный домен - средняя оценка
+        return self.UNKNOWN_SCORE if score is None else score
+
     def calculate_reliability_score(self, url: str) -> float:
         """Рассчитывает оценку надежности источника (0.0 - 1.0)"""
-        domain = self.extract_domain(url)
-        
-        if not domain:
-            return 0.1
-        
-        if domain in self.high_reliability_domains:
-            return 0.9
-        elif domain in self.medium_reliability_domains:
-            return 0.7
-        elif domain in self.biased_domains:
-            return 0.3  # Анализируем, но предупреждаем
-        elif domain in self.low_reliability_domains:
-            return 0.1
-        else:
-            return 0.5  # Неизвестный домен - средняя оценка
+        return self.score_domain(self.extract_domain(url))
+
+    def score_many(self, urls: Iterable[str]) -> List[float]:
+        """Оценки надежности для списка URL; каждый домен ищется в индексе один раз"""
+        scores: Dict[str, float] = {}
+        result = []
+        for url in urls:
+            domain = self.extract_domain(url)
+            score = scores.get(domain)
+            if score is None:
+                score = scores[domain] = self.score_domain(domain)
+            result.append(score)
+        return result
 
     def get_source_quality_advice(self, url: str) -> str:
         """Возвращает рекомендацию по качеству источника"""
-        domain = self.extract_domain(url)
-        score = self.calculate_reliability_score(url)
-        
+        return self._advice_for_score(self.calculate_reliability_score(url))
+
+    @staticmethod
+    def _advice_for_score(score: float) -> str:
         if score >= 0.8:
             return "✅ Высоконадежный источник"
         elif score >= 0.6:
@@ -108,25 +131,32 @@ class SourceValidatorService:
 
     def rank_sources(self, sources: List[str]) -> List[Tuple[str, float, str]]:
         """Ранжирует источники по надежности"""
-        ranked = []
-        for source in sources:
-            score = self.calculate_reliability_score(source)
-            advice = self.get_source_quality_advice(source)
-            ranked.append((source, score, advice))
+        ranked = [
+            (source, score, self._advice_for_score(score))
+            for source, score in zip(sources, self.score_many(sources))
+        ]
         
         # Сортируем по убыванию надежности
         ranked.sort(key=lambda x: x[1], reverse=True)
         return ranked
 
+    def citation_extractor(self) -> CitationExtractor:
+        """Инкрементальный извлекатель источников, оценивающий каждый домен один раз"""
+        return CitationExtractor(score_domain=self.score_domain)
+
     def extract_sources_from_text(self, text: str) -> List[str]:
-        """Извлекает URL из текста"""
-        url_pattern = r'https?://[^\s\)\]\}]+'
-        urls = re.findall(url_pattern, text)
-        return urls
+        """Извлекает уникальные URL из текста (включая Markdown-ссылки)"""
+        return [citation.url for citation in self.citation_extractor().extract(text)]
+
+    def analyze_source_reliability(self, text: str, citations: Optional[List[Citation]] = None) -> Dict:
+        """Анализирует надежность всех источников в тексте.
 
-    def analyze_source_reliability(self, text: str) -> Dict:
-        """Анализирует надежность всех источников в тексте"""
-        sources = self.extract_sources_from_text(text)
+        Если источники уже собраны извлекателем во время потоковой генерации,
+        их можно передать в ``citations`` вместо повторного разбора текста.
+        """
+        if citations is None:
+            citations = self.citation_extractor().extract(text)
+        sources = [citation.url for citation in citations]
         if not sources:
             return {
                 "sources_found": 0,
@@ -134,7 +164,11 @@ class SourceValidatorService:
                 "recommendations": []
             }
         
-        ranked_sources = self.rank_sources(sources)
+        ranked_sources = [
+            (citation.url, citation.score, self._advice_for_score(citation.score))
+            for citation in citations
+        ]
+        ranked_sources.sort(key=lambda x: x[1], reverse=True)
         
         # Группируем по уровням надежности
         high_quality = [s for s in ranked_sources if s[1] >= 0.8]
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Передача апдейта на обработку (получает разобранный JSON апдейта)
+UpdateDispatch = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class UpdateInboxService:
+    """Постоянный входящий буфер апдейтов webhook в SQLite с дедупликацией по update_id.
+
+    Приём (``accept``) только сохраняет сырой JSON апдейта (INSERT OR IGNORE) и
+    ставит его в очередь в памяти, поэтому Telegram получает ответ за
+    миллисекунды, а обработка идёт отдельно. Диспетчер по порядку передаёт
+    апдейты в ``dispatch`` и отмечает их отправленными; если процесс упал,
+    неотправленные апдейты берутся из базы при следующем запуске. Повторная
+    доставка того же update_id (Telegram повторяет запрос, не дождавшись
+    ответа) отбрасывается и после перезапуска — записи хранятся ``retention``
+    секунд.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        retention: float = 24 * 3600,
+        recent_size: int = 10_000,
+        batch_size: int = 100,
+        prune_interval: float = 300.0,
+    ) -> None:
+        self.retention = retention
+        self.recent_size = recent_size
+        self.batch_size = batch_size
+        self.prune_interval = prune_interval
+        self.dispatch: Optional[UpdateDispatch] = None
+        self.accepted = 0
+        self.duplicates = 0
+        self.dispatched = 0
+        self.failed = 0
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db_lock = threading.Lock()
+        # Недавние update_id: повтор отсекается без обращения к базе
+        self._recent: "OrderedDict[int, None]" = OrderedDict()
+        self._queue: "asyncio.Queue[Tuple[int, str]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._create_schema()
+
+    @classmethod
+    def from_config(cls, config) -> "UpdateInboxService":
+        return cls(config.DATABASE_PATH, retention=config.WEBHOOK_DEDUP_RETENTION)
+
+    def _create_schema(self) -> None:
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # Запись апдейта должна быть быстрой; WAL без fsync на каждую транзакцию не теряет согласованность
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS update_inbox ("
+                "update_id INTEGER PRIMARY KEY, payload TEXT NOT NULL, "
+                "received_at REAL NOT NULL, dispatched_at REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_update_inbox_pending ON update_inbox(update_id) "
+                "WHERE dispatched_at IS NULL"
+            )
+
+    def _execute(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _insert(self, update_id: int, payload: str) -> bool:
+        with self._db_lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO update_inbox (update_id, payload, received_at) VALUES (?, ?, ?)",
+                (update_id, payload, time.time()),
+            )
+            return cursor.rowcount == 1
+
+    def _remember(self, update_id: int) -> None:
+        self._recent[update_id] = None
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+    # --- Приём ---
+
+    async def accept(self, update_id: int, payload: str) -> bool:
+        """Сохраняет апдейт; False — этот update_id уже был принят"""
+        if update_id in self._recent:
+            self.duplicates += 1
+            return False
+        inserted = await asyncio.to_thread(self._insert, update_id, payload)
+        if not inserted:
+            self.duplicates += 1
+            self._remember(update_id)
+            return False
+        self._remember(update_id)
+        self.accepted += 1
+        self._queue.put_nowait((update_id, payload))
+        return True
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self.pending,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+        }
+
+    # --- Диспетчер ---
+
+    async def start(self) -> None:
+        """Возвращает в очередь апдейты, не отправленные до остановки, и запускает диспетчер"""
+        if self._task is not None:
+            return
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT update_id, payload FROM update_inbox WHERE dispatched_at IS NULL ORDER BY update_id",
+        )
+        for update_id, payload in rows:
+            self._remember(update_id)
+            self._queue.put_nowait((update_id, payload))
+        if rows:
+            logger.info("Восстановлено неотправленных апдейтов: %s", len(rows))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._db_lock:
+            self._db.close()
+
+    async def _run(self) -> None:
+        next_prune = time.monotonic() + self.prune_interval
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            done: List[int] = []
+            try:
+                for update_id, payload in batch:
+                    try:
+                        await self.dispatch(json.loads(payload))
+                        self.dispatched += 1
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # Повтор не поможет (некорректный JSON или ошибка разбора) — апдейт пропускается
+                        self.failed += 1
+                        logger.error("Не удалось передать апдейт %s на обработку: %s", update_id, e)
+                    done.append(update_id)
+            except asyncio.CancelledError:
+                # Остановка посреди пачки: переданные отмечаем, остальные вернутся после перезапуска
+                if done:
+                    self._mark_dispatched(done)
+                raise
+            await asyncio.to_thread(self._mark_dispatched, done)
+            if time.monotonic() >= next_prune:
+                next_prune = time.monotonic() + self.prune_interval
+                await asyncio.to_thread(self._prune)
+
+    def _mark_dispatched(self, update_ids: List[int]) -> None:
+        placeholders = ",".join("?" * len(update_ids))
+        with self._db_lock:
+            self._db.execute(
+                f"UPDATE update_inbox SET dispatched_at = ? WHERE update_id IN ({placeholders})",
+                (time.time(), *update_ids),
+            )
+
+    def _prune(self) -> None:
+        """Удаляет отправленные апдейты старше retention (окно дедупликации)"""
+        with self._db_lock:
+            deleted = self._db.execute(
+                "DELETE FROM update_inbox WHERE dispatched_at IS NOT NULL AND received_at < ?",
+                (time.time() - self.retention,),
+            ).rowcount
+        if deleted:
+            logger.debug("Удалено старых апдейтов из буфера: %s", deleted)
@@ -0,0 +1,216 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class Priority(IntEnum):
+    """Приоритет запроса к API (меньше — важнее)"""
+    PAID = 0
+    FREE = 1
+    DEEP_RESEARCH = 2
+    BATCH = 3
+
+
+# Приоритет текущего запроса; выставляется обработчиком и читается клиентом API
+request_priority: ContextVar[Priority] = ContextVar("request_priority", default=Priority.FREE)
+
+
+class TokenBucket:
+    """Корзина токенов с пополнением в минуту"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None) -> None:
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Сколько секунд ждать, пока наберётся amount токенов (0 — можно сейчас)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Ticket:
+    __slots__ = ("priority", "tokens", "future", "enqueued_at", "used_tokens")
+
+    def __init__(self, priority: Priority, tokens: int, future: "asyncio.Future[None]") -> None:
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.used_tokens: Optional[int] = None
+
+
+class UpstreamScheduler:
+    """Центральный планировщик запросов к Perplexity API.
+
+    Ограничивает запросы и токены в минуту (token bucket), число одновременных
+    запросов и отдельно число одновременных запросов каждого приоритета.
+    Ожидающие запросы обслуживаются строго по приоритету, внутри приоритета — по очереди.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        requests_per_minute: int = 50,
+        tokens_per_minute: int = 0,
+        priority_limits: Optional[Dict[Priority, int]] = None,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.priority_limits = priority_limits or {}
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._queues: Dict[Priority, Deque[_Ticket]] = {p: deque() for p in Priority}
+        self._inflight: Dict[Priority, int] = {p: 0 for p in Priority}
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._wait_total: Dict[Priority, float] = {p: 0.0 for p in Priority}
+        self._wait_max: Dict[Priority, float] = {p: 0.0 for p in Priority}
+        self._granted: Dict[Priority, int] = {p: 0 for p in Priority}
+
+    @classmethod
+    def from_config(cls, config) -> "UpstreamScheduler":
+        return cls(
+            max_concurrent=config.UPSTREAM_MAX_CONCURRENT,
+            requests_per_minute=config.UPSTREAM_RPM,
+            tokens_per_minute=config.UPSTREAM_TPM,
+            priority_limits={Priority.DEEP_RESEARCH: config.DEEP_RESEARCH_MAX_CONCURRENT},
+        )
+
+    # --- Метрики ---
+
+    @property
+    def inflight(self) -> int:
+        return sum(self._inflight.values())
+
+    def queue_depth(self, priority: Optional[Priority] = None) -> int:
+        if priority is not None:
+            return len(self._queues[priority])
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> Dict:
+        """Глубина очередей, число запросов в работе и время ожидания по приоритетам"""
+        by_priority = {}
+        for p in Priority:
+            granted = self._granted[p]
+            by_priority[p.name.lower()] = {
+                "queued": len(self._queues[p]),
+                "inflight": self._inflight[p],
+                "granted": granted,
+                "avg_wait": self._wait_total[p] / granted if granted else 0.0,
+                "max_wait": self._wait_max[p],
+            }
+        return {
+            "inflight": self.inflight,
+            "queued": self.queue_depth(),
+            "paused_for": max(0.0, self._paused_until - time.monotonic()),
+            "by_priority": by_priority,
+        }
+
+    # --- Планирование ---
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу слотов (например, после ответа 429)"""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            logger.warning("Запросы к API приостановлены на %.1f с", seconds)
+
+    def _schedule_retry(self, delay: float) -> None:
+        if self._timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+
+        def fire() -> None:
+            self._timer = None
+            self._dispatch()
+
+        self._timer = loop.call_later(delay, fire)
+
+    def _dispatch(self) -> None:
+        while self.inflight < self.max_concurrent:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            delay = self._paused_until - time.monotonic()
+            if self._requests is not None:
+                delay = max(delay, self._requests.wait_time(1))
+            if self._tokens is not None and ticket.tokens:
+                delay = max(delay, self._tokens.wait_time(ticket.tokens))
+            if delay > 0:
+                self._schedule_retry(delay)
+                return
+            self._queues[ticket.priority].popleft()
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None and ticket.tokens:
+                self._tokens.take(ticket.tokens)
+            self._inflight[ticket.priority] += 1
+            waited = time.monotonic() - ticket.enqueued_at
+            self._granted[ticket.priority] += 1
+            self._wait_total[ticket.priority] += waited
+            self._wait_max[ticket.priority] = max(self._wait_max[ticket.priority], waited)
+            ticket.future.set_result(None)
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and queue[0].future.done():
+                queue.popleft()  # отменённые ожидания
+            if not queue:
+                continue
+            limit = self.priority_limits.get(priority)
+            if limit is not None and self._inflight[priority] >= limit:
+                continue
+            return queue[0]
+        return None
+
+    def _release(self, ticket: _Ticket) -> None:
+        self._inflight[ticket.priority] -= 1
+        if self._tokens is not None and ticket.used_tokens is not None and ticket.used_tokens < ticket.tokens:
+            self._tokens.give_back(ticket.tokens - ticket.used_tokens)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[Priority] = None, tokens: int = 0) -> AsyncIterator[_Ticket]:
+        """Ожидает свободный слот; ``ticket.used_tokens`` можно уточнить по факту ответа"""
+        if priority is None:
+            priority = request_priority.get()
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        ticket = _Ticket(priority, tokens, future)
+        self._queues[priority].append(ticket)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
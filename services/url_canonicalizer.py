@@ -0,0 +1,316 @@
+import asyncio
+import ipaddress
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from urllib.parse import unquote, unquote_plus, urljoin, urlsplit, urlunsplit
+
+import aiohttp
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Метки рекламных кампаний и счетчиков переходов: на содержимое страницы не влияют
+_TRACKING_PREFIXES = ("utm_", "_hs", "mc_", "pk_", "vero_")
+_TRACKING_PARAMS = frozenset({
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "ysclid", "_openstat",
+    "igshid", "_ga", "_gl", "ref_src", "ref_url", "spm", "cmpid", "ocid", "twclid", "rb_clickid",
+})
+
+# Параметры, включающие AMP-версию страницы
+_AMP_PARAMS = {"amp": None, "outputtype": "amp", "output": "amp"}
+
+# Поддомены мобильных и AMP-версий сайтов
+_HOST_PREFIXES = ("www.", "m.", "mobile.", "touch.", "amp.")
+
+# Google AMP Cache: https://www-example-com.cdn.ampproject.org/c/s/www.example.com/path
+# (служебные префиксы c/, v/, i/ и т.п.; s/ — признак https, его префиксы не поглощают)
+_AMP_CACHE_RE = re.compile(r"^/(?:[a-rt-z]/)*(?P<secure>s/)?(?P<rest>[^/].*)$")
+# Google AMP viewer: https://www.google.com/amp/s/example.com/path
+_GOOGLE_AMP_RE = re.compile(r"^/amp/(?P<secure>s/)?(?P<rest>[^/].*)$")
+
+_LINK_TAG_RE = re.compile(rb"<link\b[^>]*>", re.IGNORECASE)
+_ATTR_RE = re.compile(rb"""\b(rel|href)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_HEAD_END_RE = re.compile(rb"</head\s*>|<body\b", re.IGNORECASE)
+
+_REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+
+
+def _is_tracking(name: str) -> bool:
+    name = name.lower()
+    return name in _TRACKING_PARAMS or name.startswith(_TRACKING_PREFIXES)
+
+
+def _query_params(query: str) -> List[Tuple[str, str]]:
+    """Параметры запроса как (имя, исходный фрагмент): фрагменты не перекодируются,
+    а параметр без значения («?amp») не превращается в «amp=»"""
+    params = []
+    for segment in query.split("&"):
+        if segment:
+            params.append((unquote_plus(segment.split("=", 1)[0]), segment))
+    return params
+
+
+def _param_value(segment: str) -> Optional[str]:
+    return unquote_plus(segment.split("=", 1)[1]) if "=" in segment else None
+
+
+def unwrap_amp_cache(url: str) -> str:
+    """Исходный адрес страницы, открытой через AMP-кэш Google"""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+    except ValueError:
+        return url
+    if host.endswith(".cdn.ampproject.org"):
+        match = _AMP_CACHE_RE.match(parts.path)
+    elif host.startswith(("google.", "www.google.")):
+        match = _GOOGLE_AMP_RE.match(parts.path)
+    else:
+        return url
+    if match is None:
+        return url
+    scheme = "https" if match.group("secure") else "http"
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{scheme}://{unquote(match.group('rest'))}{query}"
+
+
+def clean_url(url: str) -> str:
+    """URL без меток отслеживания: схема и хост в нижнем регистре, без порта
+    по умолчанию и фрагмента, параметры отсортированы. Адрес остается рабочим."""
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").rstrip(".")
+        port = parts.port
+    except ValueError:
+        return url
+    if ":" in host:
+        # IPv6-адрес в netloc пишется в квадратных скобках
+        host = f"[{host}]"
+    netloc = host if port is None or _DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    query = "&".join(sorted(
+        segment for name, segment in _query_params(parts.query) if not _is_tracking(name)
+    ))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def canonicalize_url(url: str) -> str:
+    """Ключ для сравнения ссылок на одну и ту же страницу.
+
+    В дополнение к ``clean_url`` приводит http к https, убирает поддомены
+    www/m/amp, AMP-варианты пути и параметров и завершающий слеш. Результат
+    годится для сравнения и кэширования, но не обязательно открывается.
+    """
+    url = clean_url(unwrap_amp_cache(url))
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if parts.scheme not in _DEFAULT_PORTS:
+        return url
+    netloc = parts.netloc
+    stripped = True
+    while stripped:
+        stripped = False
+        for prefix in _HOST_PREFIXES:
+            if netloc.startswith(prefix) and "." in netloc[len(prefix):]:
+                netloc = netloc[len(prefix):]
+                stripped = True
+
+    path = parts.path
+    # Суффикс AMP снимается, только если до него есть путь: «/amp» — обычная страница
+    if path.endswith(("/amp", "/amp/")) and path[:path.rfind("/amp")].strip("/"):
+        path = path[:path.rfind("/amp")]
+    elif path.endswith(".amp") and path[:-len(".amp")].strip("/"):
+        path = path[:-len(".amp")]
+    elif path.endswith(".amp.html") and path[:-len(".amp.html")].strip("/"):
+        path = path[:-len(".amp.html")] + ".html"
+    path = path.rstrip("/") or "/"
+
+    query = "&".join(
+        segment for name, segment in _query_params(parts.query)
+        if not _is_amp_param(name, _param_value(segment))
+    )
+    return urlunsplit(("https", netloc, path, query, ""))
+
+
+def _is_amp_param(name: str, value: Optional[str]) -> bool:
+    name = name.lower()
+    if name not in _AMP_PARAMS:
+        return False
+    expected = _AMP_PARAMS[name]
+    # «?amp», «?amp=» и «?amp=1» включают AMP; «?output=amp» — только с этим значением
+    return expected is None or (value or "").lower() == expected
+
+
+def is_public_url(url: str) -> bool:
+    """Запросы по ссылкам пользователей не должны уходить во внутреннюю сеть.
+
+    Проверяются только явные адреса и локальные имена: имя, которое DNS
+    разрешает во внутренний адрес, так не отсекается.
+    """
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").rstrip(".").lower()
+    except ValueError:
+        return False
+    if parts.scheme not in _DEFAULT_PORTS or not host:
+        return False
+    if host == "localhost" or host.endswith((".localhost", ".local", ".internal")) or "." not in host:
+        return False
+    try:
+        return ipaddress.ip_address(host).is_global
+    except ValueError:
+        return True
+
+
+def find_canonical_link(html: bytes, base_url: str) -> Optional[str]:
+    """Адрес из <link rel="canonical"> в начале HTML-документа"""
+    for tag in _LINK_TAG_RE.finditer(html):
+        attrs = {}
+        for match in _ATTR_RE.finditer(tag.group()):
+            value = match.group(2) or match.group(3) or match.group(4) or b""
+            attrs[match.group(1).lower()] = value.decode("utf-8", "ignore").strip()
+        if "canonical" in attrs.get(b"rel", "").lower().split() and attrs.get(b"href"):
+            href = urljoin(base_url, attrs[b"href"])
+            if urlsplit(href).scheme in _DEFAULT_PORTS:
+                return href
+    return None
+
+
+@dataclass(frozen=True)
+class CanonicalUrl:
+    """Результат канонизации ссылки"""
+    url: str  # рабочий адрес для анализа (без меток отслеживания, после редиректов)
+    key: str  # стабильный ключ для кэша и сравнения
+
+
+class UrlCanonicalizer:
+    """Приводит ссылки на статьи к каноническому виду перед анализом и кэшированием.
+
+    Без сети ссылка очищается функциями ``clean_url`` и ``canonicalize_url``.
+    Если включено ``follow_redirects``, страница запрашивается через
+    собственный пул соединений (в общей сессии Perplexity заголовок с ключом
+    API, его нельзя отправлять на сторонние сайты): проходятся редиректы
+    коротких ссылок и читается начало HTML до ``</head>`` в поисках
+    ``<link rel="canonical">``. Результаты хранятся в LRU с TTL, ошибки сети
+    не мешают анализу — используется адрес без сетевой проверки.
+    """
+
+    USER_AGENT = "Mozilla/5.0 (compatible; FactCheckBot/1.0)"
+
+    def __init__(
+        self,
+        follow_redirects: bool = False,
+        timeout: float = 5.0,
+        max_redirects: int = 5,
+        max_bytes: int = 256 * 1024,
+        cache_size: int = 10_000,
+        cache_ttl: float = 24 * 3600,
+        pool_limit: int = 20,
+    ) -> None:
+        self.follow_redirects = follow_redirects
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.max_bytes = max_bytes
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.pool_limit = pool_limit
+        self._session: Optional[aiohttp.ClientSession] = None
+        # ключ исходной ссылки -> (expires_at, результат)
+        self._resolved: "OrderedDict[str, Tuple[float, CanonicalUrl]]" = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config) -> "UrlCanonicalizer":
+        return cls(
+            follow_redirects=config.URL_RESOLVE_REDIRECTS,
+            timeout=config.URL_RESOLVE_TIMEOUT,
+            max_bytes=config.URL_RESOLVE_MAX_BYTES,
+            cache_size=config.URL_RESOLVE_CACHE_SIZE,
+        )
+
+    @staticmethod
+    def canonicalize(url: str) -> CanonicalUrl:
+        """Канонизация без сетевых запросов"""
+        url = clean_url(unwrap_amp_cache(url))
+        return CanonicalUrl(url=url, key=canonicalize_url(url))
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_limit, ttl_dns_cache=300),
+                headers={"User-Agent": self.USER_AGENT, "Accept": "text/html,*/*;q=0.5"},
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def resolve(self, url: str) -> CanonicalUrl:
+        """Канонический адрес ссылки (с проверкой редиректов и rel=canonical, если включено)"""
+        static = self.canonicalize(url)
+        if not self.follow_redirects or not is_public_url(static.url):
+            return static
+        cached = self._resolved.get(static.key)
+        if cached is not None and cached[0] > time.monotonic():
+            self._resolved.move_to_end(static.key)
+            return cached[1]
+
+        try:
+            final = await asyncio.wait_for(self._fetch(static.url), self.timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeError, ValueError) as e:
+            logger.debug("Не удалось проверить ссылку %s: %s", static.url, e)
+            return static
+        result = self.canonicalize(final) if final else static
+        if result != static:
+            logger.info("Ссылка %s приведена к %s", static.url, result.url)
+
+        self._resolved[static.key] = (time.monotonic() + self.cache_ttl, result)
+        self._resolved.move_to_end(static.key)
+        while len(self._resolved) > self.cache_size:
+            self._resolved.popitem(last=False)
+        return result
+
+    async def _fetch(self, url: str) -> Optional[str]:
+        """Адрес после редиректов (или из rel=canonical); None — оставить исходный"""
+        for _ in range(self.max_redirects + 1):
+            if not is_public_url(url):
+                return None
+            async with self.session.get(url, allow_redirects=False) as response:
+                if response.status in _REDIRECT_STATUSES:
+                    location = response.headers.get("Location")
+                    if not location:
+                        return None
+                    url = urljoin(url, location)
+                    continue
+                if response.status != 200:
+                    return None
+                if "html" not in response.headers.get("Content-Type", "html").lower():
+                    return url
+                head = await self._read_head(response)
+            canonical = find_canonical_link(head, url)
+            return canonical if canonical and is_public_url(canonical) else url
+        return None
+
+    async def _read_head(self, response: aiohttp.ClientResponse) -> bytes:
+        """Начало документа до </head> (не больше max_bytes)"""
+        data = b""
+        while len(data) < self.max_bytes:
+            chunk = await response.content.read(min(64 * 1024, self.max_bytes - len(data)))
+            if not chunk:
+                break
+            # Закрывающий тег может попасть на границу кусков
+            scan_from = max(0, len(data) - 8)
+            data += chunk
+            if _HEAD_END_RE.search(data, scan_from):
+                break
+        return data
@@ -1,75 +1,568 @@
-from datetime import date
-from typing import Dict
+import asyncio
+import sqlite3
+import threading
+import time
+import itertools
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_COLUMNS = (
+    "user_id", "username", "daily_requests", "daily_limit", "last_reset",
+    "total_requests", "balance", "deep_research_used",
+)
+
+_UPSERT_SQL = (
+    f"INSERT INTO users ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+    "ON CONFLICT(user_id) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in _COLUMNS[1:])
+)
+
+_SELECT_SQL = f"SELECT {', '.join(_COLUMNS[1:])} FROM users WHERE user_id = ?"
+
+# Счетчики, которые в общем режиме меняются только в транзакции с блокировкой записи
+_COUNTERS = ("daily_requests", "last_reset", "total_requests", "balance")
+
+# Общий режим: сброс из памяти не перезаписывает счетчики, изменённые другими процессами
+_UPSERT_SHARED_SQL = (
+    f"INSERT INTO users ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+    "ON CONFLICT(user_id) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in _COLUMNS[1:] if column not in _COUNTERS)
+)
+
+_SELECT_COUNTERS_SQL = f"SELECT {', '.join(_COUNTERS)} FROM users WHERE user_id = ?"
+_UPDATE_COUNTERS_SQL = f"UPDATE users SET {', '.join(f'{c} = ?' for c in _COUNTERS)} WHERE user_id = ?"
+
+
+_FIELDS = frozenset(_COLUMNS[1:])
+
+
+class UserRecord:
+    """Запись пользователя в памяти.
+
+    Атрибуты в ``__slots__`` вместо словаря из семи ключей и ``date``: запись
+    в несколько раз компактнее, а доступ к полям быстрее. День последнего
+    сброса дневного лимита хранится номером дня (``date.toordinal``).
+    Доступ по ключу (``user["balance"]``) сохранен для кода, который работал
+    со словарем.
+    """
+
+    __slots__ = ("username", "daily_requests", "daily_limit", "day", "total_requests", "balance",
+                 "deep_research_used")
+
+    def __init__(
+        self,
+        username: str,
+        day: int,
+        daily_requests: int = 0,
+        daily_limit: int = 3,
+        total_requests: int = 0,
+        balance: int = 0,
+        deep_research_used: bool = False,
+    ) -> None:
+        self.username = username
+        self.day = day
+        self.daily_requests = daily_requests
+        self.daily_limit = daily_limit
+        self.total_requests = total_requests
+        self.balance = balance
+        self.deep_research_used = deep_research_used  # Бесплатная попытка Deep Research
+
+    @property
+    def last_reset(self) -> date:
+        return date.fromordinal(self.day)
+
+    @last_reset.setter
+    def last_reset(self, value: date) -> None:
+        self.day = value.toordinal()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in _FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in _FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: object) -> bool:
+        return key in _FIELDS
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in _COLUMNS[1:]}
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.to_dict()!r})"
+
+
+class DayClock:
+    """Номер текущего дня, который пересчитывается раз в сутки.
+
+    ``date.today()`` на каждое обращение заменяется сравнением с моментом
+    ближайшей полуночи по местному времени.
+    """
+
+    __slots__ = ("day", "_rollover_at")
 
-class UserService:
     def __init__(self) -> None:
-        self.users: Dict[int, Dict] = {}
+        self._advance()
+
+    def _advance(self) -> None:
+        today = date.today()
+        self.day = today.toordinal()
+        self._rollover_at = datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp()
+
+    def today(self) -> int:
+        if time.time() >= self._rollover_at:
+            self._advance()
+        return self.day
+
+
+class _LocalChange:
+    """Изменение записи в памяти (без общей базы): запись помечается для сброса"""
+
+    __slots__ = ("service", "user_id")
+
+    def __init__(self, service: "UserService", user_id: int) -> None:
+        self.service = service
+        self.user_id = user_id
+
+    def __enter__(self) -> UserRecord:
+        return self.service._get(self.user_id)
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.service._dirty.add(self.user_id)
+        return False
+
+
+@dataclass
+class QuotaReservation:
+    """Квота, занятая до обращения к API: списывается (commit) или возвращается (refund)"""
+    id: str
+    user_id: int
+    amount: int  # зарезервированная часть баланса
+    day: int  # номер дня, в лимит которого засчитан запрос
+    expires_at: float
+
+
+class UserService:
+    """Учёт пользователей, лимитов и баланса.
+
+    Все обращения идут к записям ``UserRecord`` в памяти. Если задан ``db_path``, изменения
+    накапливаются (write-back) и пачкой сбрасываются в SQLite (WAL) раз в
+    ``flush_interval`` секунд, поэтому при сбое теряется не больше одного интервала.
+
+    Запрос к API оплачивается через резерв: ``reserve`` до запроса атомарно
+    занимает место в дневном лимите и баланс, ``commit`` после успеха
+    списывает их окончательно, ``refund`` при ошибке возвращает. Резерв, не
+    завершенный за ``reservation_ttl`` секунд, возвращается автоматически.
+    В одном процессе атомарность дает цикл событий (между проверкой и
+    списанием нет ``await``). В общем режиме (``shared``, несколько процессов
+    с одной базой) счетчики перечитываются и записываются в транзакции
+    ``BEGIN IMMEDIATE``, а резервы хранятся в таблице ``quota_reservations``:
+    резервы упавшего процесса по истечении срока возвращает любой другой.
+    Транзакция выполняется в цикле событий, поэтому блокировку записи она
+    ждет не дольше ``busy_timeout`` секунд: ``reserve`` в этом случае бросает
+    ``sqlite3.OperationalError``, а списание или возврат резерва повторяются
+    при следующем сбросе.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        flush_interval: float = 1.0,
+        shared: bool = False,
+        reservation_ttl: float = 900.0,
+        busy_timeout: float = 0.1,
+    ) -> None:
+        self.users: Dict[int, UserRecord] = {}
+        self._clock = DayClock()
         self.valid_codes = {
             "42": 5,
             "WELCOME": 3,
         }
+        self.flush_interval = flush_interval
+        self.shared = shared and bool(db_path)
+        self.reservation_ttl = reservation_ttl
+        self.busy_timeout = busy_timeout
+        self.reserved = 0
+        self.committed = 0
+        self.refunded = 0
+        self.expired = 0
+        self._reservations: Dict[str, QuotaReservation] = {}
+        # Резервы, списание которых не удалось из-за занятой базы (повторяются при сбросе)
+        self._deferred_commits: List[QuotaReservation] = []
+        # Идентификаторы резервов уникальны между процессами с общей базой
+        self._reservation_prefix = uuid.uuid4().hex[:12]
+        self._reservation_ids = itertools.count(1)
+        self._dirty: Set[int] = set()
+        self._db: Optional[sqlite3.Connection] = None
+        # Повторный вход: чтение пользователя внутри транзакции общего режима
+        self._db_lock = threading.RLock()
+        self._flush_task: Optional[asyncio.Task] = None
+        if db_path:
+            self._open_db(db_path)
+
+    # --- Хранилище ---
+
+    def _open_db(self, db_path: str) -> None:
+        # В общем режиме транзакции идут в цикле событий: ждать блокировку записи долго нельзя
+        self._db = sqlite3.connect(
+            db_path, check_same_thread=False, timeout=self.busy_timeout if self.shared else 5.0
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, username TEXT, "
+            "daily_requests INTEGER NOT NULL DEFAULT 0, daily_limit INTEGER NOT NULL DEFAULT 3, "
+            "last_reset TEXT NOT NULL, total_requests INTEGER NOT NULL DEFAULT 0, "
+            "balance INTEGER NOT NULL DEFAULT 0, deep_research_used INTEGER NOT NULL DEFAULT 0)"
+        )
+        if self.shared:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS quota_reservations ("
+                "id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, amount INTEGER NOT NULL, "
+                "day TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_quota_reservations_expires ON quota_reservations(expires_at)"
+            )
+        self._db.commit()
+        logger.info("Хранилище пользователей: %s", db_path)
+
+    def _load(self, user_id: int) -> Optional[UserRecord]:
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(_SELECT_SQL, (user_id,)).fetchone()
+        if row is None:
+            return None
+        return UserRecord(
+            username=row[0],
+            daily_requests=row[1],
+            daily_limit=row[2],
+            day=date.fromisoformat(row[3]).toordinal(),
+            total_requests=row[4],
+            balance=row[5],
+            deep_research_used=bool(row[6]),
+        )
+
+    def _row(self, user_id: int) -> Tuple:
+        u = self.users[user_id]
+        return (
+            user_id, u.username, u.daily_requests, u.daily_limit,
+            date.fromordinal(u.day).isoformat(), u.total_requests, u.balance,
+            int(u.deep_research_used),
+        )
+
+    def _write_rows(self, rows: List[Tuple]) -> None:
+        with self._db_lock:
+            with self._db:
+                self._db.executemany(_UPSERT_SHARED_SQL if self.shared else _UPSERT_SQL, rows)
+
+    def _take_dirty_rows(self) -> List[Tuple]:
+        rows = [self._row(user_id) for user_id in self._dirty if user_id in self.users]
+        self._dirty.clear()
+        return rows
+
+    async def flush(self) -> None:
+        """Сбрасывает накопленные изменения в SQLite одной транзакцией"""
+        if self._db is None:
+            # Без базы сохранять некуда
+            self._dirty.clear()
+            return
+        if not self._dirty:
+            return
+        rows = self._take_dirty_rows()
+        try:
+            await asyncio.to_thread(self._write_rows, rows)
+        except sqlite3.Error as e:
+            logger.error("Ошибка сохранения пользователей: %s", e)
+            self._dirty.update(row[0] for row in rows)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self._retry_deferred_commits()
+                self.expire_reservations()
+            except sqlite3.Error as e:
+                logger.error("Ошибка возврата просроченных резервов: %s", e)
+            await self.flush()
+
+    async def start(self) -> None:
+        """Запускает периодический сброс изменений и возврат просроченных резервов"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Останавливает сброс, сохраняет оставшиеся изменения и закрывает базу"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        self._retry_deferred_commits()
+        # Незавершенные резервы (обработчики прерваны остановкой) возвращаются
+        for reservation in list(self._reservations.values()):
+            self.refund(reservation)
+        if self._db is not None:
+            rows = self._take_dirty_rows()
+            if rows:
+                self._write_rows(rows)
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    # --- Учёт пользователей ---
+
+    def _get(self, user_id: int) -> UserRecord:
+        user = self.users.get(user_id)
+        if user is None:
+            user = self._load(user_id)
+            if user is None:
+                self.register_user(user_id, "Unknown")
+                user = self.users[user_id]
+            else:
+                self.users[user_id] = user
+        if user.day != self._clock.today():
+            self._reset(user_id, user)
+        return user
 
     def register_user(self, user_id: int, username: str) -> None:
         if user_id not in self.users:
-            self.users[user_id] = {
-                "username": username,
-                "daily_requests": 0,
-                "daily_limit": 3,
-                "last_reset": date.today(),
-                "total_requests": 0,
-                "balance": 0,
-                "deep_research_used": False,  # Бесплатная попытка Deep Research
-            }
-
-    def _reset_if_needed(self, user_id: int) -> None:
-        user = self.users[user_id]
-        if user["last_reset"] != date.today():
-            user["daily_requests"] = 0
-            user["last_reset"] = date.today()
-
-    def get_user_stats(self, user_id: int) -> Dict:
-        if user_id not in self.users:
-            self.register_user(user_id, "Unknown")
-        self._reset_if_needed(user_id)
-        return self.users[user_id]
+            user = self._load(user_id)
+            if user is not None:
+                self.users[user_id] = user
+                return
+            self.users[user_id] = UserRecord(username, self._clock.today())
+            self._dirty.add(user_id)
+
+    def _reset(self, user_id: int, user: UserRecord) -> None:
+        """Сброс дневного счетчика при первом обращении в новый день"""
+        user.daily_requests = 0
+        user.day = self._clock.today()
+        self._dirty.add(user_id)
+
+    def get_user_stats(self, user_id: int) -> UserRecord:
+        """Запись пользователя (поля доступны и как ``stats["balance"]``)"""
+        return self._get(user_id)
 
     def check_daily_limit(self, user_id: int) -> bool:
-        if user_id not in self.users:
-            self.register_user(user_id, "Unknown")
-        self._reset_if_needed(user_id)
-        u = self.users[user_id]
-        return u["daily_requests"] < u["daily_limit"]
+        u = self._get(user_id)
+        return u.daily_requests < u.daily_limit
 
     def make_request(self, user_id: int, cost: int = 1) -> None:
-        if user_id not in self.users:
-            self.register_user(user_id, "Unknown")
-        self._reset_if_needed(user_id)
-        u = self.users[user_id]
-        u["daily_requests"] += 1
-        u["total_requests"] += 1
-        u["balance"] = max(0, u["balance"] - cost)
+        with self._exclusive(user_id) as u:
+            u.daily_requests += 1
+            u.total_requests += 1
+            u.balance = max(0, u.balance - cost)
+
+    # --- Резервирование квоты ---
+
+    def _exclusive(self, user_id: int):
+        """Изменение счетчиков пользователя.
+
+        В общем режиме — транзакция ``BEGIN IMMEDIATE``: счетчики
+        перечитываются из базы под блокировкой записи и сразу записываются
+        обратно, поэтому процессы с одной базой не перезаписывают друг друга.
+        """
+        if self.shared:
+            return self._transaction(user_id)
+        return _LocalChange(self, user_id)
+
+    @contextmanager
+    def _transaction(self, user_id: int) -> Iterator[UserRecord]:
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                user = self._get(user_id)
+                row = self._db.execute(_SELECT_COUNTERS_SQL, (user_id,)).fetchone()
+                if row is None:
+                    self._db.execute(_UPSERT_SQL, self._row(user_id))
+                else:
+                    user.daily_requests, user.total_requests, user.balance = row[0], row[2], row[3]
+                    user.day = date.fromisoformat(row[1]).toordinal()
+                    if user.day != self._clock.today():
+                        self._reset(user_id, user)
+                yield user
+                self._db.execute(_UPDATE_COUNTERS_SQL, (
+                    user.daily_requests, date.fromordinal(user.day).isoformat(),
+                    user.total_requests, user.balance, user_id,
+                ))
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                # Счетчики в памяти могли измениться — при следующем обращении они перечитываются
+                raise
+
+    def _forget_reservation(self, reservation_id: str) -> bool:
+        """Удаляет резерв из общей таблицы (False — его уже завершил другой процесс)"""
+        return self._db.execute(
+            "DELETE FROM quota_reservations WHERE id = ?", (reservation_id,)
+        ).rowcount == 1
+
+    def reserve(
+        self, user_id: int, cost: int = 1, paid: bool = False, ttl: Optional[float] = None
+    ) -> Optional[QuotaReservation]:
+        """Атомарно занимает квоту до запроса к API (None — квоты не хватает).
+
+        Обычный запрос занимает место в дневном лимите и до ``cost`` баланса
+        (сколько есть). Платный (``paid``) лимитом не ограничен, но требует
+        ``cost`` на балансе целиком.
+        """
+        with self._exclusive(user_id) as u:
+            if paid:
+                if u.balance < cost:
+                    return None
+                amount = cost
+            else:
+                if u.daily_requests >= u.daily_limit:
+                    return None
+                amount = min(cost, u.balance)
+            u.daily_requests += 1
+            u.balance -= amount
+            reservation = QuotaReservation(
+                id=f"{self._reservation_prefix}-{next(self._reservation_ids)}",
+                user_id=user_id,
+                amount=amount,
+                day=u.day,
+                expires_at=time.time() + (self.reservation_ttl if ttl is None else ttl),
+            )
+            if self.shared:
+                self._db.execute(
+                    "INSERT INTO quota_reservations (id, user_id, amount, day, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (reservation.id, user_id, amount, date.fromordinal(reservation.day).isoformat(),
+                     reservation.expires_at),
+                )
+        self._reservations[reservation.id] = reservation
+        self.reserved += 1
+        return reservation
+
+    def commit(self, reservation: QuotaReservation) -> bool:
+        """Окончательно списывает резерв (False — резерв уже завершен или возвращен по сроку)"""
+        if self._reservations.pop(reservation.id, None) is None:
+            return False
+        try:
+            return self._commit(reservation)
+        except sqlite3.OperationalError as e:
+            logger.warning("База занята, списание резерва пользователя %s отложено: %s", reservation.user_id, e)
+            self._deferred_commits.append(reservation)
+            return True
+
+    def _commit(self, reservation: QuotaReservation) -> bool:
+        with self._exclusive(reservation.user_id) as u:
+            if self.shared and not self._forget_reservation(reservation.id):
+                return False
+            u.total_requests += 1
+        self.committed += 1
+        return True
+
+    def _retry_deferred_commits(self) -> None:
+        deferred, self._deferred_commits = self._deferred_commits, []
+        for index, reservation in enumerate(deferred):
+            try:
+                self._commit(reservation)
+            except sqlite3.OperationalError:
+                self._deferred_commits.extend(deferred[index:])
+                return
+
+    def refund(self, reservation: QuotaReservation) -> bool:
+        """Возвращает резерв (False — резерв уже завершен); повторный вызов безопасен"""
+        if self._reservations.pop(reservation.id, None) is None:
+            return False
+        try:
+            with self._exclusive(reservation.user_id) as u:
+                if self.shared and not self._forget_reservation(reservation.id):
+                    return False
+                self._release(u, reservation)
+        except sqlite3.OperationalError as e:
+            # Резерв остается незавершенным и возвращается при следующей проверке сроков
+            logger.warning("База занята, возврат резерва пользователя %s отложен: %s", reservation.user_id, e)
+            reservation.expires_at = 0.0
+            self._reservations[reservation.id] = reservation
+            return False
+        self.refunded += 1
+        return True
+
+    @staticmethod
+    def _release(user: UserRecord, reservation: QuotaReservation) -> None:
+        # Запрос, засчитанный во вчерашний лимит, сегодняшний лимит не освобождает
+        if user.day == reservation.day:
+            user.daily_requests = max(0, user.daily_requests - 1)
+        user.balance += reservation.amount
+
+    def expire_reservations(self) -> int:
+        """Возвращает просроченные резервы: свои и (в общем режиме) резервы упавших процессов"""
+        now = time.time()
+        expired = 0
+        for reservation in [r for r in self._reservations.values() if r.expires_at <= now]:
+            if self.refund(reservation):
+                expired += 1
+                logger.warning("Резерв квоты пользователя %s возвращен по истечении срока", reservation.user_id)
+        if self.shared:
+            with self._db_lock:
+                rows = self._db.execute(
+                    "SELECT id, user_id, amount, day, expires_at FROM quota_reservations WHERE expires_at <= ?",
+                    (now,),
+                ).fetchall()
+            for reservation_id, user_id, amount, day, expires_at in rows:
+                reservation = QuotaReservation(
+                    reservation_id, user_id, amount, date.fromisoformat(day).toordinal(), expires_at
+                )
+                with self._exclusive(user_id) as u:
+                    if not self._forget_reservation(reservation_id):
+                        continue
+                    self._release(u, reservation)
+                expired += 1
+                logger.warning("Возвращен резерв квоты пользователя %s, оставленный другим процессом", user_id)
+        self.expired += expired
+        return expired
+
+    @property
+    def pending_reservations(self) -> int:
+        return len(self._reservations)
 
     def apply_promo_code(self, user_id: int, code: str) -> Dict:
         added = self.valid_codes.get(code.upper(), 0)
         if added:
-            self.users[user_id]["balance"] += added
+            with self._exclusive(user_id) as user:
+                user.balance += added
             # Промо-код "42" также сбрасывает Deep Research
             if code.upper() == "42":
-                self.users[user_id]["deep_research_used"] = False
+                user.deep_research_used = False
+            self._dirty.add(user_id)
             return {"success": True, "added_requests": added, "message": "Промо применен"}
         return {"success": False, "added_requests": 0, "message": "Код не найден"}
 
     def can_use_deep_research(self, user_id: int) -> bool:
         """Проверяет, может ли пользователь использовать Deep Research"""
-        if user_id not in self.users:
-            self.register_user(user_id, "Unknown")
-        self._reset_if_needed(user_id)
-        return not self.users[user_id]["deep_research_used"]
+        return not self._get(user_id).deep_research_used
 
     def use_deep_research(self, user_id: int) -> None:
         """Отмечает, что пользователь использовал Deep Research"""
-        if user_id not in self.users:
-            self.register_user(user_id, "Unknown")
-        self._reset_if_needed(user_id)
-        self.users[user_id]["deep_research_used"] = True
+        self._get(user_id).deep_research_used = True
+        self._dirty.add(user_id)
+
+    def refund_request(self, user_id: int, cost: int = 1) -> None:
+        """Возвращает списанный запрос (например, если задача не была выполнена)"""
+        with self._exclusive(user_id) as u:
+            u.daily_requests = max(0, u.daily_requests - 1)
+            u.total_requests = max(0, u.total_requests - 1)
+            u.balance += cost
+
+    def restore_deep_research(self, user_id: int) -> None:
+        """Возвращает бесплатную попытку Deep Research"""
+        self._get(user_id).deep_research_used = False
+        self._dirty.add(user_id)
@@ -0,0 +1,130 @@
+import hmac
+import json
+import secrets
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from utils.logger import setup_logger
+from services.update_inbox_service import UpdateInboxService
+from utils.metrics import REGISTRY, WEBHOOK_ACK_LATENCY, WEBHOOK_UPDATES
+
+logger = setup_logger(__name__)
+
+# Заголовок с секретом, который Telegram передает в запросах webhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Формат ответа /metrics (текстовый формат Prometheus)
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Readiness = Callable[[], Tuple[bool, Dict[str, Any]]]
+
+
+class BotHttpServer:
+    """Встроенный HTTP-сервер бота: /health, /live, /metrics и приём webhook.
+
+    В режиме webhook апдейты принимаются на том же порту, что и служебные
+    маршруты; в режиме polling сервер отдает только служебные маршруты. Если
+    задан ``inbox``, апдейт только сохраняется в нём (с отбрасыванием повторов
+    по update_id) и сразу подтверждается, а разбор и обработку выполняет
+    диспетчер буфера.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        readiness: Readiness,
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        webhook_path: Optional[str] = None,
+        webhook_secret: str = "",
+        inbox: Optional[UpdateInboxService] = None,
+    ) -> None:
+        self.application = application
+        self.readiness = readiness
+        self.host = host
+        self.port = port
+        self.webhook_path = webhook_path
+        if webhook_path and not webhook_secret:
+            # Без секрета любой, кто узнал адрес, может подсовывать апдейты
+            webhook_secret = secrets.token_urlsafe(32)
+            logger.info("WEBHOOK_SECRET не задан: сгенерирован случайный секрет для webhook")
+        self.webhook_secret = webhook_secret
+        self.inbox = inbox
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/live", self.live)
+        app.router.add_get("/metrics", self.metrics)
+        if self.webhook_path:
+            app.router.add_post(self.webhook_path, self.webhook)
+        return app
+
+    async def start(self) -> None:
+        if self._runner is not None:
+            return
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("HTTP-сервер слушает %s:%s", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # --- Маршруты ---
+
+    async def health(self, request: web.Request) -> web.Response:
+        """Готовность принимать запросы (учитывает состояние автомата защиты API)"""
+        ready, details = self.readiness()
+        details["status"] = "ok" if ready else "unavailable"
+        return web.json_response(details, status=200 if ready else 503)
+
+    async def live(self, request: web.Request) -> web.Response:
+        """Процесс жив и цикл событий отвечает"""
+        return web.json_response({"status": "ok"})
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    async def webhook(self, request: web.Request) -> web.Response:
+        started = time.perf_counter()
+        token = request.headers.get(SECRET_HEADER, "")
+        if not self.webhook_secret or not hmac.compare_digest(token.encode(), self.webhook_secret.encode()):
+            WEBHOOK_UPDATES.inc(result="forbidden")
+            return web.Response(status=403)
+        if self.inbox is not None:
+            response = await self._enqueue(request)
+            WEBHOOK_ACK_LATENCY.observe(time.perf_counter() - started)
+            return response
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            WEBHOOK_UPDATES.inc(result="invalid")
+            logger.warning("Некорректный апдейт в webhook: %s", e)
+            return web.Response(status=400)
+        if update is not None:
+            await self.application.update_queue.put(update)
+        WEBHOOK_UPDATES.inc(result="accepted")
+        WEBHOOK_ACK_LATENCY.observe(time.perf_counter() - started)
+        return web.Response(status=200)
+
+    async def _enqueue(self, request: web.Request) -> web.Response:
+        """Сохраняет сырой апдейт в буфере; повтор подтверждается, но не обрабатывается"""
+        try:
+            payload = await request.text()
+            update_id = int(json.loads(payload)["update_id"])
+        except (ValueError, TypeError, KeyError) as e:
+            WEBHOOK_UPDATES.inc(result="invalid")
+            logger.warning("Некорректный апдейт в webhook: %s", e)
+            return web.Response(status=400)
+        accepted = await self.inbox.accept(update_id, payload)
+        WEBHOOK_UPDATES.inc(result="accepted" if accepted else "duplicate")
+        return web.Response(status=200)
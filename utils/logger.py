@@ -1,34 +1,223 @@
+import atexit
+import json
 import logging
-import os
-from logging.handlers import RotatingFileHandler
+import queue
+import reprlib
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Optional, Tuple
+
+from app_config import Config
+
+# Атрибуты LogRecord, которые не относятся к полям, переданным через extra
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Шумные сторонние логгеры: httpx пишет каждый запрос к Bot API (с токеном в URL)
+_QUIET_LOGGERS = ("httpx", "httpcore", "aiohttp.access")
+
+_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["_AsyncQueueHandler"] = None
+
+
+class _Truncator:
+    """Ограничивает длину аргументов сообщения и полей extra"""
+
+    def __init__(self, max_chars: int) -> None:
+        self.max_chars = max_chars
+        # repr с ограничением глубины и размера: большой словарь не сериализуется целиком
+        self._repr = reprlib.Repr()
+        self._repr.maxstring = max_chars
+        self._repr.maxother = max_chars
+        self._repr.maxlevel = 3
+        self._repr.maxdict = self._repr.maxlist = 20
+
+    def value(self, value: Any) -> Any:
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, str):
+            text = value
+        elif isinstance(value, BaseException):
+            text = str(value)
+        else:
+            text = self._repr.repr(value)
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}… (+{len(text) - self.max_chars})"
+        return text
+
+
+class _Sampler:
+    """Пропускает не больше burst записей одного шаблона за interval секунд.
+
+    Предупреждения и ошибки не отбрасываются. Число пропущенных записей
+    сообщается в поле ``suppressed`` следующей записи того же шаблона.
+    """
+
+    def __init__(self, burst: int, interval: float) -> None:
+        self.burst = burst
+        self.interval = interval
+        self._windows: Dict[Tuple[str, Any], list] = {}
+
+    def allow(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.msg)
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window is not None else 0
+            if len(self._windows) > 10_000:
+                self._windows.clear()
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class _AsyncQueueHandler(QueueHandler):
+    """Передаёт записи в фоновый поток, не форматируя их в вызывающем коде.
+
+    В потоке обработчика только обрезаются аргументы (чтобы запись не держала
+    крупные объекты) и применяется сэмплирование. Если очередь переполнена,
+    запись отбрасывается — вывод логов не должен задерживать обработку апдейтов.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]", truncator: _Truncator, sampler: _Sampler) -> None:
+        super().__init__(log_queue)
+        self.truncator = truncator
+        self.sampler = sampler
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            if isinstance(record.args, dict):
+                if "%(" in str(record.msg):
+                    record.args = {k: self.truncator.value(v) for k, v in record.args.items()}
+                else:
+                    # Единственный аргумент-словарь для "%s"
+                    record.args = (self.truncator.value(record.args),)
+            else:
+                record.args = tuple(self.truncator.value(arg) for arg in record.args)
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                record.__dict__[key] = self.truncator.value(value)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if not self.sampler.allow(record):
+            return
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON с полями extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемый формат; поля extra дописываются в конец строки"""
+
+    def __init__(self) -> None:
+        super().__init__(fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extra = " ".join(f"{k}={v}" for k, v in record.__dict__.items() if k not in _RECORD_ATTRS)
+        return f"{text} [{extra}]" if extra else text
+
+
+def configure_logging() -> None:
+    """Настраивает общий конвейер логов (один раз на процесс).
+
+    Все логгеры пишут через корневой логгер в ограниченную очередь, записи
+    форматируются и выводятся в отдельном потоке. Параметры берутся из Config:
+    LOG_LEVEL, LOG_FILE, LOG_FORMAT (json | text), LOG_MAX_FIELD_CHARS,
+    LOG_QUEUE_SIZE, LOG_SAMPLE_BURST и LOG_SAMPLE_INTERVAL.
+    """
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            return
+
+        level = Config.LOG_LEVEL.upper()
+        formatter = TextFormatter() if Config.LOG_FORMAT.lower() == "text" else JsonFormatter()
+
+        handlers = []
+        # Console
+        ch = logging.StreamHandler()
+        ch.setFormatter(formatter)
+        handlers.append(ch)
+
+        # File (optional)
+        log_file = Config.LOG_FILE
+        if log_file:
+            fh = RotatingFileHandler(log_file, maxBytes=2_000_000, backupCount=3)
+            fh.setFormatter(formatter)
+            handlers.append(fh)
+
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(Config.LOG_QUEUE_SIZE)
+        _queue_handler = _AsyncQueueHandler(
+            log_queue,
+            _Truncator(Config.LOG_MAX_FIELD_CHARS),
+            _Sampler(Config.LOG_SAMPLE_BURST, Config.LOG_SAMPLE_INTERVAL),
+        )
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        for name in _QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        _listener = QueueListener(log_queue, *handlers)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Дописывает оставшиеся в очереди записи и останавливает фоновый поток"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def dropped_records() -> int:
+    """Число записей, отброшенных из-за переполнения очереди"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
 
 
 def setup_logger(name: str) -> logging.Logger:
-    logger = logging.getLogger(name)
-    if logger.handlers:
-        return logger
-
-    level = os.getenv("LOG_LEVEL", "INFO").upper()
-    logger.setLevel(level)
-
-    formatter = logging.Formatter(
-        fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
-
-    # Console
-    ch = logging.StreamHandler()
-    ch.setLevel(level)
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
-
-    # File (optional)
-    log_file = os.getenv("LOG_FILE")
-    if log_file:
-        fh = RotatingFileHandler(log_file, maxBytes=2_000_000, backupCount=3)
-        fh.setLevel(level)
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
-
-    logger.propagate = False
-    return logger
+    configure_logging()
+    return logging.getLogger(name)
@@ -0,0 +1,114 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Ссылка [текст](url) в разметке Telegram Markdown
+_LINK_RE = re.compile(r"\[[^\]\n]*\]\([^)\s]*\)")
+
+# Закрывающая и открывающая разметка для сущности, разрезанной между частями
+_CLOSERS = {"*": "*", "_": "_", "```": "\n```"}
+_OPENERS = {"*": "*", "_": "_", "```": "```\n"}
+_RESERVE = max(map(len, _CLOSERS.values())) + max(map(len, _OPENERS.values()))
+
+# Приоритет мест разреза: абзац, строка, пробел
+_SEPARATORS = ("\n\n", "\n", " ")
+
+
+def _scan(text: str, start: int, end: int, state: str) -> Tuple[Dict[int, str], str, Optional[int]]:
+    """Проходит text[start:end] по правилам Telegram Markdown (без вложенности).
+
+    Возвращает состояние разметки в каждом допустимом месте разреза (позиция сразу
+    после пробела или перевода строки), состояние в конце отрезка и начало ссылки
+    или строчного кода, которые не поместились в отрезок (их резать нельзя).
+    """
+    cuts: Dict[int, str] = {}
+    entity_start = start
+    i = start
+    while i < end:
+        ch = text[i]
+        if state == "`":
+            close = text.find("`", i, end)
+            if close == -1:
+                return cuts, state, entity_start
+            i, state = close + 1, ""
+            continue
+        if state == "```":
+            if text.startswith("```", i):
+                i, state = i + 3, ""
+            else:
+                if ch == "\n":
+                    cuts[i + 1] = state
+                i += 1
+            continue
+        if ch == " " or ch == "\n":
+            cuts[i + 1] = state
+        elif state:
+            if ch == state:
+                state = ""
+        elif ch == "\\" and i + 1 < end and text[i + 1] in "_*`[":
+            i += 2
+            continue
+        elif text.startswith("```", i):
+            i, state = i + 3, "```"
+            continue
+        elif ch == "`":
+            entity_start, state = i, "`"
+        elif ch == "[":
+            match = _LINK_RE.match(text, i)
+            if match is not None:
+                if match.end() > end:
+                    return cuts, state, i
+                i = match.end()
+                continue
+        elif ch == "*" or ch == "_":
+            state = ch
+        i += 1
+    return cuts, state, None
+
+
+def _choose_cut(text: str, start: int, end: int, cuts: Dict[int, str]) -> Optional[int]:
+    lower = start + (end - start) // 2
+    for separator in _SEPARATORS:
+        for position in reversed(cuts):
+            if position <= lower:
+                break
+            if text.startswith(separator, position - len(separator)):
+                return position
+    return None
+
+
+def is_balanced(text: str) -> bool:
+    """Все сущности Markdown в тексте закрыты"""
+    _, state, _ = _scan(text, 0, len(text), "")
+    return state == ""
+
+
+def split_markdown(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Разбивает текст с разметкой Telegram Markdown на части не длиннее limit.
+
+    Разрез ставится по абзацу, строке или пробелу и не попадает внутрь ссылок
+    и строчного кода. Жирный, курсив и блоки кода, пересекающие разрез,
+    закрываются в конце части и открываются заново в начале следующей.
+    """
+    parts: List[str] = []
+    start = 0
+    state = ""
+    while True:
+        opener = _OPENERS.get(state, "")
+        if len(opener) + len(text) - start <= limit:
+            parts.append(opener + text[start:])
+            return parts
+        end = start + limit - _RESERVE
+        cuts, end_state, entity = _scan(text, start, end, state)
+        cut = _choose_cut(text, start, end, cuts)
+        if cut is not None:
+            cut_state = cuts[cut]
+        elif entity is not None and entity > start:
+            # Ссылка или код не помещаются — переносим их целиком в следующую часть
+            cut, cut_state = entity, ""
+        else:
+            cut, cut_state = end, ("" if entity is not None else end_state)
+        body = text[start:cut].rstrip() if cut_state else text[start:cut]
+        parts.append(opener + body + _CLOSERS.get(cut_state, ""))
+        start, state = cut, cut_state
@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Границы корзин по умолчанию, секунды (от быстрых обращений к кэшу до Deep Research)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class _ValueMetric(_Metric):
+    """Метрика с одним значением на набор меток; значения можно вычислять при сборе"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        collect: Optional[Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self.collect = collect
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        values = dict(self._values)
+        if self.collect is not None:
+            for labels, value in self.collect():
+                values[self._key(labels)] = value
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(_ValueMetric):
+    """Монотонно растущий счетчик"""
+    kind = "counter"
+
+
+class Gauge(_ValueMetric):
+    """Текущее значение"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами (кумулятивные счетчики Prometheus)"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # значения меток -> [счетчики по корзинам..., счетчик +Inf, сумма]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        row = self._values.get(key)
+        if row is None:
+            row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterable[str]:
+        for key, row in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(row[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """Набор метрик процесса, отдаваемый в текстовом формате Prometheus"""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (), collect=None) -> Counter:
+        metric = self.register(Counter(name, documentation, labelnames))
+        if collect is not None:
+            metric.collect = collect
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), collect=None) -> Gauge:
+        metric = self.register(Gauge(name, documentation, labelnames))
+        if collect is not None:
+            metric.collect = collect
+        return metric
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр процесса
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта обработчиком", ("handler",)
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Необработанные исключения в обработчиках", ("handler",)
+)
+SERVICE_LATENCY = REGISTRY.histogram(
+    "bot_service_duration_seconds", "Время выполнения операций сервисов", ("service", "operation")
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "bot_upstream_request_duration_seconds", "Время одной попытки запроса к Perplexity API", ("model",)
+)
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "bot_upstream_responses_total", "Ответы Perplexity API по кодам статуса", ("model", "status")
+)
+WEBHOOK_UPDATES = REGISTRY.counter(
+    "bot_webhook_updates_total", "Запросы webhook по результату приёма", ("result",)
+)
+WEBHOOK_ACK_LATENCY = REGISTRY.histogram(
+    "bot_webhook_ack_seconds", "Время ответа на запрос webhook",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "bot_event_loop_lag_seconds", "Опоздание пробуждений цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+def observe_latency(service: str, operation: Optional[str] = None):
+    """Декоратор асинхронного метода: время выполнения в bot_service_duration_seconds"""
+
+    def decorator(func):
+        name = operation or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with SERVICE_LATENCY.time(service=service, operation=name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class EventLoopLagMonitor:
+    """Периодически измеряет задержку цикла событий и пишет её в гистограмму"""
+
+    def __init__(self, interval: float = 0.5) -> None:
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - started - self.interval)
+            EVENT_LOOP_LAG.observe(self.last_lag)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,158 @@
+import asyncio
+from typing import Callable, List, Optional
+
+from telegram import InlineKeyboardMarkup, Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from utils.logger import setup_logger
+from utils.markdown_splitter import is_balanced, split_markdown
+
+logger = setup_logger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+CURSOR = " ⏳"
+
+
+def split_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Разбивает текст на части не длиннее limit, по возможности по строкам"""
+    parts = []
+    start = 0
+    while len(text) - start > limit:
+        cut = find_cut(text, start, limit)
+        parts.append(text[start:cut])
+        start = cut
+    if start < len(text) or not parts:
+        parts.append(text[start:])
+    return parts
+
+
+def find_cut(text: str, start: int, limit: int) -> int:
+    """Позиция разреза не дальше start + limit: по абзацу, строке или пробелу"""
+    end = start + limit
+    if end >= len(text):
+        return len(text)
+    for separator in ("\n\n", "\n", " "):
+        position = text.rfind(separator, start + limit // 2, end)
+        if position != -1:
+            return position + len(separator)
+    return end
+
+
+class ProgressiveMessage:
+    """Постепенно обновляет сообщение Telegram по мере генерации ответа.
+
+    ``update`` только запоминает текст; правки отправляет фоновая задача не чаще
+    одного раза в ``min_interval`` секунд. Когда текст перерастает лимит Telegram,
+    текущее сообщение фиксируется и продолжение уходит в новое сообщение.
+    """
+
+    def __init__(
+        self,
+        message: Message,
+        min_interval: float = 1.5,
+        limit: int = TELEGRAM_MESSAGE_LIMIT,
+        render: Optional[Callable[[str], str]] = None,
+    ) -> None:
+        self.messages: List[Message] = [message]
+        self.min_interval = min_interval
+        self.limit = limit
+        self.render = render
+        self._sent: List[str] = [message.text or ""]
+        self._text = ""
+        self._offset = 0
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def update(self, text: str) -> None:
+        """Запоминает накопленный текст ответа (не блокирует)"""
+        if self._closed:
+            return
+        self._text = text
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._closed:
+            try:
+                await self._flush()
+            except RetryAfter as e:
+                await asyncio.sleep(float(e.retry_after))
+                continue
+            except TelegramError as e:
+                logger.warning("Не удалось обновить сообщение: %s", e)
+            await asyncio.sleep(self.min_interval)
+
+    async def _flush(self) -> None:
+        display = self.render(self._text) if self.render else self._text
+        if not display:
+            return
+        # Переход на новое сообщение на границе лимита Telegram
+        while len(display) - self._offset > self.limit - len(CURSOR):
+            cut = find_cut(display, self._offset, self.limit - len(CURSOR))
+            await self._edit(len(self.messages) - 1, display[self._offset:cut])
+            self._offset = cut
+            new_message = await self.messages[-1].reply_text(display[cut:cut + self.limit - len(CURSOR)] + CURSOR)
+            self.messages.append(new_message)
+            self._sent.append(new_message.text or "")
+        await self._edit(len(self.messages) - 1, display[self._offset:] + CURSOR)
+
+    async def _edit(self, index: int, text: str, parse_mode: Optional[str] = None,
+                    reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        if self._sent[index] == text and reply_markup is None and parse_mode is None:
+            return
+        try:
+            await self.messages[index].edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._sent[index] = text
+
+    async def stop(self) -> None:
+        """Останавливает фоновые правки"""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, TelegramError):
+                pass
+            self._task = None
+
+    async def finish(self, text: str, parse_mode: Optional[str] = 'Markdown',
+                     reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Показывает итоговый текст, переиспользуя уже отправленные сообщения.
+
+        Части отправляются по порядку, по одному запросу на часть; без разметки
+        повторно отправляется только та часть, которую Telegram не принял.
+        """
+        await self.stop()
+        if parse_mode == 'Markdown':
+            parts = split_markdown(text, self.limit)
+        else:
+            parts = split_text(text, self.limit)
+        for i, part in enumerate(parts):
+            markup = reply_markup if i == len(parts) - 1 else None
+            # Заведомо несбалансированную разметку сразу отправляем без неё
+            mode = parse_mode if parse_mode != 'Markdown' or is_balanced(part) else None
+            if i < len(self.messages):
+                try:
+                    await self._edit(i, part, parse_mode=mode, reply_markup=markup)
+                except BadRequest as e:
+                    logger.warning("Не удалось применить разметку, отправляем без неё: %s", e)
+                    await self._edit(i, part, reply_markup=markup)
+            else:
+                try:
+                    new_message = await self.messages[-1].reply_text(part, parse_mode=mode, reply_markup=markup)
+                except BadRequest as e:
+                    logger.warning("Не удалось применить разметку, отправляем без неё: %s", e)
+                    new_message = await self.messages[-1].reply_text(part, reply_markup=markup)
+                self.messages.append(new_message)
+                self._sent.append(part)
+        # Лишние сообщения, оставшиеся от потоковой печати
+        for message in self.messages[len(parts):]:
+            try:
+                await message.delete()
+            except TelegramError:
+                pass
+        del self.messages[len(parts):]
+        del self._sent[len(parts):]
@@ -1,9 +1,13 @@
+from services.fact_checker_service import strip_verdict_tag
+
+
 class ResponseFormatter:
     def format_analysis(self, text: str) -> str:
         return text
 
     def format_fact_check(self, text: str) -> str:
-        return text
+        # Кэш "fact_check" общий с разбором утверждений: метку вердикта пользователю не показываем
+        return strip_verdict_tag(text)
 
     def format_deep_research(self, text: str) -> str:
         """Форматирует результат Deep Research для лучшей читаемости"""
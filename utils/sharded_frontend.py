@@ -0,0 +1,271 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application
+
+from services.update_inbox_service import UpdateInboxService
+from utils.http_server import BotHttpServer
+from utils.logger import setup_logger
+from utils.metrics import REGISTRY
+
+logger = setup_logger(__name__)
+
+# Поля апдейта, в которых Telegram передает объект с отправителем ("from" или "user")
+_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request", "channel_post", "edited_channel_post",
+)
+
+# Лимиты, которые в каждом рабочем процессе делятся на число процессов
+_SHARED_LIMITS = (
+    ("UPSTREAM_RPM", int),
+    ("UPSTREAM_TPM", int),
+    ("UPSTREAM_MAX_CONCURRENT", int),
+    ("TELEGRAM_GLOBAL_RATE", float),
+)
+
+# Точка входа рабочего процесса: (номер, число процессов, очередь апдейтов)
+WorkerTarget = Callable[[int, int, "multiprocessing.Queue"], None]
+
+
+def update_user_id(data: Dict[str, Any]) -> int:
+    """Пользователь, от которого пришел апдейт (или чат, если пользователя нет)"""
+    for name in _UPDATE_FIELDS:
+        item = data.get(name)
+        if not isinstance(item, dict):
+            continue
+        user = item.get("from") or item.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+        chat = item.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+    return int(data.get("update_id", 0))
+
+
+def shard_of(user_id: int, workers: int) -> int:
+    return user_id % workers
+
+
+def worker_environment(index: int, workers: int, config) -> Dict[str, str]:
+    """Переменные окружения рабочего процесса.
+
+    Апдейты получает только основной процесс, поэтому у рабочих нет webhook и
+    HTTP-сервера; общие лимиты API делятся между процессами поровну.
+    """
+    env = {
+        "WORKER_INDEX": str(index),
+        "WORKERS": str(workers),
+        "WEBHOOK_URL": "",
+        "HTTP_SERVER_ENABLED": "false",
+    }
+    for name, kind in _SHARED_LIMITS:
+        value = getattr(config, name)
+        if value:
+            env[name] = str(max(1, value // workers) if kind is int else value / workers)
+    return env
+
+
+class ShardedFrontend:
+    """Основной процесс многопроцессного режима.
+
+    Принимает апдейты (webhook через ``UpdateInboxService`` или long polling) и
+    раздает их рабочим процессам по ``user_id % WORKERS``: все апдейты
+    пользователя обрабатывает один процесс, поэтому его состояние в памяти
+    (``UserService``, ``context.user_data``) не расходится. Рабочие процессы
+    делят баланс и лимиты через общую базу SQLite. Упавший рабочий процесс
+    перезапускается с той же очередью.
+    """
+
+    def __init__(self, config, worker_target: WorkerTarget, workers: int) -> None:
+        self.config = config
+        self.worker_target = worker_target
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List["multiprocessing.Queue"] = [
+            self._context.Queue(maxsize=config.WORKER_QUEUE_SIZE) for _ in range(workers)
+        ]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.routed = [0] * workers
+        self.restarts = 0
+        self._stopping = False
+
+        builder = Application.builder().token(config.TELEGRAM_TOKEN).updater(None)
+        if config.TELEGRAM_BASE_URL:
+            builder = builder.base_url(config.TELEGRAM_BASE_URL)
+        self.application = builder.build()
+        self.webhook_path = config.WEBHOOK_PATH or f"/{config.TELEGRAM_TOKEN}"
+        self.inbox: Optional[UpdateInboxService] = None
+        if config.WEBHOOK_URL:
+            self.inbox = UpdateInboxService.from_config(config)
+            self.inbox.dispatch = self.route
+        self.http_server: Optional[BotHttpServer] = None
+        if config.HTTP_SERVER_ENABLED or config.WEBHOOK_URL:
+            self.http_server = BotHttpServer(
+                self.application,
+                self._readiness,
+                host=config.HTTP_SERVER_HOST,
+                port=config.PORT,
+                webhook_path=self.webhook_path if config.WEBHOOK_URL else None,
+                webhook_secret=config.WEBHOOK_SECRET,
+                inbox=self.inbox,
+            )
+        self._register_metrics()
+
+    def _register_metrics(self) -> None:
+        REGISTRY.gauge("bot_workers_alive", "Работающие рабочие процессы",
+                       collect=lambda: [({}, self.alive)])
+        REGISTRY.counter("bot_worker_restarts_total", "Перезапуски упавших рабочих процессов",
+                         collect=lambda: [({}, self.restarts)])
+        REGISTRY.counter("bot_worker_updates_total", "Апдейты, переданные рабочему процессу", ("worker",),
+                         collect=lambda: [({"worker": str(i)}, n) for i, n in enumerate(self.routed)])
+        REGISTRY.gauge("bot_worker_queue_depth", "Апдейты в очереди рабочего процесса", ("worker",),
+                       collect=lambda: [({"worker": str(i)}, self._qsize(q)) for i, q in enumerate(self._queues)])
+
+    @staticmethod
+    def _qsize(q: "multiprocessing.Queue") -> int:
+        try:
+            return q.qsize()
+        except NotImplementedError:
+            return 0
+
+    @property
+    def alive(self) -> int:
+        return sum(1 for p in self._processes if p is not None and p.is_alive())
+
+    def _readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        alive = self.alive
+        return alive == self.workers, {"workers": self.workers, "workers_alive": alive}
+
+    # --- Рабочие процессы ---
+
+    def _spawn(self, index: int) -> None:
+        # Дочерний процесс (spawn) получает копию окружения на момент запуска
+        env = worker_environment(index, self.workers, self.config)
+        saved = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+        try:
+            process = self._context.Process(
+                target=self.worker_target,
+                args=(index, self.workers, self._queues[index]),
+                name=f"bot-worker-{index}",
+            )
+            process.start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        self._processes[index] = process
+        logger.info("Рабочий процесс %s запущен (pid %s)", index, process.pid)
+
+    async def _supervise(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(1.0)
+            for index, process in enumerate(self._processes):
+                if self._stopping:
+                    return
+                if process is not None and not process.is_alive():
+                    logger.error("Рабочий процесс %s завершился (код %s), перезапускаем", index, process.exitcode)
+                    self.restarts += 1
+                    self._spawn(index)
+
+    async def _stop_workers(self, timeout: float) -> None:
+        self._stopping = True
+        for q in self._queues:
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Рабочий процесс %s не остановился, завершаем принудительно", index)
+                process.terminate()
+                await asyncio.to_thread(process.join, 5.0)
+
+    # --- Маршрутизация ---
+
+    async def route(self, data: Dict[str, Any]) -> None:
+        """Передает апдейт рабочему процессу пользователя"""
+        index = shard_of(update_user_id(data), self.workers)
+        q = self._queues[index]
+        try:
+            q.put_nowait(data)
+        except queue.Full:
+            # Рабочий процесс не успевает: ждем места, не блокируя цикл событий
+            await asyncio.to_thread(q.put, data)
+        self.routed[index] += 1
+
+    async def _poll(self, stop: asyncio.Event) -> None:
+        bot = self.application.bot
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        while not stop.is_set():
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=10, read_timeout=15, allowed_updates=Update.ALL_TYPES
+                )
+            except TelegramError as e:
+                logger.warning("Ошибка получения апдейтов: %s", e)
+                await asyncio.sleep(1.0)
+                continue
+            for update in updates:
+                await self.route(update.to_dict())
+                offset = update.update_id + 1
+
+    # --- Запуск ---
+
+    def run(self) -> None:
+        asyncio.run(self._run())
+
+    async def _run(self) -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+
+        for index in range(self.workers):
+            self._spawn(index)
+        tasks = [asyncio.create_task(self._supervise())]
+        await self.application.initialize()
+        try:
+            if self.inbox is not None:
+                await self.inbox.start()
+            if self.http_server is not None:
+                await self.http_server.start()
+            if self.config.WEBHOOK_URL:
+                await self.application.bot.set_webhook(
+                    url=self.config.WEBHOOK_URL + self.webhook_path,
+                    secret_token=self.http_server.webhook_secret,
+                    drop_pending_updates=False,
+                )
+            else:
+                tasks.append(asyncio.create_task(self._poll(stop)))
+            logger.info("Основной процесс запущен: рабочих процессов %s", self.workers)
+            await stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.http_server is not None:
+                await self.http_server.stop()
+            if self.inbox is not None:
+                await self.inbox.stop()
+            await self._stop_workers(self.config.WORKER_STOP_TIMEOUT)
+            await self.application.shutdown()
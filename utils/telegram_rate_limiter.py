@@ -0,0 +1,252 @@
+import asyncio
+import time
+from typing import Any, Callable, Coroutine, Dict, Hashable, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from services.upstream_scheduler import TokenBucket
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Методы, на которые распространяются лимиты Telegram на сообщения
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+# Правки, из которых достаточно отправить последнюю
+_COALESCED_ENDPOINTS = frozenset({"editMessageText", "editMessageCaption", "editMessageReplyMarkup"})
+
+
+class _Reissue(Exception):
+    """Отправитель правки отменён до её отправки — ожидающие повторяют запрос сами"""
+
+
+class _PendingEdit:
+    """Правка сообщения, ожидающая отправки; более новая правка заменяет вызов"""
+
+    __slots__ = ("callback", "args", "kwargs", "followers", "future")
+
+    def __init__(self, callback: Callable, args: Any, kwargs: Dict[str, Any]) -> None:
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.followers = 0
+        self.future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+
+
+class _ChatState:
+    __slots__ = ("lock", "bucket", "paused_until", "waiters", "last_used")
+
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.lock = asyncio.Lock()
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.waiters = 0
+        self.last_used = time.monotonic()
+
+
+class TelegramRateLimiter(BaseRateLimiter[None]):
+    """Планировщик исходящих запросов к Telegram Bot API.
+
+    Сообщения и правки проходят через общую корзину токенов (лимит бота) и
+    корзину своего чата (отдельный лимит для групп). Запросы одного чата
+    отправляются строго по очереди. Если правка того же сообщения ещё ждёт
+    отправки, новая правка занимает её место, и все ожидающие получают результат
+    последней. При ``RetryAfter`` чат приостанавливается на указанное время и
+    запрос повторяется.
+    """
+
+    def __init__(
+        self,
+        global_per_second: float = 30.0,
+        chat_per_second: float = 1.0,
+        group_per_minute: float = 20.0,
+        chat_burst: int = 3,
+        max_retries: int = 3,
+        idle_chat_ttl: float = 300.0,
+    ) -> None:
+        self.global_per_second = global_per_second
+        self.chat_per_second = chat_per_second
+        self.group_per_minute = group_per_minute
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.idle_chat_ttl = idle_chat_ttl
+        self._global = TokenBucket(global_per_second * 60, capacity=global_per_second)
+        self._global_lock = asyncio.Lock()
+        self._chats: Dict[Hashable, _ChatState] = {}
+        self._pending_edits: Dict[Tuple[Hashable, Any], _PendingEdit] = {}
+        self._last_sweep = time.monotonic()
+        # Метрики
+        self.queued = 0
+        self.inflight = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retry_after_count = 0
+        self.max_wait = 0.0
+
+    @classmethod
+    def from_config(cls, config) -> "TelegramRateLimiter":
+        return cls(
+            global_per_second=config.TELEGRAM_GLOBAL_RATE,
+            chat_per_second=config.TELEGRAM_CHAT_RATE,
+            group_per_minute=config.TELEGRAM_GROUP_RATE_PER_MINUTE,
+            max_retries=config.TELEGRAM_MAX_RETRIES,
+        )
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._chats.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, запросы в работе и счётчики"""
+        return {
+            "queued": self.queued,
+            "inflight": self.inflight,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retry_after": self.retry_after_count,
+            "max_wait": self.max_wait,
+            "chats": len(self._chats),
+            "pending_edits": len(self._pending_edits),
+        }
+
+    # --- Очередь чата ---
+
+    def _chat(self, chat_id: Hashable) -> _ChatState:
+        state = self._chats.get(chat_id)
+        if state is None:
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            per_minute = self.group_per_minute if is_group else self.chat_per_second * 60
+            state = self._chats[chat_id] = _ChatState(TokenBucket(per_minute, capacity=self.chat_burst))
+        return state
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < self.idle_chat_ttl:
+            return
+        self._last_sweep = now
+        for chat_id in [c for c, s in self._chats.items() if not s.waiters and now - s.last_used > self.idle_chat_ttl]:
+            del self._chats[chat_id]
+
+    @staticmethod
+    async def _wait_for(bucket: TokenBucket) -> None:
+        delay = bucket.wait_time(1)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = bucket.wait_time(1)
+        bucket.take(1)
+
+    async def _acquire(self, state: _ChatState) -> None:
+        while True:
+            pause = state.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            await self._wait_for(state.bucket)
+            break
+        async with self._global_lock:
+            await self._wait_for(self._global)
+
+    # --- Обработка запросов ---
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[None],
+    ) -> Any:
+        chat_id = data.get("chat_id")
+        if chat_id is None or not endpoint.startswith(_LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+        if endpoint not in _COALESCED_ENDPOINTS or data.get("message_id") is None:
+            return await self._send(chat_id, callback, args, kwargs, endpoint)
+
+        key = (chat_id, data["message_id"], endpoint)
+        while True:
+            pending = self._pending_edits.get(key)
+            if pending is None:
+                break
+            # Предыдущая правка ещё не отправлена — отправим только последнюю
+            pending.callback, pending.args, pending.kwargs = callback, args, kwargs
+            pending.followers += 1
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending.future)
+            except _Reissue:
+                continue
+
+        pending = self._pending_edits[key] = _PendingEdit(callback, args, kwargs)
+
+        def take_latest() -> Tuple[Callable, Any, Dict[str, Any]]:
+            # С этого момента новые правки встают в очередь заново
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+            return pending.callback, pending.args, pending.kwargs
+
+        try:
+            result = await self._send(chat_id, None, None, None, endpoint, take_latest)
+        except BaseException as e:
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+            if pending.followers:
+                pending.future.set_exception(_Reissue() if isinstance(e, asyncio.CancelledError) else e)
+            else:
+                pending.future.cancel()
+            raise
+        pending.future.set_result(result)
+        return result
+
+    async def _send(
+        self,
+        chat_id: Hashable,
+        callback: Optional[Callable],
+        args: Any,
+        kwargs: Optional[Dict[str, Any]],
+        endpoint: str,
+        take_latest: Optional[Callable[[], Tuple[Callable, Any, Dict[str, Any]]]] = None,
+    ) -> Any:
+        now = time.monotonic()
+        self._sweep(now)
+        state = self._chat(chat_id)
+        state.waiters += 1
+        self.queued += 1
+        queued = True
+        try:
+            async with state.lock:
+                self.queued -= 1
+                queued = False
+                await self._acquire(state)
+                # Правку выбираем после ожидания корзины: пришедшие за это время заменяют ее
+                if take_latest is not None:
+                    callback, args, kwargs = take_latest()
+                self.max_wait = max(self.max_wait, time.monotonic() - now)
+                return await self._call(state, callback, args, kwargs, endpoint)
+        finally:
+            if queued:
+                self.queued -= 1
+            state.waiters -= 1
+            state.last_used = time.monotonic()
+
+    async def _call(self, state: _ChatState, callback: Callable, args: Any, kwargs: Dict[str, Any], endpoint: str) -> Any:
+        for attempt in range(self.max_retries + 1):
+            self.inflight += 1
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = float(e.retry_after)
+                self.retry_after_count += 1
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning("Telegram просит подождать %.0f с перед %s", retry_after, endpoint)
+                state.paused_until = time.monotonic() + retry_after
+                await self._acquire(state)
+                continue
+            finally:
+                self.inflight -= 1
+            self.sent += 1
+            return result
+        raise AssertionError("unreachable")
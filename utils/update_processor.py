@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных пользователей.
+
+    Апдейты одного пользователя обрабатываются строго по очереди (в порядке
+    поступления), поэтому флаги в ``context.user_data`` не гоняются. Общее число
+    одновременно выполняемых обработчиков ограничено ``max_concurrent_updates``.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = 10_000) -> None:
+        # Семафор базового класса захватывается ДО пользовательской блокировки,
+        # поэтому он ограничивает только число принятых апдейтов. Реальный лимит
+        # параллельной работы применяется после получения блокировки пользователя,
+        # чтобы очередь одного пользователя не занимала слоты остальных.
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        self.concurrency_limit = max_concurrent_updates
+        self._running = asyncio.Semaphore(max_concurrent_updates)
+        # ключ пользователя -> [блокировка, число ожидающих/выполняемых апдейтов]
+        self._user_locks: Dict[Hashable, List[Any]] = {}
+        self.active_updates = 0
+
+    @staticmethod
+    def _serialization_key(update: object) -> Optional[Hashable]:
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return ("user", update.effective_user.id)
+            if update.effective_chat is not None:
+                return ("chat", update.effective_chat.id)
+        return None
+
+    @property
+    def pending_users(self) -> int:
+        """Число пользователей, у которых есть необработанные апдейты"""
+        return len(self._user_locks)
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        async with self._running:
+            self.active_updates += 1
+            try:
+                await coroutine
+            finally:
+                self.active_updates -= 1
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._serialization_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._user_locks.pop(key, None)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass